@@ -0,0 +1,107 @@
+# Throughput of the availability endpoint for one worker: WSGI (sync view) vs ASGI (async view), against the local fake google in fake_google.py.
+# It seeds a throwaway test database with one service and --stylists connected stylists, then sends --requests availability requests:
+#   - WSGI: one sync worker handles one request at a time, so requests queue up behind each other's google calls
+#   - ASGI: the async view runs on one event loop, so all the requests wait on google at the same time
+#
+# Run from the project root: python benchmarks/bench_availability.py --stylists 6 --requests 30 --latency 0.2
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_google import start_fake_google  # noqa: E402
+
+
+def seed(stylist_count):
+    """ Create a service with stylist_count stylists who all have a valid google token. Returns the service."""
+    from datetime import timedelta
+    from django.utils import timezone
+    from tressreliefapi.models import Category, Service, StylistService, UserInfo, OAuthCredential
+
+    category = Category.objects.create(
+        name="Braids", description="bench", image_url="")
+    service = Service.objects.create(
+        name="Knotless", category=category, duration=120, price=200)
+    for i in range(stylist_count):
+        stylist = UserInfo.objects.create(
+            uid=f"bench-stylist-{i}", display_name=f"Stylist {i}", role="stylist")
+        StylistService.objects.create(stylist=stylist, service=service)
+        OAuthCredential.objects.create(
+            user=stylist, refresh_token="fake-refresh", access_token="fake-access-token",
+            token_expiry=timezone.now() + timedelta(hours=1))
+    return service
+
+
+def bench_wsgi(url, request_count):
+    from django.test import Client
+    client = Client()
+    started = time.perf_counter()
+    for _ in range(request_count):
+        response = client.get(url)
+        assert response.status_code == 200, response.content
+    return time.perf_counter() - started
+
+
+def bench_asgi(url, request_count):
+    from django.test import AsyncClient
+
+    async def run():
+        client = AsyncClient()
+        responses = await asyncio.gather(*(client.get(url) for _ in range(request_count)))
+        for response in responses:
+            assert response.status_code == 200, response.content
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stylists", type=int, default=6)
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="seconds the fake google waits before answering")
+    parser.add_argument("--date", default="2025-10-01")
+    args = parser.parse_args()
+
+    fake = start_fake_google(latency=args.latency)
+    os.environ["GOOGLE_API_BASE_URL"] = f"{fake.base_url}/calendar/v3"
+    os.environ["GOOGLE_TOKEN_URL"] = f"{fake.base_url}/token"
+    # measure the google-bound path, not the busy cache
+    os.environ.setdefault("BUSY_CACHE_TTL_SEC", "0")
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                          "tressreliefproject.settings")
+
+    import django
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+    try:
+        service = seed(args.stylists)
+        print(f"{args.stylists} stylists, {args.requests} requests, {args.latency}s fake google latency")
+        for name, path, bench in (
+            ("WSGI (sync view)", f"/services/{service.id}/availability/", bench_wsgi),
+            ("ASGI (async view)", f"/services/{service.id}/availability/async/", bench_asgi),
+        ):
+            fake.calls.clear()
+            elapsed = bench(f"{path}?date={args.date}", args.requests)
+            print(f"{name:<18} {elapsed:7.2f}s  {args.requests / elapsed:7.1f} req/s  google calls: {dict(fake.calls)}")
+    finally:
+        connection.creation.destroy_test_db(
+            connection.settings_dict["NAME"], verbosity=0)
+        fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Slot generation speed: the python engine (utils/availability.py) vs the numpy engine (utils/availability_np.py),
+# for a multi-day, multi-stylist query. Both run through utils/slot_engine.py, so both make the same thing the endpoint sends:
+# "slots" is busy intervals to [start, end] ISO string pairs, "slots + JSON" adds encoding the response. No database or google needed.
+#
+# Run from the project root: python benchmarks/bench_slot_engine.py --days 31 --stylists 12 --duration 60
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tressreliefproject.settings")
+
+
+def random_jobs(days, stylists, seed=0):
+    """ (date, busy_intervals) for every stylist-day, with a few random busy blocks in working hours."""
+    from tressreliefapi.utils.availability import working_hours
+    rng = random.Random(seed)
+    jobs = []
+    first_day = date(2025, 10, 1)
+    for day in range(days):
+        for _ in range(stylists):
+            job_date = first_day + timedelta(days=day)
+            day_start, _ = working_hours(job_date)
+            busy = []
+            for _ in range(rng.randrange(0, 4)):
+                start = day_start + timedelta(minutes=rng.randrange(0, 8 * 60, 15))
+                busy.append((start, start + timedelta(minutes=rng.choice((30, 60, 90)))))
+            jobs.append((job_date, busy))
+    return jobs
+
+
+def best_of(runs, fn):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--stylists", type=int, default=12)
+    parser.add_argument("--duration", type=int, default=60,
+                        help="service duration in minutes")
+    parser.add_argument("--granularity", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    from django.test import override_settings
+    from tressreliefapi.utils.slot_engine import slots_by_day
+
+    jobs = random_jobs(args.days, args.stylists)
+    dates = sorted({job_date for job_date, _ in jobs})
+    # one {date: busy} dict per stylist, like the views pass them
+    busy_by_days = [{job_date: busy for job_date, busy in jobs[stylist::args.stylists]} for stylist in range(args.stylists)]
+
+    def engine_slots(engine):
+        with override_settings(AVAILABILITY_SLOT_ENGINE=engine):
+            return slots_by_day(args.duration, dates, busy_by_days, args.granularity)
+
+    python_time, python_result = best_of(args.runs, lambda: engine_slots("python"))
+    numpy_time, numpy_result = best_of(args.runs, lambda: engine_slots("numpy"))
+    def engine_json(engine):
+        # the response has a list of stylists per day, not dicts keyed by date
+        return json.dumps([list(by_day.values()) for by_day in engine_slots(engine)])
+
+    python_json_time, python_json = best_of(args.runs, lambda: engine_json("python"))
+    numpy_json_time, numpy_json = best_of(args.runs, lambda: engine_json("numpy"))
+    assert python_result == numpy_result and python_json == numpy_json, "engines disagree"
+    slot_count = sum(len(slots) for by_day in numpy_result for slots in by_day.values())
+    print(f"{args.days} days x {args.stylists} stylists, {slot_count} slots")
+    print(f"{'':<14} {'slots':>10} {'slots + JSON':>14}")
+    print(f"{'python engine':<14} {python_time * 1000:7.1f} ms {python_json_time * 1000:11.1f} ms")
+    print(f"{'numpy engine':<14} {numpy_time * 1000:7.1f} ms {numpy_json_time * 1000:11.1f} ms")
+    print(f"{'speedup':<14} {python_time / numpy_time:8.1f}x {python_json_time / numpy_json_time:12.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# A tiny local stand-in for the google endpoints the server talks to, so the availability views can be benchmarked (and poked at) without real google accounts.
+# Every response is delayed by `latency` seconds to act like a slow round trip to google.
+#
+# Point the server at it with:
+#   GOOGLE_API_BASE_URL=http://127.0.0.1:<port>/calendar/v3
+#   GOOGLE_TOKEN_URL=http://127.0.0.1:<port>/token
+#
+# Run standalone: python benchmarks/fake_google.py --port 8765 --latency 0.2
+#
+# It also fakes one calendar's events with sync tokens and push channels (utils/calendar_sync.py):
+# put_event() / cancel_event() change the calendar and send a notification to every open channel, like google does.
+# Notifications are POSTed to the channel's address, or handed to server.notify if you replace it (e.g. with the django test client).
+# FreeBusy answers for the calendars in other_calendars too (fill it in to fake a stylist's personal calendar).
+# Batch requests (GOOGLE_BATCH_URL=http://127.0.0.1:<port>/batch/calendar/v3) can insert, patch and delete events on it (utils/calendar_outbox.py).
+
+import argparse
+import email.parser
+import json
+import threading
+import time
+import urllib.request
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def busy_hours(time_min, time_max):
+    """ One busy hour (17:00-18:00 UTC, around lunch in Chicago) on every day from time_min to time_max."""
+    day = date.fromisoformat(time_min[:10])
+    last_day = date.fromisoformat(time_max[:10])
+    busy = []
+    while day <= last_day:
+        busy.append({"start": f"{day}T17:00:00Z", "end": f"{day}T18:00:00Z"})
+        day += timedelta(days=1)
+    return busy
+
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    # keep-alive, so clients that pool connections can reuse them
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # keep benchmark output quiet
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self._read_body()
+        time.sleep(self.server.latency)
+        if self.path == "/token":
+            self.server.count("token")
+            self._send_json({"access_token": "fake-access-token",
+                            "expires_in": 3600, "token_type": "Bearer"})
+        elif self.path == "/calendar/v3/freeBusy":
+            self.server.count("freebusy")
+            query = json.loads(body or b"{}")
+            self._send_json({"calendars": {item["id"]: self.server.freebusy(item["id"], query.get("timeMin", ""), query.get("timeMax", ""))
+                                           for item in query.get("items", [])}})
+        elif self.path.startswith("/calendar/v3/calendars/") and self.path.endswith("/events/watch"):
+            self.server.count("watch")
+            self._send_json(self.server.open_channel(json.loads(body or b"{}")))
+        elif self.path == "/batch/calendar/v3":
+            self.server.count("batch")
+            self._send_batch(body)
+        elif self.path == "/calendar/v3/channels/stop":
+            self.server.count("stop")
+            self.server.channels.pop(json.loads(body or b"{}").get("id"), None)
+            self._send_json({})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _send_batch(self, body):
+        """ Answer a multipart/mixed batch request, running each call in it against the fake calendar."""
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode() + body)
+        boundary = "batch_fake_response"
+        parts = []
+        for part in message.get_payload():
+            request_line, _, rest = part.get_payload().lstrip().partition("\n")
+            method, path = request_line.split()[:2]
+            call_body = rest.replace("\r\n", "\n").partition("\n\n")[2].strip()
+            self.server.count("batch_calls")
+            status, payload = self.server.event_call(method, path, json.loads(call_body) if call_body else None)
+            data = json.dumps(payload) if payload is not None else ""
+            parts.append(f"--{boundary}\r\nContent-Type: application/http\r\n"
+                         f"Content-ID: <response-{part.get('Content-ID', '').strip('<>')}>\r\n\r\n"
+                         f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n\r\n{data}\r\n")
+        data = ("".join(parts) + f"--{boundary}--\r\n").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/mixed; boundary={boundary}")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlsplit(self.path)
+        if url.path.startswith("/calendar/v3/calendars/") and url.path.endswith("/events"):
+            self.server.count("events")
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            page = self.server.list_events(query)
+            if page is None:
+                self._send_json({"error": {"code": 410, "message": "Sync token is no longer valid."}}, status=410)
+            else:
+                self._send_json(page)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+
+class FakeGoogleServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the async client opens a lot of connections at once, the default listen backlog of 5 is too small
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0.0):
+        super().__init__(address, FakeGoogleHandler)
+        self.latency = latency
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+        # the fake calendar: event id -> event (with "_seq", the change number it was last touched at)
+        self.events = {}
+        self.seq = 0
+        # sync tokens from before this change number get a 410, see expire_sync_tokens()
+        self.oldest_sync_seq = 0
+        self._events_lock = threading.Lock()
+        self.channels = {}
+        self.notify = self.post_notification
+        # more calendars for FreeBusy: calendar id -> [{"start", "end"}]. any other id than these and "primary" is "notFound"
+        self.other_calendars = {}
+
+    def count(self, name):
+        with self._calls_lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def put_event(self, event_id, start, end, **fields):
+        """ Add or change an event (start/end are RFC 3339 strings) and notify the open channels."""
+        self._change(event_id, {"id": event_id, "status": "confirmed",
+                                "start": {"dateTime": start}, "end": {"dateTime": end}, **fields})
+
+    def cancel_event(self, event_id):
+        self._change(event_id, {"id": event_id, "status": "cancelled"})
+
+    def event_call(self, method, path, body):
+        """ (status, response body) of one events insert (POST .../events), patch or delete (.../events/<id>) from a batch request."""
+        event_id = path.rsplit("/events", 1)[1].strip("/") or (body or {}).get("id", "")
+        with self._events_lock:
+            existing = self.events.get(event_id)
+        live = existing is not None and existing["status"] != "cancelled"
+        if method == "POST":
+            if live:
+                return 409, {"error": {"code": 409, "message": "The requested identifier already exists."}}
+            self.put_event(event_id, body["start"]["dateTime"], body["end"]["dateTime"],
+                           **{key: value for key, value in body.items() if key not in ("id", "start", "end")})
+            return 200, {**body, "status": "confirmed"}
+        if not live:
+            return (410 if existing is not None else 404), {"error": {"code": 404, "message": "Not Found"}}
+        if method == "DELETE":
+            self.cancel_event(event_id)
+            return 204, None
+        event = {key: value for key, value in existing.items() if key != "_seq"}
+        self._change(event_id, {**event, **body})
+        return 200, {**event, **body}
+
+    def expire_sync_tokens(self):
+        """ Make every sync token handed out so far invalid (google does this now and then), so the next sync has to start over."""
+        with self._events_lock:
+            self.oldest_sync_seq = self.seq
+
+    def _change(self, event_id, event):
+        with self._events_lock:
+            self.seq += 1
+            self.events[event_id] = {**event, "_seq": self.seq}
+            message_number = self.seq
+        for channel in list(self.channels.values()):
+            self.notify(channel, "exists", message_number)
+
+    def freebusy(self, calendar_id, time_min, time_max):
+        """ One calendar's entry in a FreeBusy answer. "primary" has the lunch hours and the fake calendar's events."""
+        if calendar_id == "primary":
+            return {"busy": busy_hours(time_min, time_max) + self.busy_events(time_min, time_max)}
+        if calendar_id not in self.other_calendars:
+            return {"errors": [{"domain": "global", "reason": "notFound"}], "busy": []}
+        return {"busy": [busy for busy in self.other_calendars[calendar_id]
+                         if busy["start"] < time_max and busy["end"] > time_min]}
+
+    def busy_events(self, time_min, time_max):
+        with self._events_lock:
+            return [{"start": event["start"]["dateTime"], "end": event["end"]["dateTime"]}
+                    for event in self.events.values()
+                    if event["status"] != "cancelled" and event["start"]["dateTime"] < time_max and event["end"]["dateTime"] > time_min]
+
+    def list_events(self, query):
+        """ One page of events.list: the changes since syncToken (cancelled ones too), or every live event. None means 410."""
+        with self._events_lock:
+            if "syncToken" in query:
+                since = int(query["syncToken"].removeprefix("seq-"))
+                if since < self.oldest_sync_seq:
+                    return None
+                events = [event for event in self.events.values() if event["_seq"] > since]
+            else:
+                events = [event for event in self.events.values() if event["status"] != "cancelled"
+                          and event["end"]["dateTime"] >= query.get("timeMin", "")]
+            seq = self.seq
+        offset = int(query.get("pageToken") or 0)
+        page_size = int(query.get("maxResults") or 250)
+        items = [{key: value for key, value in event.items() if key != "_seq"}
+                 for event in events[offset:offset + page_size]]
+        if offset + page_size < len(events):
+            return {"items": items, "nextPageToken": str(offset + page_size)}
+        return {"items": items, "nextSyncToken": f"seq-{seq}"}
+
+    def open_channel(self, request):
+        ttl = int(request.get("params", {}).get("ttl", 604800))
+        channel = {
+            "id": request["id"],
+            "token": request.get("token", ""),
+            "address": request["address"],
+            "resourceId": "fake-resource-primary",
+            "expiration": str(int((time.time() + ttl) * 1000)),
+        }
+        self.channels[channel["id"]] = channel
+        # google confirms every new channel with a "sync" message. after the response, like google
+        threading.Timer(0.05, self.notify, (channel, "sync", 0)).start()
+        return {key: channel[key] for key in ("id", "resourceId", "expiration")}
+
+    @staticmethod
+    def notification_headers(channel, state, message_number):
+        return {
+            "X-Goog-Channel-ID": channel["id"],
+            "X-Goog-Channel-Token": channel["token"],
+            "X-Goog-Resource-ID": channel["resourceId"],
+            "X-Goog-Resource-State": state,
+            "X-Goog-Message-Number": str(message_number),
+        }
+
+    def post_notification(self, channel, state, message_number):
+        request = urllib.request.Request(channel["address"], data=b"", method="POST",
+                                         headers=self.notification_headers(channel, state, message_number))
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except OSError:
+            pass  # google just retries later, we don't bother
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_fake_google(latency=0.0, port=0):
+    """ Start the fake google server on a background thread and return it. port=0 picks a free port."""
+    server = FakeGoogleServer(("127.0.0.1", port), latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+    server = FakeGoogleServer(("127.0.0.1", args.port), latency=args.latency)
+    print(f"fake google listening on {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,43 @@
+# Precompute availability for the next N days into the AvailabilitySnapshot table, so GET /services/<id>/availability/?source=snapshot
+# is a db read instead of a round of google calls. Run it from cron more often than AVAILABILITY_SNAPSHOT_MAX_AGE_SEC, or leave it running with --loop:
+#   python manage.py build_availability_snapshots --days 14 --loop --interval 300
+
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tressreliefapi.models import Service
+from tressreliefapi.utils.availability_snapshot import build_snapshots, delete_past_snapshots
+from tressreliefapi.utils.next_available import salon_today
+
+
+class Command(BaseCommand):
+    help = "Precompute availability snapshots for the next N days."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.AVAILABILITY_SNAPSHOT_DAYS,
+                            help="how many days from today (salon time) to precompute")
+        parser.add_argument("--service-id", type=int, action="append", dest="service_ids",
+                            help="only this service (can be given more than once). default: every service")
+        parser.add_argument("--loop", action="store_true",
+                            help="keep running, rebuilding every --interval seconds")
+        parser.add_argument("--interval", type=int, default=300,
+                            help="seconds between builds when running with --loop")
+
+    def handle(self, *args, **options):
+        services = None
+        if options["service_ids"]:
+            services = list(Service.objects.filter(id__in=options["service_ids"]))
+        while True:
+            today = salon_today()
+            dates = [today + timedelta(days=i) for i in range(options["days"])]
+            started = time.monotonic()
+            written, skipped = build_snapshots(dates, services)
+            deleted = delete_past_snapshots(today)
+            message = (f"Wrote {written} snapshot row(s) for {dates[0]} to {dates[-1]} in {time.monotonic() - started:.1f}s, "
+                       f"skipped {skipped} stylist(s), deleted {deleted} past row(s).")
+            self.stdout.write(self.style.WARNING(message)
+                              if skipped else self.style.SUCCESS(message))
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,37 @@
+# Send the queued appointment writes (CalendarOutbox) to the stylists' google calendars, see tressreliefapi/utils/calendar_outbox.py.
+# Run it from cron, or leave it running with --loop:
+#   python manage.py drain_calendar_outbox --batch-size 500 --workers 8 --loop --interval 5
+
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tressreliefapi.utils.calendar_outbox import drain_outbox
+
+
+class Command(BaseCommand):
+    help = "Write queued appointment changes to the stylists' google calendars."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500,
+                            help="how many outbox rows to claim at a time")
+        parser.add_argument("--workers", type=int, default=settings.AVAILABILITY_MAX_WORKERS,
+                            help="how many stylists' batch requests run at the same time")
+        parser.add_argument("--loop", action="store_true",
+                            help="keep running, checking for new rows every --interval seconds")
+        parser.add_argument("--interval", type=float, default=5,
+                            help="seconds to wait when there was nothing to send, with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            counts = drain_outbox(options["batch_size"], options["workers"])
+            sent = sum(counts.values())
+            if sent or not options["loop"]:
+                message = (f"Wrote {counts['done']} appointment change(s), {counts['retry']} to retry, "
+                           f"{counts['failed']} failed, {counts['skipped']} skipped (no google calendar).")
+                self.stdout.write(self.style.WARNING(message)
+                                  if counts["failed"] or counts["retry"] else self.style.SUCCESS(message))
+            if not options["loop"]:
+                return
+            if sent < options["batch_size"]:
+                # caught up. when a full batch went out there's probably more waiting, so go again right away
+                time.sleep(options["interval"])
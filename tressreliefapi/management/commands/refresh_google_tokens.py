@@ -0,0 +1,72 @@
+# Refresh stylists' google access tokens before they expire, so the availability request path (get_valid_access_token) almost never has to wait on a refresh itself.
+# Run it once from cron, or leave it running with --loop:
+#   python manage.py refresh_google_tokens --window-minutes 10 --loop --interval 60
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from tressreliefapi.models import OAuthCredential
+from tressreliefapi.utils.google_utils import refresh_access_token
+
+
+def _refresh(credential, window):
+    """ Refresh one credential on a worker thread. Returns True if it now has a token valid for the whole window."""
+    try:
+        return refresh_access_token(credential, min_valid=window) is not None
+    finally:
+        connection.close()  # each worker thread has its own db connection
+
+
+class Command(BaseCommand):
+    help = "Refresh google access tokens that expire within the refresh window."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window-minutes", type=int, default=settings.GOOGLE_TOKEN_REFRESH_WINDOW_MIN,
+                            help="refresh tokens that expire within this many minutes")
+        parser.add_argument("--batch-size", type=int, default=100,
+                            help="how many credentials to load and refresh at a time")
+        parser.add_argument("--workers", type=int, default=settings.AVAILABILITY_MAX_WORKERS,
+                            help="how many refreshes run at the same time")
+        parser.add_argument("--loop", action="store_true",
+                            help="keep running, scanning again every --interval seconds")
+        parser.add_argument("--interval", type=int, default=60,
+                            help="seconds between scans when running with --loop")
+
+    def handle(self, *args, **options):
+        window = timedelta(minutes=options["window_minutes"])
+        while True:
+            refreshed, failed = self.refresh_expiring(
+                window, options["batch_size"], options["workers"])
+            message = f"Refreshed {refreshed} token(s), {failed} failed."
+            self.stdout.write(self.style.WARNING(message)
+                              if failed else self.style.SUCCESS(message))
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
+
+    def refresh_expiring(self, window, batch_size, workers):
+        """ Refresh every google credential whose token is missing or expires within the window.
+        Returns (refreshed, failed) counts."""
+        expiring_ids = list(
+            OAuthCredential.objects
+            .filter(provider="google")
+            .filter(Q(token_expiry__isnull=True) | Q(token_expiry__lte=timezone.now() + window))
+            .order_by("token_expiry")  # soonest to expire first
+            .values_list("id", flat=True)
+        )
+        refreshed = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for i in range(0, len(expiring_ids), batch_size):
+                batch = list(OAuthCredential.objects.filter(
+                    id__in=expiring_ids[i:i + batch_size]))
+                for ok in executor.map(lambda credential: _refresh(credential, window), batch):
+                    if ok:
+                        refreshed += 1
+                    else:
+                        failed += 1
+        return refreshed, failed
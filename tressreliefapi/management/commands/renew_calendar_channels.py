@@ -0,0 +1,39 @@
+# Open google push channels for connected calendars that don't have one yet, and replace the ones about to expire,
+# so their busy times keep coming from the local mirror (see tressreliefapi/utils/calendar_sync.py). Run it from cron, or leave it running with --loop:
+#   python manage.py renew_calendar_channels --window-hours 24 --loop --interval 3600
+
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from tressreliefapi.utils.calendar_sync import credentials_to_watch, watch_calendar
+
+
+class Command(BaseCommand):
+    help = "Open or renew google calendar push channels that are missing or expire within the window."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window-hours", type=int, default=24,
+                            help="renew channels that expire within this many hours")
+        parser.add_argument("--loop", action="store_true",
+                            help="keep running, checking again every --interval seconds")
+        parser.add_argument("--interval", type=int, default=3600,
+                            help="seconds between checks when running with --loop")
+
+    def handle(self, *args, **options):
+        if not settings.GOOGLE_WEBHOOK_URL:
+            raise CommandError("GOOGLE_WEBHOOK_URL isn't set, google has nowhere to send notifications.")
+        window = timedelta(hours=options["window_hours"])
+        while True:
+            renewed = failed = 0
+            for credential in credentials_to_watch(window):
+                if watch_calendar(credential) is None:
+                    failed += 1
+                else:
+                    renewed += 1
+            message = f"Opened {renewed} channel(s), {failed} failed."
+            self.stdout.write(self.style.WARNING(message)
+                              if failed else self.style.SUCCESS(message))
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tressreliefapi', '0005_oauthcredential_oauthcredential_unique_user_provider'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilitySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('slots', models.JSONField(default=list)),
+                ('intervals', models.JSONField(default=list)),
+                ('computed_at', models.DateTimeField()),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tressreliefapi.service')),
+                ('stylist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tressreliefapi.userinfo')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='availabilitysnapshot',
+            constraint=models.UniqueConstraint(fields=('service', 'date', 'stylist'), name='unique_availability_snapshot'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tressreliefapi', '0006_availabilitysnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarSync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_id', models.CharField(blank=True, max_length=64, null=True, unique=True)),
+                ('channel_token', models.CharField(blank=True, max_length=64)),
+                ('resource_id', models.CharField(blank=True, max_length=255)),
+                ('channel_expiration', models.DateTimeField(blank=True, null=True)),
+                ('sync_token', models.TextField(blank=True, null=True)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+                ('credential', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_sync', to='tressreliefapi.oauthcredential')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BusyEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=1024)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('credential', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='busy_events', to='tressreliefapi.oauthcredential')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['credential', 'start'], name='busy_event_credential_start')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='busyevent',
+            constraint=models.UniqueConstraint(fields=('credential', 'event_id'), name='unique_credential_event'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tressreliefapi', '0007_calendar_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Appointment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('status', models.CharField(choices=[('booked', 'Booked'), ('cancelled', 'Cancelled')], default='booked', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='client_appointments', to='tressreliefapi.userinfo')),
+                ('stylist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointments', to='tressreliefapi.userinfo')),
+                ('stylist_service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointments', to='tressreliefapi.stylistservice')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stylist', 'start', 'end'], name='appointment_stylist_time')],
+            },
+        ),
+    ]
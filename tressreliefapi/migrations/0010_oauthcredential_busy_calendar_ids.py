@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tressreliefapi', '0009_calendar_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='oauthcredential',
+            name='busy_calendar_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
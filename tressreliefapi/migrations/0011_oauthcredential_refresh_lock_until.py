@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tressreliefapi', '0010_oauthcredential_busy_calendar_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='oauthcredential',
+            name='refresh_lock_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
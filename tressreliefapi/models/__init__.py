@@ -3,3 +3,7 @@ from .category import Category
 from .service import Service
 from .stylist_service import StylistService
 from .oauth_credential import OAuthCredential
+from .availability_snapshot import AvailabilitySnapshot
+from .calendar_sync import CalendarSync, BusyEvent
+from .appointment import Appointment
+from .calendar_outbox import CalendarOutbox
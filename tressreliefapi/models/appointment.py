@@ -0,0 +1,33 @@
+from django.db import models
+from .stylist_service import StylistService
+from .user_info import UserInfo
+
+# a booked appointment for one service with one stylist. availability subtracts these on top of the stylist's google busy times,
+# and booking checks them for overlaps (see tressreliefapi/utils/appointments.py), so a slot can't be booked twice even before it's on google.
+
+STATUS_CHOICES = (
+    ("booked", "Booked"),
+    ("cancelled", "Cancelled"),
+)
+
+
+class Appointment(models.Model):
+    stylist_service = models.ForeignKey(
+        StylistService, on_delete=models.CASCADE, related_name="appointments")
+    # copied from stylist_service so conflict checks and availability can use the (stylist, start, end) index without a join
+    stylist = models.ForeignKey(
+        UserInfo, on_delete=models.CASCADE, related_name="appointments")
+    client = models.ForeignKey(
+        UserInfo, on_delete=models.SET_NULL, related_name="client_appointments", blank=True, null=True)
+    # UTC. end is start + the service's duration
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    # cancelled appointments are kept (history) but don't block the time anymore
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="booked")
+    # set only when obj is first created and saved to db
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["stylist", "start", "end"], name="appointment_stylist_time"),
+        ]
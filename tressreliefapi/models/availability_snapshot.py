@@ -0,0 +1,29 @@
+from django.db import models
+from .service import Service
+from .user_info import UserInfo
+
+# precomputed availability: one row per service + stylist + day, filled ahead of time for the next few days by
+# `python manage.py build_availability_snapshots` (see tressreliefapi/utils/availability_snapshot.py).
+# GET /services/<id>/availability/?source=snapshot answers from these rows with one query instead of calling google,
+# and only computes live for the stylists/days that have no row or a row older than AVAILABILITY_SNAPSHOT_MAX_AGE_SEC.
+
+
+class AvailabilitySnapshot(models.Model):
+    service = models.ForeignKey(Service, on_delete=models.CASCADE)
+    stylist = models.ForeignKey(UserInfo, on_delete=models.CASCADE)
+    # salon-local day
+    date = models.DateField()
+    # exactly what the availability response has for this stylist and day, already JSON-ready: [[start, end], ...] as UTC ISO strings
+    slots = models.JSONField(default=list)
+    # the free windows the service fits in (the ?format=intervals response)
+    intervals = models.JSONField(default=list)
+    # when the row was computed. rows older than AVAILABILITY_SNAPSHOT_MAX_AGE_SEC aren't served
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            # one row per service, stylist and day. the builder upserts on these
+            models.UniqueConstraint(
+                fields=["service", "date", "stylist"], name="unique_availability_snapshot")
+        ]
+        # the unique constraint's index (service, date, ...) is also what the ?source=snapshot lookup uses
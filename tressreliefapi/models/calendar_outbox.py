@@ -0,0 +1,40 @@
+from django.db import models
+from django.utils import timezone
+from .appointment import Appointment
+
+# pending writes of appointments to the stylist's google calendar. booking saves a row here in the same transaction as the appointment
+# and answers right away, then the drain_calendar_outbox worker sends the rows to google in batches (see tressreliefapi/utils/calendar_outbox.py).
+# the row survives a crash or a google outage, so the write happens eventually either way.
+
+OPERATION_CHOICES = (
+    ("create", "Create"),
+    ("update", "Update"),
+    ("cancel", "Cancel"),
+)
+
+STATUS_CHOICES = (
+    ("pending", "Pending"),
+    ("done", "Done"),
+    # google refused it for good, or it kept failing GOOGLE_OUTBOX_MAX_ATTEMPTS times (last_error says why)
+    ("failed", "Failed"),
+    # the stylist hasn't connected google, there's no calendar to write to
+    ("skipped", "Skipped"),
+)
+
+
+class CalendarOutbox(models.Model):
+    appointment = models.ForeignKey(
+        Appointment, on_delete=models.CASCADE, related_name="calendar_ops")
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    # the worker skips the row until then: backoff after a failure, or the lease of the worker that's sending it right now
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # the worker asks for pending rows that are due
+            models.Index(fields=["status", "next_attempt_at"], name="calendar_outbox_due"),
+        ]
@@ -0,0 +1,41 @@
+from django.db import models
+from .oauth_credential import OAuthCredential
+
+# local mirror of each connected stylist's google calendar, kept up to date by google push notifications instead of asking FreeBusy on every request.
+# google POSTs to our webhook (a "channel", one per credential) whenever the calendar changes, and we pull just the changed events with the sync token.
+# see tressreliefapi/utils/calendar_sync.py
+# DOCS: https://developers.google.com/workspace/calendar/api/guides/push
+# https://developers.google.com/workspace/calendar/api/guides/sync
+
+
+class CalendarSync(models.Model):
+    credential = models.OneToOneField(
+        OAuthCredential, on_delete=models.CASCADE, related_name="calendar_sync")
+    # the push channel: our id for it, the secret google echoes back in every notification, google's id for the watched calendar, and when it stops
+    channel_id = models.CharField(max_length=64, unique=True, blank=True, null=True)
+    channel_token = models.CharField(max_length=64, blank=True)
+    resource_id = models.CharField(max_length=255, blank=True)
+    channel_expiration = models.DateTimeField(blank=True, null=True)
+    # google's bookmark for "changes since the last sync". None until the first full sync
+    sync_token = models.TextField(blank=True, null=True)
+    synced_at = models.DateTimeField(blank=True, null=True)
+
+
+class BusyEvent(models.Model):
+    # one event on the stylist's calendar that makes them busy (cancelled and "show me as available" events aren't kept)
+    credential = models.ForeignKey(
+        OAuthCredential, on_delete=models.CASCADE, related_name="busy_events")
+    event_id = models.CharField(max_length=1024)
+    # UTC
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["credential", "event_id"], name="unique_credential_event")
+        ]
+        indexes = [
+            # availability asks for the events overlapping a range of days
+            models.Index(fields=["credential", "start"], name="busy_event_credential_start"),
+        ]
@@ -22,6 +22,12 @@ class OAuthCredential(models.Model):
     token_expiry = models.DateTimeField(blank=True, null=True)
     # which calendar to write to. using 'primary' for simplicity. will use when creating/updating/deleting events on the stylist's google calendar
     calendar_id = models.CharField(max_length=255, default='primary')
+    # other calendars whose busy times count for availability too (e.g. a personal calendar kept apart from the salon one).
+    # all of them and calendar_id are checked in one FreeBusy call, see busy_calendars() in tressreliefapi/utils/google_utils.py
+    busy_calendar_ids = models.JSONField(default=list, blank=True)
+    # while set and in the future, some worker (in any process) is refreshing the access token and the others wait for it.
+    # claimed with a conditional UPDATE so it works on every database, see refresh_access_token() in tressreliefapi/utils/google_utils.py
+    refresh_lock_until = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         constraints = [
@@ -0,0 +1,14 @@
+# DRF reads ?format= as "render the response with this renderer" (?format=json, ?format=api) and 404s when no renderer has that format.
+# The availability endpoints also use ?format= to pick the shape of the JSON (?format=slots / ?format=intervals),
+# so those values are left for the view and the renderer is picked from the Accept header as usual.
+
+from rest_framework.negotiation import DefaultContentNegotiation
+
+RESPONSE_SHAPE_FORMATS = ("slots", "intervals")
+
+
+class ContentNegotiation(DefaultContentNegotiation):
+    def filter_renderers(self, renderers, format):
+        if format in RESPONSE_SHAPE_FORMATS:
+            return renderers
+        return super().filter_renderers(renderers, format)
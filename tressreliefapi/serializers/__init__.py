@@ -3,3 +3,4 @@ from .category import CategorySerializer
 from .service import ServiceSerializer
 from .stylist_service import StylistServiceSerializer
 from .oauth_credential import OAuthCredentialSerializer
+from .appointment import AppointmentSerializer
@@ -0,0 +1,10 @@
+from rest_framework import serializers
+from tressreliefapi.models import Appointment
+
+
+class AppointmentSerializer(serializers.ModelSerializer):
+    """JSON Serializer for appointments"""
+
+    class Meta:
+        model = Appointment
+        fields = ('id', 'stylist_service', 'stylist', 'client', 'start', 'end', 'status', 'created_at')
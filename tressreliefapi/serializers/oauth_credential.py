@@ -3,6 +3,11 @@ from tressreliefapi.models import OAuthCredential
 
 
 class OAuthCredentialSerializer(serializers.ModelSerializer):
+    # a list of calendar ids. a bare JSONField would take "personal" and busy_calendars() would then check "p", "e", "r", ...
+    busy_calendar_ids = serializers.ListField(
+        child=serializers.CharField(max_length=255), required=False)
+
     class Meta:
         model = OAuthCredential
         fields = '__all__'
+        read_only_fields = ('refresh_lock_until',)
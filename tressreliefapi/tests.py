@@ -1,3 +1,1499 @@
-from django.test import TestCase
+import asyncio
+import inspect
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from itertools import islice
+from types import SimpleNamespace
+from unittest import mock
+import requests
+from dateutil.tz import tzutc
+from io import StringIO
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.utils.encoders import JSONEncoder
+from tressreliefapi.models import Appointment, AvailabilitySnapshot, BusyEvent, CalendarOutbox, CalendarSync, Category, OAuthCredential, Service, StylistService, UserInfo
+from tressreliefapi.utils.any_stylist import merge_stylist_slots
+from tressreliefapi.utils.availability_snapshot import build_snapshots
+from tressreliefapi.utils import busy_cache
+from tressreliefapi.utils.busy_cache import LRUBusyCache, cache_busy, get_cached_busy, get_stale_busy, invalidate_busy
+from tressreliefapi.utils.calendar_outbox import _claim, drain_outbox
+from tressreliefapi.utils.calendar_sync import amirror_busy_by_day, event_interval, mirror_busy_by_day, sync_calendar
+from tressreliefapi.utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, get_breaker, stylist_breaker
+from tressreliefapi.utils.availability import SLOT_GRANULARITY_MIN, bookable_intervals, count_slots, free_intervals, generate_available_slots, local_day_bounds, normalize_intervals, split_busy_by_day, working_hours
+from tressreliefapi.utils.availability_np import generate_available_slots_np, generate_slots_batch_np, normalize_intervals_np, slots_by_day_np
+from tressreliefapi.utils.booking import BookingError, SlotTaken, book_appointment, cancel_appointment, day_free_intervals
+from tressreliefapi.utils.day_bitmap import DayBitmap, all_free, any_free
+from tressreliefapi.utils import google_transport
+from tressreliefapi.utils.google_utils import forget_access_token, get_busy_calendars, get_valid_access_token, parse_freebusy, prefetch_credentials, refresh_access_token
+from tressreliefapi.utils.next_available import iter_next_available, salon_today
+from tressreliefapi.utils.rate_limit import GoogleRateLimited, RateLimiter
+from tressreliefapi.utils.stylist_busy import BusyDays, gather_stylists_busy, get_busy_by_day, iter_stylists_busy
 
-# Create your tests here.
+
+def random_busy(rng, date, count):
+    """ count random busy intervals around the salon-local day: before opening, after closing, overlapping, zero-length, odd seconds."""
+    day_start, _ = local_day_bounds(date)
+    busy = []
+    for _ in range(count):
+        start = day_start + timedelta(minutes=rng.randrange(-120, 26 * 60, rng.choice((1, 5, 15))),
+                                      seconds=rng.choice((0, 0, 0, 30)))
+        end = start + timedelta(minutes=rng.choice((0, 15, 30, 45, 60, 90, 200)))
+        # google's FreeBusy times come back parsed with dateutil's tzutc()
+        busy.append((start.astimezone(tzutc()), end.astimezone(tzutc())))
+    return busy
+
+
+class SlotEngineEquivalenceTests(SimpleTestCase):
+    """ The numpy slot engine (utils/availability_np.py) must give exactly what the python one (utils/availability.py) gives."""
+
+    def setUp(self):
+        self.rng = random.Random(9)
+
+    def random_case(self):
+        # dates over two years so both DST switches are covered
+        day = date(2025, 1, 1) + timedelta(days=self.rng.randrange(730))
+        return day, random_busy(self.rng, day, self.rng.randrange(0, 8))
+
+    def test_normalize_intervals(self):
+        for _ in range(500):
+            _, busy = self.random_case()
+            self.assertEqual(normalize_intervals_np(busy),
+                             normalize_intervals(list(busy)))
+
+    def test_generate_available_slots(self):
+        for _ in range(1000):
+            day, busy = self.random_case()
+            duration = self.rng.choice((15, 30, 45, 60, 120, 180, 500))
+            granularity = self.rng.choice((5, 15, 30))
+            expected = generate_available_slots(
+                duration, list(busy), day, granularity)
+            with self.subTest(date=day, busy=busy, duration=duration, granularity=granularity):
+                self.assertEqual(generate_available_slots_np(
+                    duration, busy, day, granularity), expected)
+                # string output must serialize exactly like DRF serializes the datetimes
+                self.assertEqual(generate_slots_batch_np(duration, [(day, busy)], granularity, as_strings=True)[0],
+                                 json.loads(json.dumps(expected, cls=JSONEncoder)))
+
+    def test_batch_matches_one_job_at_a_time(self):
+        jobs = [self.random_case() for _ in range(300)]
+        expected = [generate_available_slots(60, list(busy), day)
+                    for day, busy in jobs]
+        self.assertEqual(generate_slots_batch_np(60, jobs), expected)
+
+    def test_empty_inputs(self):
+        day = date(2025, 10, 1)
+        self.assertEqual(generate_slots_batch_np(60, []), [])
+        self.assertEqual(normalize_intervals_np([]), [])
+        self.assertEqual(generate_available_slots_np(60, [], day),
+                         generate_available_slots(60, [], day))
+        # no room for the service at all
+        self.assertEqual(generate_available_slots_np(9 * 60, [], day), [])
+
+    def test_slots_by_day_keeps_stylist_order_and_skips(self):
+        dates = [date(2025, 10, 1) + timedelta(days=i) for i in range(3)]
+        busy_by_days = [{day: random_busy(self.rng, day, 3) for day in dates},
+                        None,
+                        {day: [] for day in dates}]
+        results = slots_by_day_np(45, dates, busy_by_days)
+        self.assertIsNone(results[1])
+        for busy_by_day, result in zip(busy_by_days, results):
+            if busy_by_day is None:
+                continue
+            for day in dates:
+                expected = generate_available_slots(
+                    45, list(busy_by_day[day]), day)
+                self.assertEqual(result[day], json.loads(
+                    json.dumps(expected, cls=JSONEncoder)))
+
+
+class BookableIntervalsTests(SimpleTestCase):
+    def test_client_side_expansion_gives_the_same_slots(self):
+        # what a client does with ?format=intervals: a slot every granularity from each window's start while it fits
+        def expand(intervals, duration, granularity=15):
+            slots = []
+            for start, end in intervals:
+                while start + timedelta(minutes=duration) <= end:
+                    slots.append((start, start + timedelta(minutes=duration)))
+                    start += timedelta(minutes=granularity)
+            return slots
+
+        rng = random.Random(13)
+        for _ in range(500):
+            day = date(2025, 1, 1) + timedelta(days=rng.randrange(730))
+            busy = random_busy(rng, day, rng.randrange(0, 8))
+            duration = rng.choice((15, 60, 180, 500))
+            intervals = bookable_intervals(duration, list(busy), day)
+            self.assertEqual(expand(intervals, duration),
+                             generate_available_slots(duration, list(busy), day))
+            # only windows long enough for the service
+            self.assertTrue(all(end - start >= timedelta(minutes=duration)
+                                for start, end in intervals))
+
+    def test_count_slots_matches_the_slots(self):
+        rng = random.Random(17)
+        for _ in range(500):
+            day = date(2025, 1, 1) + timedelta(days=rng.randrange(730))
+            busy = random_busy(rng, day, rng.randrange(0, 8))
+            duration = rng.choice((15, 45, 60, 180, 500))
+            self.assertEqual(count_slots(duration, free_intervals(list(busy), day)),
+                             len(generate_available_slots(duration, list(busy), day)))
+
+
+def random_grid_busy(rng, date, count):
+    """ count random busy intervals that start and end on the 15 minute grid, some of them outside working hours."""
+    day_start, _ = working_hours(date)
+    busy = []
+    for _ in range(count):
+        start = day_start + timedelta(minutes=rng.randrange(-120, 10 * 60, 15))
+        busy.append((start, start + timedelta(minutes=rng.choice((15, 30, 60, 90)))))
+    return busy
+
+
+class DayBitmapTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = random.Random(10)
+        self.date = date(2025, 10, 1)
+        self.opening, _ = working_hours(self.date)
+
+    def at(self, hours):
+        """ UTC datetime hours after opening on self.date."""
+        return self.opening + timedelta(hours=hours)
+
+    def test_slots_match_python_engine_on_grid(self):
+        for _ in range(500):
+            day = date(2025, 1, 1) + timedelta(days=self.rng.randrange(730))
+            busy = random_grid_busy(self.rng, day, self.rng.randrange(6))
+            duration = self.rng.choice((15, 30, 60, 120, 480))
+            with self.subTest(date=day, busy=busy, duration=duration):
+                self.assertEqual(DayBitmap.from_busy(day, busy).slots(duration),
+                                 generate_available_slots(duration, list(busy), day))
+
+    def test_off_grid_busy_takes_whole_cells(self):
+        # busy 10:05-10:20 blocks the 10:00-10:30 cells
+        bitmap = DayBitmap.from_busy(self.date, [(self.at(1) + timedelta(minutes=5),
+                                                   self.at(1) + timedelta(minutes=20))])
+        self.assertFalse(bitmap.is_free(self.at(1), self.at(1.25)))
+        self.assertFalse(bitmap.is_free(self.at(1.25), self.at(2)))
+        self.assertTrue(bitmap.is_free(self.at(1.5), self.at(2)))
+        self.assertEqual(bitmap.free_cell_count(), 30)
+
+    def test_is_free(self):
+        bitmap = DayBitmap.from_busy(self.date, [(self.at(2), self.at(3))])
+        self.assertTrue(bitmap.is_free(self.at(0), self.at(2)))
+        self.assertFalse(bitmap.is_free(self.at(1.5), self.at(2.5)))
+        self.assertTrue(bitmap.is_free(self.at(3), self.at(8)))
+        # outside working hours is never free
+        self.assertFalse(bitmap.is_free(self.at(-1), self.at(1)))
+        self.assertFalse(bitmap.is_free(self.at(7), self.at(9)))
+
+    def test_and_or_across_stylists(self):
+        morning_busy = DayBitmap.from_busy(self.date, [(self.at(0), self.at(4))])
+        afternoon_busy = DayBitmap.from_busy(self.date, [(self.at(4), self.at(8))])
+        self.assertEqual(any_free([morning_busy, afternoon_busy]),
+                         DayBitmap.free_day(self.date))
+        self.assertEqual(all_free([morning_busy, afternoon_busy]).free_cell_count(), 0)
+        self.assertEqual((morning_busy | afternoon_busy).slots(8 * 60),
+                         [(self.at(0), self.at(8))])
+        with self.assertRaises(ValueError):
+            morning_busy & DayBitmap.free_day(self.date + timedelta(days=1))
+
+    def test_bytes_round_trip(self):
+        bitmap = DayBitmap.from_busy(self.date, random_grid_busy(self.rng, self.date, 4))
+        self.assertEqual(len(bitmap.to_bytes()), 4)
+        self.assertEqual(DayBitmap.from_bytes(self.date, bitmap.to_bytes()), bitmap)
+
+
+class AnyStylistMergeTests(SimpleTestCase):
+    def setUp(self):
+        # 10:00 and 10:15 for stylist 1, 10:15 and 10:30 for stylist 2, 10:15 for stylist 3
+        self.stylist_slots = [
+            (1, [("10:00", "11:00"), ("10:15", "11:15")]),
+            (2, [("10:15", "11:15"), ("10:30", "11:30")]),
+            (3, [("10:15", "11:15")]),
+        ]
+
+    def test_each_start_once_in_order(self):
+        self.assertEqual(merge_stylist_slots(self.stylist_slots), [
+            {"start": "10:00", "end": "11:00", "stylist_ids": [1]},
+            {"start": "10:15", "end": "11:15", "stylist_ids": [1, 2, 3]},
+            {"start": "10:30", "end": "11:30", "stylist_ids": [2]},
+        ])
+
+    def test_matches_brute_force(self):
+        rng = random.Random(11)
+        day = date(2025, 10, 1)
+        stylist_slots = [(stylist_id, generate_available_slots(60, random_grid_busy(rng, day, 4), day))
+                         for stylist_id in range(1, 9)]
+        expected = {}
+        for stylist_id, slots in stylist_slots:
+            for start, end in slots:
+                expected.setdefault((start, end), []).append(stylist_id)
+        merged = merge_stylist_slots(stylist_slots)
+        self.assertEqual([(slot["start"], slot["end"]) for slot in merged], sorted(expected))
+        self.assertEqual([slot["stylist_ids"] for slot in merged],
+                         [expected[key] for key in sorted(expected)])
+
+    def test_policies(self):
+        def ids_at_1015(policy):
+            return merge_stylist_slots(self.stylist_slots, policy)[1]["stylist_ids"]
+        self.assertEqual(ids_at_1015("order"), [1, 2, 3])
+        # second start time prefers the second stylist
+        self.assertEqual(ids_at_1015("round_robin"), [2, 3, 1])
+        # stylist 3 has 1 free slot, the others 2 (ties keep link order)
+        self.assertEqual(ids_at_1015("most_free"), [1, 2, 3])
+        self.assertEqual(ids_at_1015("least_free"), [3, 1, 2])
+
+    def test_no_stylists(self):
+        self.assertEqual(merge_stylist_slots([]), [])
+
+
+class NextAvailableTests(SimpleTestCase):
+    def setUp(self):
+        self.service = SimpleNamespace(duration=60)
+        self.stylists = [SimpleNamespace(id=1), SimpleNamespace(id=2)]
+        self.start = date(2025, 10, 1)
+        self.fetched = []
+        # stylist 1 is booked solid for the first 5 days, stylist 2 isn't connected to google
+        patcher = mock.patch("tressreliefapi.utils.next_available.gather_stylists_busy",
+                             side_effect=self.fake_gather_stylists_busy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_gather_stylists_busy(self, stylists, dates, compute, deadline=None):
+        self.fetched.append(dates)
+        booked_until = self.start + timedelta(days=5)
+        return [compute(stylists[0], {day: [working_hours(day)] if day < booked_until else [] for day in dates}),
+                None], []
+
+    def search(self, count, **kwargs):
+        now = local_day_bounds(self.start)[0]
+        return list(islice(iter_next_available(self.service, self.stylists, self.start, now=now, **kwargs), count))
+
+    def test_finds_first_open_day_in_growing_windows(self):
+        slots = self.search(3)
+        first_open_day = self.start + timedelta(days=5)
+        opening, _ = working_hours(first_open_day)
+        self.assertEqual([start for start, _, _ in slots],
+                         [opening + timedelta(minutes=15 * i) for i in range(3)])
+        self.assertTrue(all(stylist.id == 1 for _, _, stylist in slots))
+        # windows of 1, 2 and 4 days reach day 6, and nothing after that window is fetched
+        self.assertEqual([len(dates) for dates in self.fetched], [1, 2, 4])
+
+    def test_stops_at_max_days(self):
+        self.assertEqual(self.search(3, max_days=5), [])
+        self.assertEqual(sum(len(dates) for dates in self.fetched), 5)
+
+    def test_skips_slots_that_already_started(self):
+        now = working_hours(self.start + timedelta(days=5))[1] - timedelta(hours=2)
+        slots = list(islice(iter_next_available(self.service, self.stylists, self.start, now=now), 2))
+        self.assertEqual([start for start, _, _ in slots],
+                         [now, now + timedelta(minutes=15)])
+
+    def test_stops_fetching_windows_after_the_deadline(self):
+        timed_out = []
+        with mock.patch("tressreliefapi.utils.next_available.time.monotonic", side_effect=[0, 0, 11]):
+            slots = self.search(3, deadline=10, timed_out=timed_out)
+        self.assertEqual(slots, [])
+        # windows of 1 and 2 days were fetched before the deadline, the 4 day window that has the open day wasn't
+        self.assertEqual([len(dates) for dates in self.fetched], [1, 2])
+        self.assertEqual(timed_out, self.stylists)
+
+
+class IterStylistsBusyTests(SimpleTestCase):
+    def test_yields_fastest_first_with_status(self):
+        stylists = [SimpleNamespace(id=stylist_id) for stylist_id in (1, 2, 3, 4)]
+        delays = {1: 0.4, 2: 0.1, 3: 0.2, 4: 0}
+
+        def fake_get_busy_by_day(stylist, dates, credentials, deadline=None):
+            time.sleep(delays[stylist.id])
+            # 3 isn't connected, 4's google call fails
+            return None if stylist.id in (3, 4) else {dates[0]: []}
+
+        with mock.patch("tressreliefapi.utils.stylist_busy.prefetch_credentials", return_value={3: None, 4: object()}), \
+                mock.patch("tressreliefapi.utils.stylist_busy.needs_fetch", return_value=True), \
+                mock.patch("tressreliefapi.utils.stylist_busy.appointments_by_day", return_value={}), \
+                mock.patch("tressreliefapi.utils.stylist_busy.get_busy_by_day", side_effect=fake_get_busy_by_day):
+            results = list(iter_stylists_busy(
+                stylists, [date(2025, 10, 1)], lambda stylist, busy_by_day: stylist.id))
+
+        self.assertEqual([(stylist.id, result, status) for stylist, result, status in results],
+                         [(4, None, "failed"), (2, 2, "ok"), (3, None, "not_connected"), (1, 1, "ok")])
+
+
+class StylistDeadlineTests(SimpleTestCase):
+    def setUp(self):
+        self.stylists = [SimpleNamespace(id=stylist_id) for stylist_id in (1, 2, 3)]
+        # stylist 2's google call hangs way past the deadline
+        delays = {1: 0, 2: 2, 3: 0.05}
+
+        def fake_get_busy_by_day(stylist, dates, credentials, deadline=None):
+            time.sleep(delays[stylist.id])
+            return {dates[0]: []}
+
+        for target, kwargs in (("prefetch_credentials", {"return_value": {}}),
+                               ("appointments_by_day", {"return_value": {}}),
+                               ("get_busy_by_day", {"side_effect": fake_get_busy_by_day})):
+            patcher = mock.patch(f"tressreliefapi.utils.stylist_busy.{target}", **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_gather_returns_at_the_deadline_without_the_slow_stylist(self):
+        started = time.monotonic()
+        results, timed_out = gather_stylists_busy(
+            self.stylists, [date(2025, 10, 1)], lambda stylist, busy_by_day: stylist.id, deadline=started + 0.3)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(results, [1, None, 3])
+        self.assertEqual(timed_out, [self.stylists[1]])
+
+    def test_stream_reports_the_slow_stylist_as_timed_out(self):
+        started = time.monotonic()
+        results = list(iter_stylists_busy(
+            self.stylists, [date(2025, 10, 1)], lambda stylist, busy_by_day: stylist.id, deadline=started + 0.3))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual([(stylist.id, status) for stylist, _, status in results],
+                         [(1, "ok"), (3, "ok"), (2, "timed_out")])
+
+    def test_requests_share_one_bounded_pool(self):
+        running, most = [0], [0]
+        lock = threading.Lock()
+
+        def hanging_get_busy_by_day(stylist, dates, credentials, deadline=None):
+            with lock:
+                running[0] += 1
+                most[0] = max(most[0], running[0])
+            time.sleep(0.3)
+            with lock:
+                running[0] -= 1
+            return {dates[0]: []}
+
+        pool = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(pool.shutdown)
+        with mock.patch("tressreliefapi.utils.stylist_busy._executor", pool), \
+                mock.patch("tressreliefapi.utils.stylist_busy.get_busy_by_day", side_effect=hanging_get_busy_by_day):
+            # three requests in a row give up on their stylists at the deadline, the abandoned calls don't add threads
+            for _ in range(3):
+                _, timed_out = gather_stylists_busy(self.stylists, [date(2025, 10, 1)], lambda stylist, busy_by_day: stylist.id,
+                                                    deadline=time.monotonic() + 0.05)
+                self.assertEqual(timed_out, self.stylists)
+            pool.shutdown(wait=True)
+        self.assertLessEqual(most[0], 2)
+
+    def test_a_failing_stylist_does_not_fail_the_others(self):
+        def flaky_get_busy_by_day(stylist, dates, credentials, deadline=None):
+            if stylist.id == 2:
+                raise ValueError("bad FreeBusy answer")
+            return {dates[0]: []}
+
+        with mock.patch("tressreliefapi.utils.stylist_busy.get_busy_by_day", side_effect=flaky_get_busy_by_day), \
+                self.assertLogs("tressreliefapi.utils.stylist_busy", "ERROR"):
+            results, timed_out = gather_stylists_busy(self.stylists, [date(2025, 10, 1)], lambda stylist, busy_by_day: stylist.id)
+        self.assertEqual(results, [1, None, 3])
+        self.assertEqual(timed_out, [])
+
+    def test_the_google_call_times_out_with_the_request(self):
+        stylist = SimpleNamespace(id=9002)
+        for target, kwargs in (("get_cached_busy", {"return_value": None}),
+                               ("mirror_busy_by_day", {"return_value": None}),
+                               ("get_busy_calendars", {"return_value": ("primary",)}),
+                               ("get_valid_access_token", {"return_value": "token"})):
+            patcher = mock.patch(f"tressreliefapi.utils.stylist_busy.{target}", **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(invalidate_busy, stylist.id, [date(2025, 10, 1)])
+        with mock.patch("tressreliefapi.utils.circuit_breaker._breakers", {}), \
+                mock.patch("tressreliefapi.utils.stylist_busy.fetch_busy_intervals", return_value=[]) as fetch:
+            get_busy_by_day(stylist, [date(2025, 10, 1)], deadline=time.monotonic() + 1.5)
+            # google's 3.05s connect / 10s read timeouts are cut to the 1.5s the request has left
+            self.assertTrue(1 < min(fetch.call_args.kwargs["timeout"]) <= max(fetch.call_args.kwargs["timeout"]) <= 1.5)
+            # out of time: nothing is sent
+            self.assertIsNone(get_busy_by_day(stylist, [date(2025, 10, 2)], deadline=time.monotonic() - 1))
+        self.assertEqual(fetch.call_count, 1)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("tressreliefapi.utils.circuit_breaker.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+
+    def test_opens_after_threshold_failures_in_a_row(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()  # a success resets the count
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertTrue(self.breaker.is_open())
+
+    def test_half_open_lets_one_trial_call_through(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        # the trial fails: open for another reset_timeout
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+
+class StaleBusyFallbackTests(SimpleTestCase):
+    def setUp(self):
+        self.stylist = SimpleNamespace(id=9001)
+        self.date = date(2025, 10, 1)
+        self.busy = [(datetime(2025, 10, 1, 15, tzinfo=tzutc()), datetime(2025, 10, 1, 16, tzinfo=tzutc()))]
+        # fresh breakers, and the regular cache always misses (and no mirror) so every call goes to (fake) google
+        for target, kwargs in (("circuit_breaker._breakers", {"new": {}}),
+                               ("stylist_busy.get_cached_busy", {"return_value": None}),
+                               ("stylist_busy.mirror_busy_by_day", {"return_value": None}),
+                               ("stylist_busy.get_busy_calendars", {"return_value": ("primary",)}),
+                               ("stylist_busy.get_valid_access_token", {"return_value": "token"})):
+            patcher = mock.patch(f"tressreliefapi.utils.{target}", **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(invalidate_busy, self.stylist.id, [self.date])
+
+    def test_failing_google_serves_last_fetch_marked_stale(self):
+        with mock.patch("tressreliefapi.utils.stylist_busy.fetch_busy_intervals", return_value=self.busy):
+            fresh = get_busy_by_day(self.stylist, [self.date])
+        self.assertEqual(fresh.stale, {})
+
+        with mock.patch("tressreliefapi.utils.stylist_busy.fetch_busy_intervals", return_value=None) as fetch:
+            for _ in range(5):
+                busy_by_day = get_busy_by_day(self.stylist, [self.date])
+                self.assertEqual(busy_by_day[self.date], fresh[self.date])
+                self.assertEqual(list(busy_by_day.stale), [self.date])
+        # the stylist's breaker opened after GOOGLE_BREAKER_STYLIST_FAILURES failures and the rest didn't call google
+        self.assertEqual(fetch.call_count, 3)
+
+    def test_no_stale_copy_leaves_the_stylist_out(self):
+        with mock.patch("tressreliefapi.utils.stylist_busy.fetch_busy_intervals", return_value=None):
+            self.assertIsNone(get_busy_by_day(self.stylist, [self.date]))
+
+    def test_an_open_freebusy_breaker_does_not_count_against_the_stylist(self):
+        with mock.patch("tressreliefapi.utils.stylist_busy.fetch_busy_intervals", return_value=self.busy):
+            fresh = get_busy_by_day(self.stylist, [self.date])
+        freebusy = get_breaker("google:freebusy")
+        for _ in range(settings.GOOGLE_BREAKER_FAILURES):
+            freebusy.record_failure()
+        with mock.patch("tressreliefapi.utils.google_utils.google_post") as post:
+            for _ in range(5):
+                busy_by_day = get_busy_by_day(self.stylist, [self.date])
+                self.assertEqual(busy_by_day[self.date], fresh[self.date])
+                self.assertEqual(list(busy_by_day.stale), [self.date])
+        # nothing was sent, so the stylist's own breaker never saw a failure
+        post.assert_not_called()
+        self.assertEqual(stylist_breaker(self.stylist.id).state, CLOSED)
+
+
+@override_settings(GOOGLE_RATE_PER_SEC=10, GOOGLE_RATE_BURST=5, GOOGLE_RATE_USER_PER_SEC=1,
+                   GOOGLE_RATE_USER_BURST=2, GOOGLE_RATE_MAX_WAIT_SEC=1)
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.slept = []
+
+        def fake_sleep(seconds):
+            self.slept.append(round(seconds, 3))
+            self.now += seconds
+
+        for target, kwargs in (("monotonic", {"side_effect": lambda: self.now}), ("sleep", {"side_effect": fake_sleep})):
+            patcher = mock.patch(f"tressreliefapi.utils.rate_limit.time.{target}", **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.limiter = RateLimiter()
+
+    def test_burst_then_calls_queue_at_the_rate(self):
+        for _ in range(7):
+            self.limiter.acquire()
+        # 5 go right away, then one every 0.1s
+        self.assertEqual(self.slept, [0.1, 0.1])
+        metrics = self.limiter.metrics()
+        self.assertEqual((metrics["calls"], metrics["throttled"], metrics["queue_depth"]), (7, 2, 0))
+
+    def test_per_user_bucket_and_wait_budget(self):
+        self.limiter.acquire("token-a")
+        self.limiter.acquire("token-a")
+        self.limiter.acquire("token-b")  # another user isn't held up by token-a
+        self.assertEqual(self.slept, [])
+        self.limiter.acquire("token-a")
+        self.assertEqual(self.slept, [1.0])
+        # another thread's token-a call is already waiting its second, so one more would have to wait 2s
+        self.limiter._reserve("token-a")
+        with self.assertRaises(GoogleRateLimited):
+            self.limiter.acquire("token-a")
+        self.assertEqual(self.limiter.metrics()["rejected"], 1)
+
+    def test_retry_after_pauses_the_bucket(self):
+        self.limiter.pause(0.5)
+        self.limiter.acquire()
+        self.assertEqual(self.slept, [0.6])  # the pause, then a token at 10/s from empty
+        self.limiter.pause(5)
+        with self.assertRaises(GoogleRateLimited):
+            self.limiter.acquire()
+
+
+class AvailabilitySnapshotTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Braids", description="", image_url="")
+        self.service = Service.objects.create(name="Knotless", category=category, duration=120, price=200)
+        self.stylists = [UserInfo.objects.create(uid=f"stylist-{i}", display_name=f"Stylist {i}", role="stylist")
+                         for i in range(2)]
+        for stylist in self.stylists:
+            StylistService.objects.create(stylist=stylist, service=self.service)
+        self.dates = [date(2025, 10, 1), date(2025, 10, 2)]
+        rng = random.Random(18)
+        self.busy = {stylist.id: BusyDays({day: random_busy(rng, day, 3) for day in self.dates})
+                     for stylist in self.stylists}
+
+    def fake_map(self, stylists, dates, compute, deadline=None):
+        return [compute(stylist, self.busy[stylist.id]) for stylist in stylists]
+
+    def fake_gather(self, stylists, dates, compute, deadline=None):
+        return self.fake_map(stylists, dates, compute), []
+
+    def get(self, query):
+        return self.client.get(f"/services/{self.service.id}/availability/?{query}").json()
+
+    def test_snapshot_matches_live_in_one_query(self):
+        with mock.patch("tressreliefapi.utils.availability_snapshot.map_stylists_busy", side_effect=self.fake_map):
+            self.assertEqual(build_snapshots(self.dates), (4, 0))
+        for query in ("start=2025-10-01&end=2025-10-02", "date=2025-10-01&any=true", "date=2025-10-02&format=intervals"):
+            with self.subTest(query=query):
+                with mock.patch("tressreliefapi.views.availability.gather_stylists_busy", side_effect=self.fake_gather):
+                    live = self.get(query)
+                    with self.assertNumQueries(3):  # service, its stylists, the snapshot rows
+                        snapshot = self.get(query + "&source=snapshot")
+                self.assertEqual(snapshot, live)
+
+    def test_missing_days_fall_back_to_live(self):
+        with mock.patch("tressreliefapi.utils.availability_snapshot.map_stylists_busy", side_effect=self.fake_map):
+            build_snapshots(self.dates[:1])
+        with mock.patch("tressreliefapi.views.availability.gather_stylists_busy", side_effect=self.fake_gather) as gather:
+            snapshot = self.get("start=2025-10-01&end=2025-10-02&source=snapshot")
+            self.assertEqual([stylist.id for stylist in gather.call_args.args[0]], [stylist.id for stylist in self.stylists])
+            self.assertEqual(snapshot, self.get("start=2025-10-01&end=2025-10-02"))
+
+
+def fake_response(status_code, payload=None):
+    response = mock.Mock(status_code=status_code)
+    response.json.return_value = payload
+    response.raise_for_status.side_effect = None if status_code < 400 else Exception(status_code)
+    return response
+
+
+def event(event_id, start, end, **fields):
+    return {"id": event_id, "status": "confirmed", "start": {"dateTime": start}, "end": {"dateTime": end}, **fields}
+
+
+class CalendarSyncTests(TestCase):
+    def setUp(self):
+        self.stylist = UserInfo.objects.create(uid="stylist", display_name="Stylist", role="stylist")
+        self.credential = OAuthCredential.objects.create(
+            user=self.stylist, refresh_token="refresh", access_token="access",
+            token_expiry=datetime.now(tzutc()) + timedelta(hours=1))
+        self.day = date(2025, 10, 1)
+
+    def sync(self, *pages):
+        with mock.patch("tressreliefapi.utils.calendar_sync.google_get", side_effect=list(pages)) as google_get:
+            self.assertIsNotNone(sync_calendar(self.credential))
+        return [call.kwargs["params"] for call in google_get.call_args_list]
+
+    def mirrored(self):
+        return sorted(BusyEvent.objects.values_list("event_id", flat=True))
+
+    def test_event_interval(self):
+        self.assertEqual(event_interval(event("a", "2025-10-01T10:00:00-05:00", "2025-10-01T11:00:00-05:00")),
+                         (datetime(2025, 10, 1, 15, tzinfo=tzutc()), datetime(2025, 10, 1, 16, tzinfo=tzutc())))
+        # all-day: salon-local midnight to midnight
+        self.assertEqual(event_interval({"id": "b", "start": {"date": "2025-10-01"}, "end": {"date": "2025-10-02"}}),
+                         local_day_bounds(self.day))
+        for not_busy in ({"id": "c", "status": "cancelled"},
+                         event("d", "2025-10-01T10:00:00Z", "2025-10-01T11:00:00Z", transparency="transparent"),
+                         event("e", "2025-10-01T10:00:00Z", "2025-10-01T11:00:00Z",
+                               attendees=[{"self": True, "responseStatus": "declined"}])):
+            self.assertIsNone(event_interval(not_busy))
+
+    def test_full_then_incremental_sync(self):
+        params = self.sync(
+            fake_response(200, {"items": [event("a", "2025-10-01T15:00:00Z", "2025-10-01T16:00:00Z")], "nextPageToken": "2"}),
+            fake_response(200, {"items": [event("b", "2025-10-01T18:00:00Z", "2025-10-01T19:00:00Z")], "nextSyncToken": "s1"}))
+        self.assertNotIn("syncToken", params[0])
+        self.assertEqual(params[1]["pageToken"], "2")
+        self.assertEqual(self.mirrored(), ["a", "b"])
+
+        params = self.sync(fake_response(200, {"items": [{"id": "a", "status": "cancelled"},
+                                                         event("c", "2025-10-01T20:00:00Z", "2025-10-01T21:00:00Z")],
+                                               "nextSyncToken": "s2"}))
+        self.assertEqual(params[0]["syncToken"], "s1")
+        self.assertEqual(self.mirrored(), ["b", "c"])
+
+        # an expired sync token (410) starts over with a full listing that replaces the mirror
+        params = self.sync(fake_response(410),
+                           fake_response(200, {"items": [event("d", "2025-10-01T15:00:00Z", "2025-10-01T16:00:00Z")],
+                                               "nextSyncToken": "s3"}))
+        self.assertEqual([("syncToken" in call) for call in params], [True, False])
+        self.assertEqual(self.mirrored(), ["d"])
+        self.assertEqual(CalendarSync.objects.get().sync_token, "s3")
+
+    @override_settings(GOOGLE_WEBHOOK_URL="https://salon.example/google/webhook")
+    def test_mirror_only_used_while_the_channel_is_alive(self):
+        self.sync(fake_response(200, {"items": [event("a", "2025-10-01T15:00:00Z", "2025-10-01T16:00:00Z")],
+                                      "nextSyncToken": "s1"}))
+        self.assertIsNone(mirror_busy_by_day(self.stylist.id, [self.day]))
+        CalendarSync.objects.update(channel_id="channel", channel_expiration=datetime.now(tzutc()) + timedelta(days=1))
+        self.assertEqual(mirror_busy_by_day(self.stylist.id, [self.day]),
+                         {self.day: [(datetime(2025, 10, 1, 15, tzinfo=tzutc()), datetime(2025, 10, 1, 16, tzinfo=tzutc()))]})
+
+    @override_settings(GOOGLE_WEBHOOK_URL="")
+    def test_no_webhook_no_mirror_lookup(self):
+        CalendarSync.objects.create(credential=self.credential, sync_token="s1", channel_id="channel",
+                                    channel_expiration=datetime.now(tzutc()) + timedelta(days=1))
+        with self.assertNumQueries(0):
+            self.assertIsNone(mirror_busy_by_day(self.stylist.id, [self.day]))
+            self.assertIsNone(asyncio.run(amirror_busy_by_day(self.stylist.id, [self.day])))
+
+    def test_webhook_checks_the_channel_token(self):
+        CalendarSync.objects.create(credential=self.credential, channel_id="channel", channel_token="secret",
+                                    resource_id="resource")
+        headers = {"HTTP_X_GOOG_CHANNEL_ID": "channel", "HTTP_X_GOOG_RESOURCE_ID": "resource",
+                   "HTTP_X_GOOG_RESOURCE_STATE": "exists"}
+        with mock.patch("tressreliefapi.utils.calendar_sync.sync_calendar") as sync:
+            self.assertEqual(self.client.post("/webhooks/google/calendar", HTTP_X_GOOG_CHANNEL_TOKEN="wrong",
+                                              **headers).status_code, 404)
+            self.assertEqual(self.client.post("/webhooks/google/calendar", HTTP_X_GOOG_CHANNEL_TOKEN="secret",
+                                              **headers).status_code, 200)
+        self.assertEqual(sync.call_count, 1)
+
+
+class BookingTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Braids", description="", image_url="")
+        self.service = Service.objects.create(name="Knotless", category=category, duration=60, price=200)
+        self.stylist = UserInfo.objects.create(uid="stylist", display_name="Stylist", role="stylist")
+        self.link = StylistService.objects.create(stylist=self.stylist, service=self.service)
+        # appointments can't be booked in the past
+        self.day = salon_today() + timedelta(days=7)
+        self.opening = working_hours(self.day)[0]
+        # google has the stylist busy for the first hour of the day
+        patcher = mock.patch("tressreliefapi.utils.booking.get_busy_by_day",
+                             return_value=BusyDays({self.day: [(self.opening, self.opening + timedelta(hours=1))]}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, start):
+        return self.client.post("/appointments", {"service": self.service.id, "stylist": self.stylist.id,
+                                                  "start": start.isoformat()}, content_type="application/json")
+
+    def test_overlaps_are_refused(self):
+        with self.assertRaises(SlotTaken):
+            book_appointment(self.link, self.opening + timedelta(minutes=30))  # google busy
+        appointment = book_appointment(self.link, self.opening + timedelta(hours=1))
+        self.assertEqual(appointment.end, self.opening + timedelta(hours=2))
+        self.assertEqual(self.post(self.opening + timedelta(hours=1, minutes=45)).status_code, 409)
+        self.assertEqual(self.post(self.opening + timedelta(hours=2)).status_code, 201)
+        # after closing
+        self.assertEqual(self.post(working_hours(self.day)[1] - timedelta(minutes=30)).status_code, 400)
+
+        cancel_appointment(appointment)
+        self.assertEqual(self.post(self.opening + timedelta(hours=1)).status_code, 201)
+        self.assertEqual(Appointment.objects.filter(status="booked").count(), 2)
+
+    def test_only_future_slots_on_the_grid(self):
+        with self.assertRaisesMessage(BookingError, "past"):
+            book_appointment(self.link, working_hours(salon_today() - timedelta(days=1))[0])
+        # the free window starts at 10:00 (google busy until then), so 10:10 is off the 15 minute grid
+        with self.assertRaisesMessage(BookingError, "start times"):
+            book_appointment(self.link, self.opening + timedelta(hours=1, minutes=10))
+        # an appointment ending at 11:20 restarts the grid there, like the slots availability shows
+        Appointment.objects.create(stylist_service=self.link, stylist=self.stylist, start=self.opening + timedelta(hours=1),
+                                   end=self.opening + timedelta(hours=2, minutes=20))
+        self.assertEqual(self.post(self.opening + timedelta(hours=2, minutes=30)).status_code, 400)
+        self.assertEqual(self.post(self.opening + timedelta(hours=2, minutes=35)).status_code, 201)
+
+    def test_ids_have_to_be_numbers(self):
+        for data in ({"service": "abc", "stylist": self.stylist.id}, {"service": self.service.id, "stylist": [1]},
+                     {"service": self.service.id, "stylist": self.stylist.id, "client": "abc"}):
+            response = self.client.post("/appointments", {**data, "start": (self.opening + timedelta(hours=3)).isoformat()},
+                                        content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_booking_drops_the_days_snapshots(self):
+        AvailabilitySnapshot.objects.create(service=self.service, stylist=self.stylist, date=self.day, slots=[], intervals=[],
+                                            computed_at=datetime.now(tzutc()))
+        self.assertEqual(self.post(self.opening + timedelta(hours=3)).status_code, 201)
+        self.assertFalse(AvailabilitySnapshot.objects.exists())
+
+    def test_availability_leaves_out_booked_slots(self):
+        book_appointment(self.link, self.opening + timedelta(hours=1))
+        with mock.patch("tressreliefapi.utils.stylist_busy.get_busy_by_day", return_value=BusyDays({self.day: []})), \
+                mock.patch("tressreliefapi.utils.stylist_busy.prefetch_credentials", return_value={}):
+            slots = self.client.get(f"/services/{self.service.id}/availability/?date={self.day}").json()[0]["slots"]
+        taken = [slot for slot in slots
+                 if self.opening + timedelta(hours=1) <= datetime.fromisoformat(slot[0].replace("Z", "+00:00"))
+                 < self.opening + timedelta(hours=2)]
+        self.assertEqual(taken, [])
+        # 29 hour-long starts from 9:00 to 16:00, minus the 7 that overlap 10:00-11:00 (9:15 through 10:45)
+        self.assertEqual(len(slots), 29 - 7)
+
+
+def batch_answer(statuses):
+    """ A fake google_post() for batch requests: answers each call in the batch with statuses[content id] (200 if missing)."""
+    def post(url, rate_key=None, headers=None, data=None):
+        boundary = headers["Content-Type"].split("boundary=")[1]
+        content_ids = [line.split("<")[1].rstrip(">") for line in data.decode().split("\r\n")
+                       if line.startswith("Content-ID:")]
+        body = "".join(f"--b\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                       f"HTTP/1.1 {statuses.get(content_id, 200)} X\r\nContent-Type: application/json\r\n\r\n{{}}\r\n"
+                       for content_id in content_ids) + "--b--\r\n"
+        response = mock.Mock(status_code=200, content=body.encode(), headers={"Content-Type": "multipart/mixed; boundary=b"})
+        post.sent.append((boundary, content_ids))
+        return response
+    post.sent = []
+    return post
+
+
+class CalendarOutboxTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Braids", description="", image_url="")
+        self.service = Service.objects.create(name="Knotless", category=category, duration=60, price=200)
+        self.day = salon_today() + timedelta(days=7)
+        opening = working_hours(self.day)[0]
+        self.appointments = []
+        for i in range(2):
+            stylist = UserInfo.objects.create(uid=f"stylist-{i}", display_name=f"Stylist {i}", role="stylist")
+            OAuthCredential.objects.create(user=stylist, refresh_token="refresh")
+            link = StylistService.objects.create(stylist=stylist, service=self.service)
+            with mock.patch("tressreliefapi.utils.booking.get_busy_by_day", return_value=BusyDays({self.day: []})):
+                self.appointments += [book_appointment(link, opening + timedelta(hours=hour)) for hour in (0, 2)]
+        for target, kwargs in (("circuit_breaker._breakers", {"new": {}}),
+                               ("calendar_outbox.get_valid_access_token", {"return_value": "token"})):
+            patcher = mock.patch(f"tressreliefapi.utils.{target}", **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def drain(self, statuses=None, **kwargs):
+        post = batch_answer(statuses or {})
+        with mock.patch("tressreliefapi.utils.calendar_outbox.google_post", side_effect=kwargs.get("side_effect", post)):
+            return drain_outbox(100), post.sent
+
+    def test_one_batch_per_stylist_and_folded_operations(self):
+        cancel_appointment(self.appointments[0])
+        counts, sent = self.drain({str(self.appointments[0].pk): 404})
+        # the create + cancel of the first appointment is one delete, and a 404 for it is fine
+        self.assertEqual(counts, {"done": 5, "retry": 0, "failed": 0, "skipped": 0})
+        self.assertEqual(sorted(len(content_ids) for _, content_ids in sent), [2, 2])
+        self.assertFalse(CalendarOutbox.objects.exclude(status="done").exists())
+        self.assertEqual(self.drain()[1], [])
+
+    def test_retries_with_backoff_and_gives_up_on_refusals(self):
+        retried, refused = self.appointments[0].pk, self.appointments[1].pk
+        started = datetime.now(tzutc())
+        with self.assertLogs("tressreliefapi.utils.calendar_outbox", "WARNING"):
+            counts, _ = self.drain({str(retried): 503, str(refused): 400})
+        self.assertEqual(counts, {"done": 2, "retry": 1, "failed": 1, "skipped": 0})
+        row = CalendarOutbox.objects.get(appointment_id=retried)
+        self.assertEqual((row.status, row.attempts), ("pending", 1))
+        self.assertGreaterEqual(row.next_attempt_at, started + timedelta(seconds=30))
+        self.assertEqual(CalendarOutbox.objects.get(appointment_id=refused).last_error, "POST: HTTP 400")
+
+        # not due yet, then due and google's back
+        self.assertEqual(self.drain()[1], [])
+        CalendarOutbox.objects.filter(appointment_id=retried).update(next_attempt_at=started)
+        self.assertEqual(self.drain()[0]["done"], 1)
+
+    def test_one_stylist_failing_does_not_stop_the_others(self):
+        broken = self.appointments[0].stylist
+
+        def access_token(stylist, prefetched=None):
+            if stylist.id == broken.id:
+                raise RuntimeError("boom")
+            return "token"
+
+        started = datetime.now(tzutc())
+        with mock.patch("tressreliefapi.utils.calendar_outbox.get_valid_access_token", side_effect=access_token), \
+                self.assertLogs("tressreliefapi.utils.calendar_outbox", "ERROR"):
+            counts, sent = self.drain()
+        self.assertEqual(counts, {"done": 2, "retry": 2, "failed": 0, "skipped": 0})
+        self.assertEqual(len(sent), 1)
+        # the broken stylist's rows aren't left leased: they wait out the backoff like any retry
+        for row in CalendarOutbox.objects.filter(appointment__stylist=broken):
+            self.assertEqual((row.status, row.attempts, row.last_error), ("pending", 1, "RuntimeError: boom"))
+            self.assertGreaterEqual(row.next_attempt_at, started + timedelta(seconds=30))
+
+    @override_settings(BUSY_CACHE_TTL_SEC=120, BUSY_STALE_TTL_SEC=3600)
+    def test_written_days_are_dropped_from_the_busy_cache(self):
+        stylist_ids = [appointment.stylist_id for appointment in self.appointments]
+        next_day = self.day + timedelta(days=1)
+        with mock.patch.object(busy_cache, "_backend", LRUBusyCache(10)):
+            for stylist_id in stylist_ids:
+                for day in (self.day, next_day):
+                    cache_busy(stylist_id, day, [])
+            self.drain({str(self.appointments[2].pk): 503, str(self.appointments[3].pk): 503})
+            # the first stylist's events were written, the second stylist's weren't (google answered 503)
+            self.assertIsNone(get_cached_busy(stylist_ids[0], self.day))
+            self.assertIsNone(get_stale_busy(stylist_ids[0], self.day))
+            self.assertEqual(get_cached_busy(stylist_ids[0], next_day), [])
+            self.assertEqual(get_cached_busy(stylist_ids[2], self.day), [])
+
+    def test_overlapping_claims_never_share_an_appointment(self):
+        first = _claim(100)
+        self.assertEqual(len(first), 4)
+        # a cancel queued while the first worker holds the create: a second worker mustn't send it alongside
+        cancel_appointment(self.appointments[0])
+        self.assertEqual(_claim(100), [])
+        # the lease on another appointment runs out (its worker died): that one is claimed again, the first still isn't
+        CalendarOutbox.objects.filter(appointment=self.appointments[1]).update(next_attempt_at=datetime.now(tzutc()) - timedelta(seconds=1))
+        self.assertEqual(_claim(100), [row for row in first if row.appointment_id == self.appointments[1].pk])
+        # once the first worker's lease runs out, the create and the cancel are claimed together
+        CalendarOutbox.objects.filter(appointment=self.appointments[0]).update(next_attempt_at=datetime.now(tzutc()) - timedelta(seconds=1))
+        self.assertEqual([row.operation for row in _claim(100)], ["create", "cancel"])
+
+    def test_unreachable_google_retries_everything(self):
+        counts, _ = self.drain(side_effect=requests.ConnectionError("down"))
+        self.assertEqual(counts["retry"], 4)
+        self.assertEqual(set(CalendarOutbox.objects.values_list("attempts", flat=True)), {1})
+
+
+class MultiCalendarTests(TestCase):
+    def test_busy_times_of_every_calendar_are_merged(self):
+        payload = {"calendars": {
+            "primary": {"busy": [{"start": "2025-10-01T15:00:00Z", "end": "2025-10-01T16:00:00Z"}]},
+            "personal": {"busy": [{"start": "2025-10-01T15:30:00Z", "end": "2025-10-01T17:00:00Z"},
+                                  {"start": "2025-10-01T19:00:00Z", "end": "2025-10-01T20:00:00Z"}]},
+            "deleted": {"errors": [{"domain": "global", "reason": "notFound"}], "busy": []},
+        }}
+        with self.assertLogs("tressreliefapi.utils.google_utils", "WARNING"):
+            busy = parse_freebusy(payload, ("primary", "personal", "deleted"))
+        self.assertEqual(busy, [(datetime(2025, 10, 1, 15, tzinfo=tzutc()), datetime(2025, 10, 1, 17, tzinfo=tzutc())),
+                                (datetime(2025, 10, 1, 19, tzinfo=tzutc()), datetime(2025, 10, 1, 20, tzinfo=tzutc()))])
+        # any other error means we don't know the stylist's busy times
+        payload["calendars"]["personal"] = {"errors": [{"domain": "global", "reason": "backendError"}], "busy": []}
+        self.assertIsNone(parse_freebusy(payload, ("primary", "personal")))
+
+    def test_calendar_list_is_read_from_the_row_not_the_token_cache(self):
+        stylist = UserInfo.objects.create(uid="stylist", display_name="Stylist", role="stylist")
+        OAuthCredential.objects.create(user=stylist, refresh_token="refresh", access_token="access",
+                                       token_expiry=datetime.now(tzutc()) + timedelta(hours=1),
+                                       busy_calendar_ids=["personal", "primary"])
+        # user ids come around again between tests, don't pick up another test's cached token
+        forget_access_token(stylist.id)
+        self.addCleanup(forget_access_token, stylist.id)
+        self.assertEqual(get_valid_access_token(stylist), "access")
+        self.assertEqual(get_busy_calendars(stylist), ("primary", "personal"))
+        # another worker edits the list: this process's token cache isn't told, the next fetch still asks for the new calendars
+        OAuthCredential.objects.filter(user=stylist).update(busy_calendar_ids=["work"])
+        self.assertEqual(get_valid_access_token(stylist), "access")
+        self.assertEqual(get_busy_calendars(stylist), ("primary", "work"))
+        prefetched = prefetch_credentials([stylist.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_busy_calendars(stylist, prefetched=prefetched), ("primary", "work"))
+
+
+class CombinedAvailabilityTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Hair", description="", image_url="")
+        self.cut = Service.objects.create(name="Cut", category=category, duration=45, price=50)
+        self.color = Service.objects.create(name="Color", category=category, duration=90, price=120)
+        self.stylists = [UserInfo.objects.create(uid=f"stylist-{i}", display_name=f"Stylist {i}", role="stylist")
+                         for i in range(3)]
+        # stylist 1 only cuts
+        for stylist, services in zip(self.stylists, ([self.cut, self.color], [self.cut], [self.color, self.cut])):
+            for service in services:
+                StylistService.objects.create(stylist=stylist, service=service)
+        self.day = date(2025, 10, 1)
+        opening = working_hours(self.day)[0]
+        self.busy = {self.stylists[0].id: [(opening + timedelta(hours=1), opening + timedelta(hours=2))],
+                     self.stylists[2].id: []}
+
+    def get(self, query):
+        with mock.patch("tressreliefapi.utils.stylist_busy.get_busy_by_day",
+                        side_effect=lambda stylist, dates, credentials, deadline=None: BusyDays({self.day: self.busy[stylist.id]})) as fetch, \
+                mock.patch("tressreliefapi.utils.stylist_busy.prefetch_credentials", return_value={}):
+            body = self.client.get(f"/availability/combined/?services={self.cut.id},{self.color.id}&date={self.day}&{query}").json()
+        return body, fetch.call_count
+
+    def test_slots_for_the_summed_duration_from_stylists_offering_everything(self):
+        body, fetches = self.get("")
+        self.assertEqual(fetches, 2)  # once per eligible stylist for the whole combination
+        self.assertEqual(body["duration"], 135)
+        self.assertEqual([(segment["name"], segment["offset_min"]) for segment in body["services"]], [("Cut", 0), ("Color", 45)])
+        self.assertEqual([stylist["stylist_id"] for stylist in body["stylists"]], [self.stylists[0].id, self.stylists[2].id])
+        for stylist in body["stylists"]:
+            self.assertEqual(stylist["slots"], generate_slots_batch_np(135, [(self.day, self.busy[stylist["stylist_id"]])], as_strings=True)[0])
+
+    def test_intervals_and_errors(self):
+        body, _ = self.get("format=intervals")
+        self.assertEqual(body["duration"], 135)
+        self.assertEqual(body["stylists"][1]["intervals"],
+                         json.loads(json.dumps(bookable_intervals(135, [], self.day), cls=JSONEncoder)))
+        self.assertEqual(self.client.get(f"/availability/combined/?services=x&date={self.day}").status_code, 400)
+        self.assertEqual(self.client.get(f"/availability/combined/?services={self.cut.id},999&date={self.day}").status_code, 404)
+
+
+class StylistAvailabilityTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Hair", description="", image_url="")
+        self.stylist = UserInfo.objects.create(uid="stylist", display_name="Stylist", role="stylist")
+        self.services = [Service.objects.create(name=name, category=category, duration=duration, price=50)
+                         for name, duration in (("Cut", 45), ("Trim", 45), ("Color", 90))]
+        for service in self.services:
+            StylistService.objects.create(stylist=self.stylist, service=service)
+        self.day = date(2025, 10, 1)
+        opening = working_hours(self.day)[0]
+        self.busy = [(opening + timedelta(hours=2), opening + timedelta(hours=3, minutes=10))]
+
+    def get(self, query, busy_by_day):
+        with mock.patch("tressreliefapi.utils.stylist_busy.get_busy_by_day", return_value=busy_by_day) as fetch, \
+                mock.patch("tressreliefapi.utils.stylist_busy.prefetch_credentials", return_value={}):
+            body = self.client.get(f"/userinfo/{self.stylist.id}/availability?{query}").json()
+        self.assertEqual(fetch.call_count, 1)
+        return body
+
+    def test_every_service_from_one_fetch(self):
+        body = self.get(f"date={self.day}", BusyDays({self.day: self.busy}))
+        self.assertEqual([service["name"] for service in body["services"]], ["Cut", "Trim", "Color"])
+        for service, entry in zip(self.services, body["services"]):
+            expected = generate_available_slots(service.duration, self.busy, self.day)
+            self.assertEqual(entry["slots"], json.loads(json.dumps(expected, cls=JSONEncoder)))
+
+        body = self.get(f"start={self.day}&end={self.day}&format=intervals", BusyDays({self.day: self.busy}))
+        self.assertEqual(body["days"][0]["services"][2]["intervals"],
+                         json.loads(json.dumps(bookable_intervals(90, self.busy, self.day), cls=JSONEncoder)))
+
+    def test_no_calendar_means_no_services(self):
+        self.assertEqual(self.get(f"date={self.day}", None)["services"], [])
+
+
+class AvailabilitySummaryTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Hair", description="", image_url="")
+        self.service = Service.objects.create(name="Cut", category=category, duration=60, price=50)
+        self.stylists = [UserInfo.objects.create(uid=f"stylist{i}", display_name=f"Stylist {i}", role="stylist") for i in range(2)]
+        for stylist in self.stylists:
+            StylistService.objects.create(stylist=stylist, service=self.service)
+        self.dates = [date(2025, 2, 1) + timedelta(days=i) for i in range(28)]
+        rng = random.Random(19)
+        self.busy = {stylist.id: BusyDays({day: random_busy(rng, day, 4) for day in self.dates}) for stylist in self.stylists}
+        # the first stylist is booked solid on the 3rd
+        self.busy[self.stylists[0].id][self.dates[2]] = [working_hours(self.dates[2])]
+
+    def get(self, query):
+        with mock.patch("tressreliefapi.utils.stylist_busy.get_busy_by_day",
+                        side_effect=lambda stylist, dates, credentials, deadline=None: self.busy[stylist.id]) as fetch, \
+                mock.patch("tressreliefapi.utils.stylist_busy.prefetch_credentials", return_value={}):
+            response = self.client.get(f"/services/{self.service.id}/availability/summary/?{query}")
+        return response, fetch
+
+    def test_counts_per_day_from_one_fetch_per_stylist(self):
+        response, fetch = self.get("month=2025-02")
+        self.assertEqual(fetch.call_count, 2)
+        self.assertTrue(all(call.args[1] == self.dates for call in fetch.call_args_list))
+        body = response.json()
+        self.assertEqual(len(body["days"]), 28)
+        for day, entry in zip(self.dates, body["days"]):
+            counts = [len(generate_available_slots(60, list(self.busy[stylist.id][day]), day)) for stylist in self.stylists]
+            self.assertEqual(entry, {"date": str(day), "open_slots": sum(counts),
+                                     "stylists_available": sum(count > 0 for count in counts),
+                                     "open_times": self.grid_open_times(day)})
+        self.assertEqual(body["days"][2]["stylists_available"], 1)
+        self.assertFalse(body["partial"])
+
+    def grid_open_times(self, day):
+        """ Start times on the 15 minute grid from opening where some stylist has no busy time touching any of the 4 cells the hour needs."""
+        opening, closing = working_hours(day)
+        cells = [opening + timedelta(minutes=15 * i) for i in range((closing - opening) // timedelta(minutes=15))]
+
+        def cell_free(stylist, cell):
+            return not any(start < cell + timedelta(minutes=15) and end > cell for start, end in self.busy[stylist.id][day])
+        return sum(any(all(cell_free(stylist, cell) for cell in cells[i:i + 4]) for stylist in self.stylists)
+                   for i in range(len(cells) - 3))
+
+    def test_bad_month(self):
+        for month in ("", "2025-13", "2025-02-01", "feb"):
+            self.assertEqual(self.get(f"month={month}")[0].status_code, 400)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    def test_overlapping_bookings_from_other_processes_get_one_appointment(self):
+        category = Category.objects.create(name="Braids", description="", image_url="")
+        service = Service.objects.create(name="Knotless", category=category, duration=60, price=200)
+        stylist = UserInfo.objects.create(uid="stylist", display_name="Stylist", role="stylist")
+        link = StylistService.objects.create(stylist=stylist, service=service)
+        day = salon_today() + timedelta(days=7)
+        opening = working_hours(day)[0]
+        barrier = threading.Barrier(2)
+
+        def free_intervals_after_both_checked(*args):
+            free = day_free_intervals(*args)
+            barrier.wait()  # both bookings passed the free-window check before either one inserts
+            return free
+
+        def book(start):
+            try:
+                return book_appointment(link, start)
+            except SlotTaken:
+                return None
+            finally:
+                connection.close()
+
+        # stand-in for separate processes: no shared per-stylist lock (and no row lock on sqlite)
+        with mock.patch("tressreliefapi.utils.booking._booking_lock", side_effect=lambda stylist_id: threading.Lock()), \
+                mock.patch("tressreliefapi.utils.booking.day_free_intervals", side_effect=free_intervals_after_both_checked), \
+                mock.patch("tressreliefapi.utils.booking.get_busy_by_day", return_value=BusyDays({day: []})), \
+                ThreadPoolExecutor(max_workers=2) as executor:
+            booked = list(executor.map(book, (opening, opening + timedelta(minutes=30))))
+        self.assertEqual(sum(appointment is not None for appointment in booked), 1)
+        self.assertEqual(Appointment.objects.filter(status="booked").count(), 1)
+
+
+@override_settings(GOOGLE_HTTP_RETRIES=3, GOOGLE_HTTP_CONNECT_TIMEOUT=2, GOOGLE_HTTP_READ_TIMEOUT=7)
+class GoogleTransportTests(SimpleTestCase):
+    def setUp(self):
+        # fresh sessions built with the settings above
+        patcher = mock.patch.dict(google_transport._sessions, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_shared_session_retries_5xx_with_backoff(self):
+        session = google_transport.get_session()
+        self.assertIs(google_transport.get_session(), session)
+        retry = session.get_adapter("https://www.googleapis.com").max_retries
+        self.assertEqual(retry.total, 3)
+        self.assertEqual(set(retry.status_forcelist), {500, 502, 503, 504})
+        self.assertIn("POST", retry.allowed_methods)
+        self.assertFalse(retry.raise_on_status)
+
+    def test_calls_get_timeouts_and_single_use_calls_are_sent_once(self):
+        self.assertEqual(google_transport.get_session(retry_calls=False)
+                         .get_adapter("https://oauth2.googleapis.com").max_retries.total, 0)
+        response = mock.Mock(status_code=429, json=lambda: {"error": {"errors": [{"reason": "rateLimitExceeded"}]}},
+                             headers={})
+        for retry, sessions in ((False, [False]), (True, [True] * 4)):
+            with mock.patch.object(google_transport, "get_session") as get_session, \
+                    mock.patch.object(google_transport, "get_rate_limiter"):
+                get_session.return_value.request.return_value = response
+                google_transport.google_post("https://oauth2.googleapis.com/token", retry=retry)
+            self.assertEqual([call.args[0] for call in get_session.call_args_list], sessions)
+            self.assertEqual(get_session.return_value.request.call_args.kwargs["timeout"], (2, 7))
+
+    @override_settings(GOOGLE_RATE_MAX_WAIT_SEC=0.5)
+    def test_429_retry_after_goes_to_the_limiter_not_urllib3(self):
+        requests_seen = []
+
+        class TooManyRequests(BaseHTTPRequestHandler):
+            def do_POST(self):
+                requests_seen.append(self.path)
+                self.send_response(429)
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), TooManyRequests)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        limiter = RateLimiter()
+        started = time.monotonic()
+        # the limiter pauses for the Retry-After, which is longer than a call may wait for its turn, so the retry isn't sent
+        with mock.patch.object(google_transport, "get_rate_limiter", return_value=limiter), \
+                self.assertRaises(GoogleRateLimited):
+            google_transport.google_post(f"http://127.0.0.1:{server.server_port}/token")
+        self.assertEqual(requests_seen, ["/token"])
+        self.assertEqual(limiter.metrics()["retry_after_pauses"], 1)
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class ParallelFanOutOrderTests(SimpleTestCase):
+    def test_results_follow_the_stylist_order_not_finish_order(self):
+        stylists = [SimpleNamespace(id=stylist_id) for stylist_id in range(1, 7)]
+
+        def fake_get_busy_by_day(stylist, dates, credentials, deadline=None):
+            # the first stylists answer last
+            time.sleep(0.02 * (7 - stylist.id))
+            return {dates[0]: []}
+
+        with mock.patch("tressreliefapi.utils.stylist_busy.prefetch_credentials", return_value={}), \
+                mock.patch("tressreliefapi.utils.stylist_busy.appointments_by_day", return_value={}), \
+                mock.patch("tressreliefapi.utils.stylist_busy.get_busy_by_day", side_effect=fake_get_busy_by_day):
+            started = time.monotonic()
+            results, timed_out = gather_stylists_busy(stylists, [date(2025, 10, 1)], lambda stylist, busy_by_day: stylist.id)
+        self.assertEqual(results, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(timed_out, [])
+        # at the same time, not one after the other (0.42s)
+        self.assertLess(time.monotonic() - started, 0.3)
+
+
+class AsyncAvailabilityOrderTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Hair", description="", image_url="")
+        self.service = Service.objects.create(name="Cut", category=category, duration=60, price=50)
+        self.stylists = [UserInfo.objects.create(uid=f"stylist{i}", display_name=f"Stylist {i}", role="stylist") for i in range(4)]
+        for stylist in self.stylists:
+            StylistService.objects.create(stylist=stylist, service=self.service)
+
+    async def test_stylists_in_link_order_not_finish_order(self):
+        day = date(2025, 10, 1)
+        last = self.stylists[-1].id
+
+        async def fake_aget_busy_by_day(stylist, dates, credentials=None):
+            # the first stylists answer last
+            await asyncio.sleep(0.02 * (last - stylist.id))
+            return BusyDays({day: []})
+
+        with mock.patch("tressreliefapi.views.availability_async.aget_busy_by_day", side_effect=fake_aget_busy_by_day), \
+                mock.patch("tressreliefapi.views.availability_async.aneeds_fetch", return_value=False), \
+                mock.patch("tressreliefapi.views.availability_async.aprefetch_credentials", return_value={}), \
+                mock.patch("tressreliefapi.views.availability_async.aappointments_by_day", return_value={}):
+            response = await self.async_client.get(f"/services/{self.service.id}/availability/async/?date={day}")
+        self.assertEqual([entry["stylist_id"] for entry in response.json()], [stylist.id for stylist in self.stylists])
+        self.assertEqual(response["X-Availability-Partial"], "false")
+
+
+class CredentialPrefetchTests(TestCase):
+    def setUp(self):
+        self.stylists = [UserInfo.objects.create(uid=f"stylist{i}", display_name=f"Stylist {i}", role="stylist") for i in range(3)]
+        for stylist in self.stylists[:2]:
+            OAuthCredential.objects.create(user=stylist, refresh_token="refresh", access_token=f"access{stylist.id}",
+                                           token_expiry=datetime.now(tzutc()) + timedelta(hours=1))
+        for stylist in self.stylists:
+            # user ids come around again between tests, don't pick up another test's cached token
+            forget_access_token(stylist.id)
+            self.addCleanup(forget_access_token, stylist.id)
+
+    def test_one_query_for_every_stylist(self):
+        ids = [stylist.id for stylist in self.stylists]
+        with self.assertNumQueries(1):
+            prefetched = prefetch_credentials(ids)
+        self.assertEqual(set(prefetched), set(ids))
+        self.assertIsNone(prefetched[self.stylists[2].id])
+        with self.assertNumQueries(0):
+            tokens = [get_valid_access_token(stylist, prefetched=prefetched) for stylist in self.stylists]
+            self.assertEqual(get_busy_calendars(self.stylists[0], prefetched=prefetched), ("primary",))
+        self.assertEqual(tokens, [f"access{self.stylists[0].id}", f"access{self.stylists[1].id}", None])
+
+        # the valid tokens are cached now, but the credentials still come along (for the calendar lists), in the same one query
+        with self.assertNumQueries(1):
+            self.assertEqual(set(prefetch_credentials(ids)), set(ids))
+        with self.assertNumQueries(0):
+            self.assertEqual(prefetch_credentials([]), {})
+            self.assertEqual(get_valid_access_token(self.stylists[0]), f"access{self.stylists[0].id}")
+
+
+class TokenRefreshCoalescingTests(TransactionTestCase):
+    # each thread has its own db connection, so the credential has to be committed for them to see it
+
+    def test_concurrent_refreshes_make_one_google_call(self):
+        stylist = UserInfo.objects.create(uid="stylist", display_name="Stylist", role="stylist")
+        credential = OAuthCredential.objects.create(user=stylist, refresh_token="refresh", access_token="old",
+                                                    token_expiry=datetime.now(tzutc()) - timedelta(minutes=1))
+        forget_access_token(stylist.id)
+        self.addCleanup(forget_access_token, stylist.id)
+
+        def fake_google_post(url, **kwargs):
+            time.sleep(0.1)  # long enough for every thread to pile up behind the first
+            return mock.Mock(status_code=200, json=lambda: {"access_token": "new", "expires_in": 3600})
+
+        def refresh(_):
+            try:
+                return get_valid_access_token(stylist, prefetched={stylist.id: credential})
+            finally:
+                connection.close()
+
+        with mock.patch("tressreliefapi.utils.google_utils.google_post", side_effect=fake_google_post) as post, \
+                ThreadPoolExecutor(max_workers=8) as executor:
+            tokens = list(executor.map(refresh, range(8)))
+        self.assertEqual(tokens, ["new"] * 8)
+        self.assertEqual(post.call_count, 1)
+        credential.refresh_from_db()
+        self.assertEqual(credential.access_token, "new")
+
+    def test_workers_in_other_processes_wait_for_the_refresh_lock(self):
+        stylist = UserInfo.objects.create(uid="stylist", display_name="Stylist", role="stylist")
+        credential = OAuthCredential.objects.create(user=stylist, refresh_token="refresh", access_token="old",
+                                                    token_expiry=datetime.now(tzutc()) - timedelta(minutes=1))
+        self.addCleanup(forget_access_token, stylist.id)
+        # stand-in for separate processes: no shared per-process lock, and nothing in the token cache
+        for patcher in (mock.patch("tressreliefapi.utils.google_utils._refresh_lock", side_effect=lambda pk: threading.Lock()),
+                        mock.patch("tressreliefapi.utils.google_utils.cache_access_token")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        def fake_google_post(url, **kwargs):
+            time.sleep(0.2)
+            return mock.Mock(status_code=200, json=lambda: {"access_token": "new", "expires_in": 3600})
+
+        def refresh(_):
+            try:
+                return refresh_access_token(credential)
+            finally:
+                connection.close()
+
+        with mock.patch("tressreliefapi.utils.google_utils.google_post", side_effect=fake_google_post) as post, \
+                ThreadPoolExecutor(max_workers=4) as executor:
+            tokens = list(executor.map(refresh, range(4)))
+        self.assertEqual(tokens, ["new"] * 4)
+        self.assertEqual(post.call_count, 1)
+        credential.refresh_from_db()
+        self.assertIsNone(credential.refresh_lock_until)
+
+    def test_failed_refresh_releases_the_lock_and_expired_locks_are_taken_over(self):
+        stylist = UserInfo.objects.create(uid="stylist", display_name="Stylist", role="stylist")
+        credential = OAuthCredential.objects.create(user=stylist, refresh_token="refresh", access_token="old",
+                                                    token_expiry=datetime.now(tzutc()) - timedelta(minutes=1),
+                                                    # left behind by a worker that died mid-refresh
+                                                    refresh_lock_until=datetime.now(tzutc()) - timedelta(seconds=1))
+        self.addCleanup(forget_access_token, stylist.id)
+        with mock.patch("tressreliefapi.utils.google_utils.google_post",
+                        return_value=mock.Mock(status_code=400, json=lambda: {"error": "invalid_grant"})):
+            self.assertIsNone(refresh_access_token(credential))
+        credential.refresh_from_db()
+        self.assertIsNone(credential.refresh_lock_until)
+
+
+class RefreshGoogleTokensCommandTests(TransactionTestCase):
+    # the command refreshes on worker threads, which have their own db connections
+
+    def test_refreshes_only_tokens_expiring_within_the_window(self):
+        now = datetime.now(tzutc())
+        credentials = {}
+        for name, expires_in, refresh_token in (("soon", 5, "good"), ("later", 120, "good"), ("revoked", 5, "revoked")):
+            stylist = UserInfo.objects.create(uid=name, display_name=name, role="stylist")
+            forget_access_token(stylist.id)
+            self.addCleanup(forget_access_token, stylist.id)
+            credentials[name] = OAuthCredential.objects.create(
+                user=stylist, refresh_token=refresh_token, access_token="old", token_expiry=now + timedelta(minutes=expires_in))
+
+        def fake_google_post(url, data, **kwargs):
+            if data["refresh_token"] == "revoked":
+                return mock.Mock(status_code=400, json=lambda: {"error": "invalid_grant"})
+            return mock.Mock(status_code=200, json=lambda: {"access_token": "new", "expires_in": 3600})
+
+        out = StringIO()
+        with mock.patch("tressreliefapi.utils.google_utils.google_post", side_effect=fake_google_post) as post:
+            call_command("refresh_google_tokens", "--window-minutes", "10", "--workers", "2", stdout=out)
+        self.assertEqual(post.call_count, 2)
+        self.assertIn("Refreshed 1 token(s), 1 failed.", out.getvalue())
+        tokens = {name: OAuthCredential.objects.get(pk=credential.pk).access_token for name, credential in credentials.items()}
+        self.assertEqual(tokens, {"soon": "new", "later": "old", "revoked": "old"})
+
+
+class LRUBusyCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("tressreliefapi.utils.busy_cache.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_entries_expire_after_their_ttl(self):
+        cache = LRUBusyCache(10)
+        cache.set("a", 1, ttl=60)
+        self.now += 59
+        self.assertEqual(cache.get("a"), 1)
+        self.now += 1
+        self.assertIsNone(cache.get("a"))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUBusyCache(2)
+        cache.set("a", 1, ttl=60)
+        cache.set("b", 2, ttl=60)
+        cache.get("a")  # b is the least recently used now
+        cache.set("c", 3, ttl=60)
+        self.assertEqual([cache.get(key) for key in ("a", "b", "c")], [1, None, 3])
+
+    @override_settings(BUSY_CACHE_TTL_SEC=120, BUSY_STALE_TTL_SEC=3600)
+    def test_invalidate_busy_drops_the_day_and_its_stale_copy(self):
+        days = [date(2025, 10, 1), date(2025, 10, 2)]
+        busy = [(datetime(2025, 10, 1, 15, tzinfo=tzutc()), datetime(2025, 10, 1, 16, tzinfo=tzutc()))]
+        with mock.patch.object(busy_cache, "_backend", LRUBusyCache(10)):
+            for day in days:
+                cache_busy(7, day, busy)
+            invalidate_busy(7, days[:1])
+            self.assertIsNone(get_cached_busy(7, days[0]))
+            self.assertIsNone(get_stale_busy(7, days[0]))
+            self.assertEqual(get_cached_busy(7, days[1]), busy)
+            self.assertEqual(get_stale_busy(7, days[1])[0], busy)
+
+
+class SplitBusyByDayTests(SimpleTestCase):
+    def test_intervals_crossing_midnight_are_clipped_to_each_day(self):
+        days = [date(2025, 10, 1), date(2025, 10, 2), date(2025, 10, 3)]
+        first_start, first_end = local_day_bounds(days[0])
+        overnight = (first_end - timedelta(hours=2), first_end + timedelta(hours=3))  # 10pm to 3am local
+        multi_day = (first_start + timedelta(hours=20), local_day_bounds(days[2])[0] + timedelta(hours=1))
+        busy_by_day = split_busy_by_day([overnight, multi_day], days)
+        self.assertEqual(busy_by_day[days[0]], [(overnight[0], first_end), (multi_day[0], first_end)])
+        self.assertEqual(busy_by_day[days[1]], [(first_end, overnight[1]), local_day_bounds(days[1])])
+        self.assertEqual(busy_by_day[days[2]], [(local_day_bounds(days[2])[0], multi_day[1])])
+
+    def test_dst_days_use_local_midnight(self):
+        # 2025-11-02 is 25 hours long in Chicago
+        day = date(2025, 11, 2)
+        day_start, day_end = local_day_bounds(day)
+        self.assertEqual(day_end - day_start, timedelta(hours=25))
+        busy_by_day = split_busy_by_day([(day_start - timedelta(hours=1), day_end + timedelta(hours=1))], [day])
+        self.assertEqual(busy_by_day, {day: [(day_start, day_end)]})
+
+
+class FreeIntervalsTests(SimpleTestCase):
+    def test_busy_time_after_closing_is_not_free_time(self):
+        day = date(2025, 10, 1)
+        opening, closing = working_hours(day)
+        # a 6pm event used to make the whole gap up to 6pm free, past the 5pm closing
+        evening = [(closing + timedelta(hours=1), closing + timedelta(hours=2))]
+        self.assertEqual(free_intervals(list(evening), day), [(opening, closing)])
+        self.assertEqual(generate_available_slots(60, list(evening), day)[-1][1], closing)
+        lunch = [(opening + timedelta(hours=3), opening + timedelta(hours=4))]
+        self.assertEqual(free_intervals(lunch + evening, day),
+                         [(opening, lunch[0][0]), (lunch[0][1], closing)])
+
+
+class SlotEngineSettingTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Hair", description="", image_url="")
+        self.service = Service.objects.create(name="Cut", category=category, duration=60, price=50)
+        self.stylists = [UserInfo.objects.create(uid=f"stylist{i}", display_name=f"Stylist {i}", role="stylist") for i in range(3)]
+        for stylist in self.stylists:
+            StylistService.objects.create(stylist=stylist, service=self.service)
+        rng = random.Random(23)
+        self.dates = [date(2025, 10, 31) + timedelta(days=i) for i in range(4)]
+        self.busy = {stylist.id: {day: random_busy(rng, day, 4) for day in self.dates} for stylist in self.stylists}
+
+    def get(self, query):
+        with mock.patch("tressreliefapi.utils.stylist_busy.get_busy_by_day",
+                        side_effect=lambda stylist, dates, credentials, deadline=None: BusyDays(
+                            {day: list(self.busy[stylist.id][day]) for day in dates})), \
+                mock.patch("tressreliefapi.utils.stylist_busy.prefetch_credentials", return_value={}):
+            return self.client.get(f"/services/{self.service.id}/availability/?{query}").json()
+
+    def test_numpy_is_the_default_and_python_answers_the_same(self):
+        self.assertEqual(settings.AVAILABILITY_SLOT_ENGINE, "numpy")
+        for query in (f"date={self.dates[0]}", f"start={self.dates[0]}&end={self.dates[-1]}",
+                      f"start={self.dates[0]}&end={self.dates[-1]}&any=true", f"date={self.dates[0]}&source=snapshot"):
+            numpy_body = self.get(query)
+            with override_settings(AVAILABILITY_SLOT_ENGINE="python"):
+                self.assertEqual(self.get(query), numpy_body)
+
+    def test_snapshots_use_the_configured_engine(self):
+        for engine in ("numpy", "python"):
+            with override_settings(AVAILABILITY_SLOT_ENGINE=engine), \
+                    mock.patch(f"tressreliefapi.utils.slot_engine.{'slots_by_day_np' if engine == 'numpy' else 'generate_available_slots'}",
+                               wraps=slots_by_day_np if engine == "numpy" else generate_available_slots) as engine_call, \
+                    mock.patch("tressreliefapi.utils.availability_snapshot.map_stylists_busy",
+                               return_value=[BusyDays(self.busy[stylist.id]) for stylist in self.stylists]):
+                build_snapshots(self.dates)
+            self.assertTrue(engine_call.called)
+            self.assertEqual(AvailabilitySnapshot.objects.count(), len(self.stylists) * len(self.dates))
+        snapshot = AvailabilitySnapshot.objects.get(stylist=self.stylists[0], date=self.dates[0])
+        self.assertEqual(snapshot.slots, json.loads(json.dumps(
+            generate_available_slots(60, self.busy[self.stylists[0].id][self.dates[0]], self.dates[0]), cls=JSONEncoder)))
+
+
+class SlotGranularityTests(SimpleTestCase):
+    def test_every_engine_defaults_to_the_setting(self):
+        self.assertEqual(SLOT_GRANULARITY_MIN, settings.APPT_SLOT_GRANULARITY_MIN)
+        for function, parameter in ((generate_available_slots, "slot_granularity"), (count_slots, "slot_granularity"),
+                                    (generate_available_slots_np, "slot_granularity"), (generate_slots_batch_np, "slot_granularity"),
+                                    (slots_by_day_np, "slot_granularity"), (DayBitmap.from_busy, "granularity"),
+                                    (DayBitmap.free_day, "granularity")):
+            self.assertEqual(inspect.signature(function).parameters[parameter].default, SLOT_GRANULARITY_MIN, function)
+
+
+class NextAvailableDeadlineTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Hair", description="", image_url="")
+        self.service = Service.objects.create(name="Cut", category=category, duration=60, price=50)
+        self.fast, self.slow = [UserInfo.objects.create(uid=name, display_name=name, role="stylist") for name in ("fast", "slow")]
+        for stylist in (self.fast, self.slow):
+            StylistService.objects.create(stylist=stylist, service=self.service)
+
+    @override_settings(AVAILABILITY_DEADLINE_SEC=0.3)
+    def test_slow_stylist_is_reported_and_the_request_answers_on_time(self):
+        def fake_get_busy_by_day(stylist, dates, credentials, deadline=None):
+            if stylist.id == self.slow.id:
+                time.sleep(2)
+            return BusyDays({day: [] for day in dates})
+
+        day = salon_today() + timedelta(days=30)
+        with mock.patch("tressreliefapi.utils.stylist_busy.get_busy_by_day", side_effect=fake_get_busy_by_day), \
+                mock.patch("tressreliefapi.utils.stylist_busy.prefetch_credentials", return_value={}), \
+                mock.patch("tressreliefapi.utils.stylist_busy.appointments_by_day", return_value={}):
+            started = time.monotonic()
+            body = self.client.get(f"/services/{self.service.id}/next-available/?from={day}&count=2").json()
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(body["partial"])
+        self.assertEqual([stylist["stylist_id"] for stylist in body["timed_out_stylists"]], [self.slow.id])
+        self.assertEqual([slot["stylist_id"] for slot in body["slots"]], [self.fast.id] * 2)
+
+
+class GoogleMetricsAccessTests(SimpleTestCase):
+    def test_needs_the_token_or_debug(self):
+        # django logs every 403 as a warning
+        with override_settings(GOOGLE_METRICS_TOKEN="", DEBUG=False), self.assertLogs("django.request", "WARNING"):
+            self.assertEqual(self.client.get("/metrics/google").status_code, 403)
+        with override_settings(GOOGLE_METRICS_TOKEN="", DEBUG=True):
+            self.assertEqual(self.client.get("/metrics/google").status_code, 200)
+        with override_settings(GOOGLE_METRICS_TOKEN="secret", DEBUG=True):
+            with self.assertLogs("django.request", "WARNING"):
+                self.assertEqual(self.client.get("/metrics/google").status_code, 403)
+                self.assertEqual(self.client.get("/metrics/google", HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+            response = self.client.get("/metrics/google", HTTP_AUTHORIZATION="Bearer secret")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("rate_limit", response.json())
+
+
+class CredentialEditTests(TestCase):
+    def setUp(self):
+        self.stylist = UserInfo.objects.create(uid="stylist", display_name="Stylist", role="stylist")
+        self.credential = OAuthCredential.objects.create(user=self.stylist, refresh_token="refresh", access_token="access",
+                                                         token_expiry=datetime.now(tzutc()) + timedelta(hours=1))
+        forget_access_token(self.stylist.id)
+        self.addCleanup(forget_access_token, self.stylist.id)
+        patcher = mock.patch.object(busy_cache, "_backend", LRUBusyCache(100))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.days = [salon_today() + timedelta(days=i) for i in (0, 3, 30)]
+        for day in self.days:
+            cache_busy(self.stylist.id, day, [])
+
+    def test_changing_the_calendars_drops_the_cached_busy_days(self):
+        get_valid_access_token(self.stylist)
+        response = self.client.patch(f"/oauth-credentials/{self.credential.id}", {"busy_calendar_ids": ["personal"]},
+                                     content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([get_cached_busy(self.stylist.id, day) for day in self.days], [None] * 3)
+        self.assertEqual(get_busy_calendars(self.stylist), ("primary", "personal"))
+
+    def test_deleting_drops_the_cached_busy_days(self):
+        self.assertEqual(self.client.delete(f"/oauth-credentials/{self.credential.id}").status_code, 204)
+        self.assertEqual([get_stale_busy(self.stylist.id, day) for day in self.days], [None] * 3)
+
+    def test_calendar_ids_must_be_a_list_of_ids(self):
+        for value in ("personal", ["personal", ""], [1, {"id": "x"}]):
+            response = self.client.patch(f"/oauth-credentials/{self.credential.id}", {"busy_calendar_ids": value},
+                                         content_type="application/json")
+            self.assertEqual(response.status_code, 400, value)
+        self.credential.refresh_from_db()
+        self.assertEqual(self.credential.busy_calendar_ids, [])
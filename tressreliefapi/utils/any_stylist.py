@@ -0,0 +1,49 @@
+# "Any stylist" availability: merge every stylist's slots for a day into one list of distinct start times,
+# each with the ids of the stylists who are free then, so the client doesn't have to de-dupe stylists x slots itself.
+#
+# Each stylist's slots are already sorted by start time, so a sweep over all of them at once (heapq.merge) visits every start time in order
+# and groups the stylists that share it, in O(total slots x log(stylists)) with no sorting of the whole thing.
+# Works on datetimes (python slot engine) and on ISO strings (numpy slot engine) alike, since the strings sort chronologically.
+
+import heapq
+from itertools import groupby
+
+# how the stylist ids of a merged slot are ordered, i.e. who the client gets if they just take the first one
+#   order: the order the stylists are linked to the service
+#   round_robin: rotate the order from one start time to the next, so first picks are spread evenly
+#   most_free: stylists with the most free slots that day first (spreads bookings out)
+#   least_free: stylists with the fewest free slots that day first (packs bookings, keeps whole days open)
+ASSIGNMENT_POLICIES = ("order", "round_robin", "most_free", "least_free")
+
+
+def _tagged(stylist_id, slots):
+    for start, end in slots:
+        yield start, end, stylist_id
+
+
+def merge_stylist_slots(stylist_slots, policy="order"):
+    """ stylist_slots is a list of (stylist_id, slots) in link order, slots being (start, end) pairs sorted by start.
+    Returns [{"start", "end", "stylist_ids"}] with one entry per distinct start time, in time order."""
+    rank = {stylist_id: position
+            for position, (stylist_id, _) in enumerate(stylist_slots)}
+    if policy in ("most_free", "least_free"):
+        sign = -1 if policy == "most_free" else 1
+        rank = {stylist_id: (sign * len(slots), rank[stylist_id])
+                for stylist_id, slots in stylist_slots}
+
+    # each stylist's slots become (start, end, stylist_id) and the sweep yields them all in start time order
+    sweep = heapq.merge(*(_tagged(stylist_id, slots)
+                          for stylist_id, slots in stylist_slots))
+    merged = []
+    for index, (start, group) in enumerate(groupby(sweep, key=lambda slot: slot[0])):
+        group = list(group)
+        # every slot at a start time has the same end (start + service duration)
+        stylist_ids = [stylist_id for _, _, stylist_id in group]
+        if policy == "round_robin":
+            # the k-th start time prefers the k-th stylist (counting round all of them), then whoever comes after
+            stylist_ids.sort(key=lambda stylist_id: (
+                rank[stylist_id] - index) % len(rank))
+        else:
+            stylist_ids.sort(key=rank.get)
+        merged.append({"start": start, "end": group[0][1], "stylist_ids": stylist_ids})
+    return merged
@@ -0,0 +1,44 @@
+# Booked appointments (the local ledger) as busy times, so availability subtracts them on top of google's busy times
+# without waiting for them to show up on the stylist's calendar.
+
+from tressreliefapi.models import Appointment
+from tressreliefapi.utils.availability import local_day_bounds, split_busy_by_day
+
+
+def _booked(stylist_ids, dates):
+    range_start, range_end = local_day_bounds(min(dates))[0], local_day_bounds(max(dates))[1]
+    # the (stylist, start, end) index covers this
+    return (Appointment.objects.filter(stylist_id__in=stylist_ids, status="booked",
+                                       start__lt=range_end, end__gt=range_start)
+            .values_list("stylist_id", "start", "end"))
+
+
+def _by_stylist_day(rows, dates):
+    intervals = {}
+    for stylist_id, start, end in rows:
+        intervals.setdefault(stylist_id, []).append((start, end))
+    return {stylist_id: split_busy_by_day(stylist_intervals, dates)
+            for stylist_id, stylist_intervals in intervals.items()}
+
+
+def appointments_by_day(stylist_ids, dates):
+    """ {stylist_id: {date: [(start, end), ...]}} of the booked appointments of every stylist on the dates, in one query.
+    Stylists with no appointments on any of the dates are left out."""
+    if not stylist_ids or not dates:
+        return {}
+    return _by_stylist_day(_booked(stylist_ids, dates), dates)
+
+
+async def aappointments_by_day(stylist_ids, dates):
+    """ Async version of appointments_by_day()."""
+    if not stylist_ids or not dates:
+        return {}
+    return _by_stylist_day([row async for row in _booked(stylist_ids, dates)], dates)
+
+
+def add_appointments(busy_by_day, appointments):
+    """ Add one stylist's appointments ({date: intervals}, from appointments_by_day()) to their busy intervals, in place. Returns busy_by_day."""
+    for date, intervals in appointments.items():
+        if date in busy_by_day:
+            busy_by_day[date] = busy_by_day[date] + intervals
+    return busy_by_day
@@ -2,10 +2,47 @@
 
 from datetime import datetime, time, timedelta
 import pytz
+from django.conf import settings
 
 # FreeBusy API will give me a list of time ranges when the stylist is busy, represented as start and end datetimes in UTC. E.g.,
 # busy_intervals = [(start_time_utc, end_time_utc), ...]
 
+# the salon's time zone. working hours and "days" are in this time zone
+SALON_TZ = pytz.timezone('America/Chicago')  # Central Time Zone object
+WORKDAY_START = time(9, 0)  # 9:00 AM CST
+WORKDAY_END = time(17, 0)  # 5:00 PM CST
+# a slot can start every APPT_SLOT_GRANULARITY_MIN minutes (15 by default). every slot engine defaults to this one value
+SLOT_GRANULARITY_MIN = settings.APPT_SLOT_GRANULARITY_MIN
+
+
+def local_day_bounds(date):
+    """ (start, end) in UTC of the whole salon-local day: local midnight to the next local midnight."""
+    start = SALON_TZ.localize(datetime.combine(date, time(0, 0)))
+    end = SALON_TZ.localize(datetime.combine(
+        date + timedelta(days=1), time(0, 0)))
+    return start.astimezone(pytz.utc), end.astimezone(pytz.utc)
+
+
+def working_hours(date):
+    """ (day_start, day_end) in UTC of the salon's working hours on the date."""
+    # central.localize() makes a naive datetime (no timezone info) into an aware datetime (with timezone info)
+    # combine() makes a datetime from a date object and a time object
+    day_start_ct = SALON_TZ.localize(datetime.combine(date, WORKDAY_START))
+    day_end_ct = SALON_TZ.localize(datetime.combine(date, WORKDAY_END))
+    return day_start_ct.astimezone(pytz.utc), day_end_ct.astimezone(pytz.utc)
+
+
+def split_busy_by_day(busy_intervals, dates):
+    """ Split busy intervals fetched for a range of days into {date: busy intervals on that salon-local day}.
+    Intervals that cross midnight are clipped so each day only gets its own part."""
+    busy_by_day = {}
+    for date in dates:
+        day_start, day_end = local_day_bounds(date)
+        busy_by_day[date] = [(max(start, day_start), min(end, day_end))
+                             for start, end in busy_intervals
+                             if start < day_end and end > day_start]
+    return busy_by_day
+
 
 def normalize_intervals(intervals):
     """Sort and merge overlapping or touching busy intervals
@@ -38,45 +75,63 @@ def normalize_intervals(intervals):
     return merged
 
 
-def generate_available_slots(service_duration, busy_intervals, date, slot_granularity=15):
-    """ Turns a list of busy intervals into available slots for booking.
-    """
+def free_intervals(busy_intervals, date):
+    """ Working hours on the date minus the busy intervals: the merged (start, end) windows the stylist is free, in time order."""
     # 1.) Define working hours for a day in CST
     # we enforce this here because a stylist may have availability outside of working hours (e.g., 11pm), but we don't want to show those times to clients
-    central = pytz.timezone('America/Chicago')  # Central Time Zone object
-    # central.localize() makes a naive datetime (no timezone info) into an aware datetime (with timezone info)
-    # combine() makes a datetime from a date object and a time object
-    day_start_ct = central.localize(
-        datetime.combine(date, time(9, 0)))  # 9:00 AM CST
-    day_end_ct = central.localize(
-        datetime.combine(date, time(17, 0)))  # 5:00 PM CST
-
-    # 2.) Convert above to UTC for comparison with busy times from Google Calendar
-    day_start = day_start_ct.astimezone(pytz.utc)
-    day_end = day_end_ct.astimezone(pytz.utc)
+    # 2.) working_hours() converts them to UTC for comparison with busy times from Google Calendar
+    day_start, day_end = working_hours(date)
 
     # 3.) Busy intervals may not be in order or may overlap, so first merge any overlapping busy intervals, and then sort them by start time (via helper function above).
     busy_intervals = normalize_intervals(busy_intervals)
 
     # 4.) Subtract busy intervals from working hours to get free time intervals
-    free_intervals = []
+    free = []
     current_start = day_start  # start with the beginning of the work day
     for start, end in busy_intervals:
+        # busy intervals are sorted, so once one starts after closing time the rest are after closing too. without this, the gap before it would be counted as free time past closing (e.g. a 6pm event made slots until 6pm)
+        if start >= day_end:
+            break
         # if opening time is less than (before) the busy interval's start time, then there's free time from current_start to the start of the busy interval, so add that as a free interval (it will be the gap before the busy interval). Note to self: I also drew a diagram to understand this logic, refer back to it if confused. pic taken on iphone 091625
         if current_start < start:
-            free_intervals.append((current_start, start))
+            free.append((current_start, start))
         # move the current_start forward to the end of the busy interval (if it's later than the current_start, which it always should be given my setup... but this is a safty net i guess so we don't accidentally reset current_start backwards... it can only move farwards.)
         if end > current_start:  # safety check, this should always be true given my setup
             current_start = end
 
     # 5.) After the last busy interval, there might still be free time until day_end, so add that as a free interval if applicable.
     if current_start < day_end:
-        free_intervals.append((current_start, day_end))
+        free.append((current_start, day_end))
+    return free
+
+
+def bookable_intervals(service_duration, busy_intervals, date):
+    """ The free windows that are long enough for the service. The client can expand them into slots itself:
+    a slot starts at the window's start and then every slot granularity, as long as it ends by the window's end."""
+    return long_enough_intervals(service_duration, free_intervals(busy_intervals, date))
+
+
+def long_enough_intervals(service_duration, free):
+    """ The free windows (from free_intervals()) that are long enough for the service."""
+    duration = timedelta(minutes=service_duration)
+    return [(start, end) for start, end in free if end - start >= duration]
+
 
+def generate_available_slots(service_duration, busy_intervals, date, slot_granularity=SLOT_GRANULARITY_MIN):
+    """ Turns a list of busy intervals into available slots for booking.
+    """
+    # 1.) - 5.) free time intervals within working hours (helper function above)
+    free = free_intervals(busy_intervals, date)
+    return slice_free_intervals(service_duration, free, slot_granularity)
+
+
+def slice_free_intervals(service_duration, free, slot_granularity=SLOT_GRANULARITY_MIN):
+    """ Slice free windows (from free_intervals()) into bookable slots for the service.
+    Split out of generate_available_slots() so the same free windows can be sliced for several durations."""
     # 6. Slice the free intervals into into bookable slots that match the service's duration
     slots = []
     step = timedelta(minutes=slot_granularity)  # default is 15 min increments
-    for free_start, free_end in free_intervals:
+    for free_start, free_end in free:
         slot_start = free_start
         # while the slot (from slot_start to slot_start + service_duration) fits within the free interval
         while slot_start + timedelta(minutes=service_duration) <= free_end:
@@ -90,3 +145,11 @@ def generate_available_slots(service_duration, busy_intervals, date, slot_granul
 
     # 7.) Return all the slots (in UTC since that's how we store times in the DB)
     return slots
+
+
+def count_slots(service_duration, free, slot_granularity=SLOT_GRANULARITY_MIN):
+    """ How many slots slice_free_intervals() would cut from the free windows, without building them:
+    a window fits one slot at its start plus one more every granularity while start + duration still fits. O(windows), not O(slots)."""
+    duration = timedelta(minutes=service_duration)
+    step = timedelta(minutes=slot_granularity)
+    return sum((end - start - duration) // step + 1 for start, end in free if end - start >= duration)
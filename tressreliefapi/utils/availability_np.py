@@ -0,0 +1,187 @@
+# NumPy version of the slot engine in availability.py, for multi-day and multi-stylist queries.
+# Same results as normalize_intervals() / generate_available_slots(), but instead of a python loop with timedelta math and two datetime objects per slot,
+# every time is an integer number of microseconds since the epoch, and merging, subtracting from working hours and slicing into slots are whole-array numpy operations.
+# Times only become datetimes (or ISO strings for the JSON response) at the very end.
+#
+# Many (date, busy intervals) "day jobs" (e.g. 7 days x 12 stylists) are done in ONE pass: each job's working hours are laid side by side on one number line,
+# with a busy block filling the space between them, so one merge + one complement over the whole line gives every job's free time at once.
+
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import numpy as np
+from tressreliefapi.utils.availability import SLOT_GRANULARITY_MIN, working_hours
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+MICROSECONDS_PER_MINUTE = 60 * 1000 * 1000
+
+
+def to_micros(dt):
+    """ Aware datetime -> integer microseconds since the epoch (exact, unlike dt.timestamp())."""
+    return (dt - EPOCH) // ONE_MICROSECOND
+
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=int(micros))
+
+
+def _intervals_to_arrays(intervals):
+    # one pass over the datetimes: start, end, start, end, ...
+    times = np.fromiter((to_micros(time) for interval in intervals for time in interval),
+                        dtype=np.int64, count=2 * len(intervals))
+    return times[0::2], times[1::2]
+
+
+def merge_intervals_np(starts, ends):
+    """ Vectorized normalize_intervals(): sort by start and merge overlapping or touching intervals.
+    Takes and returns (starts, ends) int64 arrays."""
+    if len(starts) == 0:
+        return starts, ends
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    # running max of the ends: how far the merged interval reaching each position extends
+    reach = np.maximum.accumulate(ends)
+    # a new merged interval starts wherever an interval starts after everything before it has ended
+    new_group = np.empty(len(starts), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = starts[1:] > reach[:-1]
+    group_heads = np.flatnonzero(new_group)
+    group_tails = np.append(group_heads[1:] - 1, len(starts) - 1)
+    return starts[group_heads], reach[group_tails]
+
+
+def normalize_intervals_np(intervals):
+    """ Same result as availability.normalize_intervals(), as a list of (start, end) UTC datetimes."""
+    starts, ends = merge_intervals_np(*_intervals_to_arrays(intervals))
+    return [(from_micros(start), from_micros(end)) for start, end in zip(starts, ends)]
+
+
+@lru_cache(maxsize=4096)
+def _working_hours_micros(date):
+    """ working_hours() of the date as epoch micros. The time zone math is the slow part, and every request asks about the same few weeks."""
+    day_start, day_end = working_hours(date)
+    return to_micros(day_start), to_micros(day_end)
+
+
+def _free_intervals_for_jobs(jobs):
+    """ Free (start, end) micros arrays for every (date, busy_intervals) job, plus the job index of each free interval and each job's working-hours start."""
+    job_count = len(jobs)
+    hours = np.array([_working_hours_micros(date) for date, _ in jobs], dtype=np.int64)
+    day_starts = hours[:, 0]
+    day_lengths = hours[:, 1] - day_starts
+    # every job's busy intervals in one flat pair of arrays, job_of_busy says which job each one belongs to
+    busy_counts = np.fromiter((len(busy_intervals) for _, busy_intervals in jobs),
+                              dtype=np.int64, count=job_count)
+    starts, ends = _intervals_to_arrays(
+        [interval for _, busy_intervals in jobs for interval in busy_intervals])
+
+    # lay the jobs side by side: job j's working hours become [j * width, j * width + day_length]
+    width = 2 * int(day_lengths.max()) + 2
+    offsets = np.arange(job_count, dtype=np.int64) * width
+    job_of_busy = np.repeat(np.arange(job_count), busy_counts)
+
+    # busy times that start after closing don't affect the day (generate_available_slots() stops at them), everything else is clipped to working hours.
+    # clipping doesn't change the result: the part before opening or after closing never makes or removes free time inside working hours.
+    # (zero-length busy intervals inside working hours are kept on purpose: like in the python loop, they split a free interval and restart the slot grid)
+    relative_starts = starts - day_starts[job_of_busy]
+    relative_ends = ends - day_starts[job_of_busy]
+    lengths = day_lengths[job_of_busy]
+    keep = relative_starts < lengths
+    job_of_busy = job_of_busy[keep]
+    relative_starts = np.clip(relative_starts[keep], 0, lengths[keep])
+    relative_ends = np.clip(relative_ends[keep], 0, lengths[keep])
+
+    # the space outside every job's working hours is one more busy block, so the free time of the whole line is exactly every job's free time
+    line_starts = np.concatenate((
+        relative_starts + offsets[job_of_busy],
+        [-width],  # before the first job
+        offsets + day_lengths,  # after each job, up to the start of the next one
+    ))
+    line_ends = np.concatenate((
+        relative_ends + offsets[job_of_busy],
+        [0],
+        offsets + width,
+    ))
+    merged_starts, merged_ends = merge_intervals_np(line_starts, line_ends)
+
+    # free time = the gaps between merged busy intervals (merging guarantees every gap is non-empty)
+    free_starts = merged_ends[:-1]
+    free_ends = merged_starts[1:]
+    free_jobs = free_starts // width
+    free_offsets = offsets[free_jobs]
+    return free_starts - free_offsets, free_ends - free_offsets, free_jobs, day_starts
+
+
+def _slots_for_jobs(service_duration, jobs, slot_granularity):
+    """ (slot_starts, job_of_slot) for every job, slot_starts in epoch micros and in the same order generate_available_slots() would produce them."""
+    duration = service_duration * MICROSECONDS_PER_MINUTE
+    step = slot_granularity * MICROSECONDS_PER_MINUTE
+    if not jobs:
+        return np.empty(0, np.int64), np.empty(0, np.int64), duration
+
+    free_starts, free_ends, free_jobs, day_starts = _free_intervals_for_jobs(jobs)
+    # how many slots fit in each free interval: a slot starts every step while start + duration still fits
+    lengths = free_ends - free_starts
+    counts = np.where(lengths >= duration,
+                      (lengths - duration) // step + 1, 0)
+    total = int(counts.sum())
+    # slot k of a free interval starts at free_start + k * step
+    first_slot = np.cumsum(counts) - counts
+    slot_index = np.arange(total, dtype=np.int64) - \
+        np.repeat(first_slot, counts)
+    slot_jobs = np.repeat(free_jobs, counts)
+    slot_starts = np.repeat(free_starts, counts) + slot_index * \
+        step + day_starts[slot_jobs]
+    return slot_starts, slot_jobs, duration
+
+
+def _split_by_job(values, slot_jobs, job_count):
+    """ Cut values (an array or a list, in slot order) into one piece per job."""
+    bounds = np.searchsorted(slot_jobs, np.arange(job_count + 1)).tolist()
+    return [values[bounds[j]:bounds[j + 1]] for j in range(job_count)]
+
+
+def iso_strings(micros):
+    """ Epoch micros array -> UTC ISO 8601 strings, formatted exactly like DRF formats a UTC datetime (e.g. 2025-10-01T14:00:00Z)."""
+    times = np.asarray(micros, dtype=np.int64).astype("datetime64[us]")
+    # timezone="UTC" adds the Z
+    if (np.asarray(micros) % 1000000 == 0).all():
+        return np.datetime_as_string(times, unit="s", timezone="UTC")
+    # datetime.isoformat() only shows microseconds when there are some
+    return np.char.replace(np.datetime_as_string(times, unit="us", timezone="UTC"), ".000000Z", "Z")
+
+
+def generate_slots_batch_np(service_duration, jobs, slot_granularity=SLOT_GRANULARITY_MIN, as_strings=False):
+    """ generate_available_slots() for many (date, busy_intervals) jobs in one vectorized pass.
+    Returns one slot list per job, in the same order as jobs.
+    With as_strings=True each slot is a [start, end] pair of ISO strings, ready for the JSON response (no datetime objects at all),
+    otherwise a (start, end) tuple of UTC datetimes equal to what generate_available_slots() returns."""
+    slot_starts, slot_jobs, duration = _slots_for_jobs(
+        service_duration, jobs, slot_granularity)
+    if as_strings:
+        # stylists on the same day share most slot times, so format each distinct time once and look the rest up.
+        # as python strings (object array): .tolist() then hands out references instead of building a new str per slot
+        times, positions = np.unique(np.concatenate(
+            (slot_starts, slot_starts + duration)), return_inverse=True)
+        strings = np.array(iso_strings(times).tolist(), dtype=object)[positions]
+        pairs = strings.reshape(2, -1).T.tolist()
+        return _split_by_job(pairs, slot_jobs, len(jobs))
+    duration_delta = timedelta(minutes=service_duration)
+    return [[(start, start + duration_delta) for start in map(from_micros, starts)]
+            for starts in _split_by_job(slot_starts, slot_jobs, len(jobs))]
+
+
+def generate_available_slots_np(service_duration, busy_intervals, date, slot_granularity=SLOT_GRANULARITY_MIN):
+    """ Drop-in replacement for availability.generate_available_slots()."""
+    return generate_slots_batch_np(service_duration, [(date, busy_intervals)], slot_granularity)[0]
+
+
+def slots_by_day_np(service_duration, dates, busy_by_days, slot_granularity=SLOT_GRANULARITY_MIN):
+    """ Slots on every date for many stylists in one pass. busy_by_days has one {date: busy_intervals} dict per stylist (None for stylists to skip).
+    Returns one {date: slots} dict per stylist (None stays None), with the slots as ISO string pairs for the JSON response."""
+    jobs = [(date, busy_by_day[date]) for busy_by_day in busy_by_days
+            if busy_by_day is not None for date in dates]
+    slot_lists = iter(generate_slots_batch_np(
+        service_duration, jobs, slot_granularity, as_strings=True))
+    return [None if busy_by_day is None else {date: next(slot_lists) for date in dates}
+            for busy_by_day in busy_by_days]
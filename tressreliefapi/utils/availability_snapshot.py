@@ -0,0 +1,73 @@
+# Fill and read the AvailabilitySnapshot table (precomputed availability per service, stylist and day).
+# The builder fetches every linked stylist's busy times once for the whole window (one FreeBusy call per stylist, shared by all their services),
+# turns them into slots and free windows for each of their services and upserts the rows.
+# Days whose busy times came from the stale copy (google failing) are left alone, so a row never looks fresher than its data.
+
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+from tressreliefapi.models import AvailabilitySnapshot, StylistService
+from tressreliefapi.utils.availability import bookable_intervals
+from tressreliefapi.utils.slot_engine import slots_by_day
+from tressreliefapi.utils.stylist_busy import map_stylists_busy
+
+
+def _json_ready(value):
+    # datetimes -> the same ISO strings the API returns
+    return json.loads(json.dumps(value, cls=JSONEncoder))
+
+
+def build_snapshots(dates, services=None):
+    """ Compute and upsert the snapshot rows of every service (or just services) and its stylists on each of the dates.
+    Returns (rows written, stylists skipped) where skipped stylists have no google calendar or their fetch failed."""
+    links = StylistService.objects.select_related("stylist", "service").order_by("id")
+    if services is not None:
+        links = links.filter(service__in=services)
+    links = list(links)
+    stylists = list({link.stylist.id: link.stylist for link in links}.values())
+
+    busy_by_stylist = dict(zip(
+        (stylist.id for stylist in stylists),
+        map_stylists_busy(stylists, dates, lambda stylist, busy_by_day: busy_by_day)))
+    computed_at = timezone.now()
+    rows = []
+    for link in links:
+        busy_by_day = busy_by_stylist[link.stylist.id]
+        if busy_by_day is None:
+            continue
+        fresh_dates = [date for date in dates if date not in busy_by_day.stale]
+        slots = slots_by_day(link.service.duration, fresh_dates, [busy_by_day])[0]
+        rows.extend(AvailabilitySnapshot(
+            service=link.service,
+            stylist=link.stylist,
+            date=date,
+            slots=slots[date],
+            intervals=_json_ready(bookable_intervals(link.service.duration, busy_by_day[date], date)),
+            computed_at=computed_at,
+        ) for date in fresh_dates)
+
+    AvailabilitySnapshot.objects.bulk_create(
+        rows, batch_size=500, update_conflicts=True,
+        unique_fields=["service", "date", "stylist"], update_fields=["slots", "intervals", "computed_at"])
+    skipped = sum(busy_by_day is None for busy_by_day in busy_by_stylist.values())
+    return len(rows), skipped
+
+
+def delete_past_snapshots(today):
+    """ Drop rows for days before today, nobody asks for those."""
+    return AvailabilitySnapshot.objects.filter(date__lt=today).delete()[0]
+
+
+def fresh_snapshots(service, stylists, dates, field):
+    """ {stylist_id: {date: slots or intervals (field)}} from the snapshot rows of the service's stylists on the dates,
+    leaving out rows older than AVAILABILITY_SNAPSHOT_MAX_AGE_SEC. One query."""
+    oldest = timezone.now() - timedelta(seconds=settings.AVAILABILITY_SNAPSHOT_MAX_AGE_SEC)
+    rows = AvailabilitySnapshot.objects.filter(
+        service=service, date__in=dates, stylist__in=stylists, computed_at__gte=oldest,
+    ).values_list("stylist_id", "date", field)
+    snapshots = {}
+    for stylist_id, date, value in rows:
+        snapshots.setdefault(stylist_id, {})[date] = value
+    return snapshots
@@ -0,0 +1,128 @@
+# Book an appointment without double booking.
+# The stylist's google busy times for the day are fetched first (busy cache / calendar mirror / FreeBusy, outside any transaction),
+# then the day's booked appointments are loaded (one indexed query) and the start has to be one of the slots
+# availability would offer: inside a free window (working hours minus google busy times and appointments) and on that window's slot grid.
+# That's O(windows), no index or slot list needed.
+#
+# Writing the appointment to the stylist's google calendar isn't done here: an outbox row saved with the appointment has the
+# drain_calendar_outbox worker do it (utils/calendar_outbox.py), so booking doesn't wait on google.
+#
+# Two bookings for the same stylist at the same time mustn't both get in. The appointment is inserted with a conditional INSERT
+# (_create_if_free()) that only adds the row if no booked appointment of the stylist overlaps it. The overlap lookup is a range scan
+# on the (stylist, start, end) index, O(log n) in the stylist's appointments, done by the database in the same statement as the insert,
+# so there's no in-memory index to build or keep in step with other processes. On top of that the insert runs under
+#   - a per-stylist lock for threads in this process
+#   - a row lock (select_for_update) on the stylist, on databases where two transactions' INSERT ... WHERE NOT EXISTS could both pass (postgres/mysql).
+#     sqlite doesn't have row locks and doesn't need one: it runs one write at a time, so the second insert sees the first
+
+import threading
+from datetime import timedelta
+from django.db import connection, transaction
+from django.utils import timezone
+from tressreliefapi.models import Appointment, AvailabilitySnapshot, UserInfo
+from tressreliefapi.utils.availability import SALON_TZ, SLOT_GRANULARITY_MIN, free_intervals, local_day_bounds, working_hours
+from tressreliefapi.utils.calendar_outbox import enqueue_calendar_op
+from tressreliefapi.utils.stylist_busy import get_busy_by_day
+
+
+class BookingError(Exception):
+    """ The appointment can't be booked. The message says why (for the response)."""
+
+
+class SlotTaken(BookingError):
+    """ The time overlaps the stylist's google busy times or another appointment."""
+
+
+class CalendarUnavailable(BookingError):
+    """ We couldn't get the stylist's busy times from google, so we can't tell whether the time is free."""
+
+
+_booking_locks = {}
+_booking_locks_guard = threading.Lock()
+
+
+def _booking_lock(stylist_id):
+    with _booking_locks_guard:
+        return _booking_locks.setdefault(stylist_id, threading.Lock())
+
+
+def day_free_intervals(stylist_id, date, busy):
+    """ The stylist's free windows on the salon-local date: working hours minus their google busy times (busy) and booked appointments.
+    Call it inside the booking transaction so the appointments are current."""
+    day_start, day_end = local_day_bounds(date)
+    appointments = Appointment.objects.filter(
+        stylist_id=stylist_id, status="booked", start__lt=day_end, end__gt=day_start).values_list("start", "end")
+    return free_intervals(list(busy) + list(appointments), date)
+
+
+def _check_slot(free, start, end):
+    """ Raise unless [start, end) is a slot availability offers: inside one free window, a whole number of granularity steps from its start."""
+    window_start = next((window_start for window_start, window_end in free
+                         if window_start <= start and end <= window_end), None)
+    if window_start is None:
+        raise SlotTaken("That time isn't available anymore.")
+    if (start - window_start) % timedelta(minutes=SLOT_GRANULARITY_MIN):
+        raise BookingError("That isn't one of the available start times.")
+
+
+def _create_if_free(stylist_service, client, start, end):
+    """ Insert the appointment unless a booked appointment of the stylist overlaps [start, end), in one statement.
+    Returns the new Appointment. Raises SlotTaken if another booking got there first (since the _check_slot() before it)."""
+    table = connection.ops.quote_name(Appointment._meta.db_table)
+    start_column, end_column = connection.ops.quote_name("start"), connection.ops.quote_name("end")
+    start_value, end_value = (connection.ops.adapt_datetimefield_value(value) for value in (start, end))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (stylist_service_id, stylist_id, client_id, {start_column}, {end_column}, status, created_at) "
+            f"SELECT %s, %s, %s, %s, %s, %s, %s WHERE NOT EXISTS ("
+            f"SELECT 1 FROM {table} WHERE stylist_id = %s AND status = %s AND {start_column} < %s AND {end_column} > %s)",
+            [stylist_service.pk, stylist_service.stylist_id, client.pk if client else None, start_value, end_value, "booked",
+             connection.ops.adapt_datetimefield_value(timezone.now()),
+             stylist_service.stylist_id, "booked", end_value, start_value])
+        if cursor.rowcount != 1:
+            raise SlotTaken("That time isn't available anymore.")
+    # no other booked appointment of the stylist can overlap it, so this finds exactly the new one
+    return Appointment.objects.get(stylist_id=stylist_service.stylist_id, status="booked", start=start, end=end)
+
+
+def book_appointment(stylist_service, start, client=None):
+    """ Book stylist_service (a StylistService with its service and stylist loaded) at start (aware datetime).
+    Returns the new Appointment. Raises BookingError (SlotTaken, CalendarUnavailable) if it can't be booked."""
+    service, stylist = stylist_service.service, stylist_service.stylist
+    if start < timezone.now():
+        raise BookingError("The appointment can't start in the past.")
+    end = start + timedelta(minutes=service.duration)
+    date = start.astimezone(SALON_TZ).date()
+    day_start, day_end = working_hours(date)
+    if start < day_start or end > day_end:
+        raise BookingError("The appointment has to be within working hours.")
+
+    # google first, so the transaction (and the locks) aren't held during a google call
+    busy_by_day = get_busy_by_day(stylist, [date])
+    if busy_by_day is None:
+        raise CalendarUnavailable("Couldn't check the stylist's calendar, try again.")
+    # busy_by_day.stale: google is failing and these are the last busy times we fetched. better than refusing every booking
+
+    with _booking_lock(stylist.id):
+        _check_slot(day_free_intervals(stylist.id, date, busy_by_day[date]), start, end)
+        with transaction.atomic():
+            if connection.features.has_select_for_update:
+                UserInfo.objects.select_for_update().get(pk=stylist.pk)
+            appointment = _create_if_free(stylist_service, client, start, end)
+            enqueue_calendar_op(appointment, "create")
+    forget_day_snapshots(stylist.id, date)
+    return appointment
+
+
+def cancel_appointment(appointment):
+    """ Cancel the appointment, freeing its time (its google event is deleted by the outbox worker)."""
+    with transaction.atomic():
+        appointment.status = "cancelled"
+        appointment.save(update_fields=["status"])
+        enqueue_calendar_op(appointment, "cancel")
+    forget_day_snapshots(appointment.stylist_id, appointment.start.astimezone(SALON_TZ).date())
+
+
+def forget_day_snapshots(stylist_id, date):
+    """ The stylist's precomputed availability for the day (every service) is out of date now. ?source=snapshot computes them live until the next build."""
+    AvailabilitySnapshot.objects.filter(stylist_id=stylist_id, date=date).delete()
@@ -0,0 +1,171 @@
+# Cache of each stylist's parsed FreeBusy busy intervals, keyed by (stylist, calendar day).
+# A client flipping between two services on the same day (or two clients looking at the same day) reuses one FreeBusy fetch instead of asking google again for every request.
+# Entries live for BUSY_CACHE_TTL_SEC, and should be invalidated (invalidate_busy) whenever we write an event to the stylist's calendar.
+# Every fetch is also kept as a "stale" copy for much longer (BUSY_STALE_TTL_SEC) with the time it was fetched:
+# when google is down (see utils/circuit_breaker.py) availability is served from it, marked stale with its age.
+#
+# Two backends, picked with the BUSY_CACHE_BACKEND setting:
+# - "lru": in-process LRU dict (default). fastest, but each worker process has its own copy
+# - "django": django's cache framework (settings.CACHES, alias BUSY_CACHE_DJANGO_ALIAS), e.g. memcached/redis shared by every worker
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from tressreliefapi.utils.availability import SALON_TZ
+
+
+class LRUBusyCache:
+    """ Thread-safe in-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)  # evict the least recently used entry
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    # nothing here waits on I/O, so the async views can use the sync methods directly
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value, ttl):
+        self.set(key, value, ttl)
+
+
+class DjangoBusyCache:
+    """ Same interface as LRUBusyCache, backed by a django cache."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def get(self, key):
+        return caches[self.alias].get(key)
+
+    def set(self, key, value, ttl):
+        caches[self.alias].set(key, value, ttl)
+
+    def delete(self, key):
+        caches[self.alias].delete(key)
+
+    async def aget(self, key):
+        return await caches[self.alias].aget(key)
+
+    async def aset(self, key, value, ttl):
+        await caches[self.alias].aset(key, value, ttl)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_busy_cache():
+    """ Return the configured busy cache backend (created the first time)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if settings.BUSY_CACHE_BACKEND == "django":
+                    _backend = DjangoBusyCache(
+                        settings.BUSY_CACHE_DJANGO_ALIAS)
+                else:
+                    _backend = LRUBusyCache(settings.BUSY_CACHE_MAX_ENTRIES)
+    return _backend
+
+
+def busy_cache_key(stylist_id, date):
+    return f"busy:{stylist_id}:{date.isoformat()}"
+
+
+def stale_busy_key(stylist_id, date):
+    return f"busy-stale:{stylist_id}:{date.isoformat()}"
+
+
+def get_cached_busy(stylist_id, date):
+    """ Return the cached busy intervals for the stylist on the date as a new list, or None on a miss.
+    (a new list because normalize_intervals() sorts in place and the cached copy is shared between requests)"""
+    busy = get_busy_cache().get(busy_cache_key(stylist_id, date))
+    return None if busy is None else list(busy)
+
+
+def cache_busy(stylist_id, date, busy_intervals):
+    # stored as a tuple so nobody can change the shared copy
+    busy = tuple(busy_intervals)
+    cache = get_busy_cache()
+    cache.set(busy_cache_key(stylist_id, date), busy,
+              settings.BUSY_CACHE_TTL_SEC)
+    # wall clock time (not monotonic) so the age means the same thing in every worker sharing a django cache
+    cache.set(stale_busy_key(stylist_id, date), (time.time(), busy),
+              settings.BUSY_STALE_TTL_SEC)
+
+
+def _stale_entry(entry):
+    if entry is None:
+        return None
+    fetched_at, busy = entry
+    return list(busy), max(0, int(time.time() - fetched_at))
+
+
+def get_stale_busy(stylist_id, date):
+    """ The last busy intervals we fetched for the stylist on the date, even if they're past BUSY_CACHE_TTL_SEC,
+    as (busy intervals, age in seconds), or None if we never fetched that day (or it's older than BUSY_STALE_TTL_SEC)."""
+    return _stale_entry(get_busy_cache().get(stale_busy_key(stylist_id, date)))
+
+
+async def aget_stale_busy(stylist_id, date):
+    return _stale_entry(await get_busy_cache().aget(stale_busy_key(stylist_id, date)))
+
+
+async def aget_cached_busy(stylist_id, date):
+    """ Async version of get_cached_busy() for the ASGI views."""
+    busy = await get_busy_cache().aget(busy_cache_key(stylist_id, date))
+    return None if busy is None else list(busy)
+
+
+async def acache_busy(stylist_id, date, busy_intervals):
+    busy = tuple(busy_intervals)
+    cache = get_busy_cache()
+    await cache.aset(busy_cache_key(stylist_id, date), busy,
+                     settings.BUSY_CACHE_TTL_SEC)
+    await cache.aset(stale_busy_key(stylist_id, date), (time.time(), busy),
+                     settings.BUSY_STALE_TTL_SEC)
+
+
+def invalidate_busy(stylist_id, dates):
+    """ Forget the stylist's cached busy intervals for each of the dates, e.g. after writing an event to their calendar.
+    The stale copy goes too, it no longer matches their calendar."""
+    cache = get_busy_cache()
+    for date in dates:
+        cache.delete(busy_cache_key(stylist_id, date))
+        cache.delete(stale_busy_key(stylist_id, date))
+
+
+def invalidate_upcoming_busy(stylist_id):
+    """ invalidate_busy() for every day from today (salon time) through NEXT_AVAILABLE_MAX_DAYS ahead, as far as availability searches on its own.
+    For changes to all of a stylist's busy times (e.g. which calendars count), since the cache can't list a stylist's days."""
+    today = timezone.now().astimezone(SALON_TZ).date()
+    invalidate_busy(stylist_id, [today + timedelta(days=i) for i in range(settings.NEXT_AVAILABLE_MAX_DAYS)])
@@ -0,0 +1,281 @@
+# Write appointments to the stylists' google calendars from the CalendarOutbox table, off the request path.
+# Booking only saves an outbox row (enqueue_calendar_op(), in the booking transaction), and the drain_calendar_outbox worker sends them:
+#   1.) claim the due rows (a lease: their next_attempt_at moves GOOGLE_OUTBOX_LEASE_SEC ahead, so another worker doesn't send them too)
+#   2.) fold each appointment's rows into the one call that gets its event to the appointment's current state
+#       (create + cancel before anything was sent is a delete of an event that isn't there, which is fine)
+#   3.) send each stylist's calls as google batch requests (one HTTP round trip for up to GOOGLE_OUTBOX_BATCH_SIZE calls, one access token)
+#   4.) mark the rows done, or retry them later with exponential backoff. calls google refuses for good are marked failed
+#   5.) forget the cached busy times (and their stale copies) of the days whose events were written, so availability sees the change
+# Event ids are derived from the appointment id, so a create that's sent again (its response got lost) gets a 409 instead of a duplicate event.
+#
+# DOCS: https://developers.google.com/workspace/calendar/api/guides/batch
+# https://developers.google.com/workspace/calendar/api/v3/reference/events/insert
+
+import json
+import logging
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from email.parser import BytesParser
+from urllib.parse import quote, urlsplit
+import requests
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from tressreliefapi.models import CalendarOutbox, OAuthCredential
+from tressreliefapi.utils.availability import SALON_TZ
+from tressreliefapi.utils.busy_cache import invalidate_busy
+from tressreliefapi.utils.circuit_breaker import get_breaker, is_upstream_failure
+from tressreliefapi.utils.google_transport import google_post
+from tressreliefapi.utils.google_utils import forget_access_token, get_valid_access_token
+from tressreliefapi.utils.rate_limit import GoogleRateLimited, get_rate_limiter, rate_limit_reason
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_calendar_op(appointment, operation):
+    """ Queue a google calendar write ("create", "update" or "cancel") for the appointment.
+    Call it in the same transaction that changes the appointment, so neither is saved without the other."""
+    return CalendarOutbox.objects.create(appointment=appointment, operation=operation)
+
+
+def appointment_event_id(appointment):
+    """ The google event id of the appointment. Event ids may only use the letters a-v and digits (base32hex)."""
+    return f"tressrelief{appointment.pk}"
+
+
+def event_body(appointment):
+    """ The google event for the appointment."""
+    return {
+        "id": appointment_event_id(appointment),
+        "summary": appointment.stylist_service.service.name,
+        "description": f"Booked through TressRelief (appointment {appointment.pk})",
+        "start": {"dateTime": appointment.start.isoformat()},
+        "end": {"dateTime": appointment.end.isoformat()},
+    }
+
+
+def _claim(limit):
+    """ Lease up to limit due rows, plus every other pending row of the same appointments (so their calls are folded together).
+    An appointment is only claimed when all its pending rows are due and this worker could lock them: a row that isn't due is leased
+    by another worker (or waiting out its backoff), and sending the rest alongside it could race its call (an orphan event, a double delete).
+    Returns the rows with their appointment, service and stylist loaded."""
+    now = timezone.now()
+    pending = CalendarOutbox.objects.filter(status="pending")
+    waiting = pending.filter(next_attempt_at__gt=now).values("appointment_id")
+    with transaction.atomic():
+        due = (pending.select_for_update(skip_locked=True)
+               .filter(next_attempt_at__lte=now).exclude(appointment_id__in=waiting).order_by("id")
+               .values_list("appointment_id", flat=True)[:limit])
+        appointment_ids = set(due)
+        rows = list(pending.select_for_update(skip_locked=True, of=("self",))
+                    .filter(next_attempt_at__lte=now, appointment_id__in=appointment_ids)
+                    .select_related("appointment__stylist_service__service", "appointment__stylist")
+                    .order_by("id"))
+        # skip_locked leaves out rows another worker locked since the first query. leave their appointments to that worker
+        pending_count = dict(pending.filter(appointment_id__in=appointment_ids).values("appointment_id")
+                             .annotate(count=Count("id")).values_list("appointment_id", "count"))
+        locked = Counter(row.appointment_id for row in rows)
+        rows = [row for row in rows if locked[row.appointment_id] == pending_count[row.appointment_id]]
+        CalendarOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+            next_attempt_at=now + timedelta(seconds=settings.GOOGLE_OUTBOX_LEASE_SEC))
+    return rows
+
+
+def _plan(appointment, operations):
+    """ (method, path, body) of the one call that brings the appointment's event in line with the appointment, given its queued operations in order.
+    path is relative to the calendar's events collection."""
+    if operations[-1] == "cancel":
+        return "DELETE", f"/{appointment_event_id(appointment)}", None
+    if "create" in operations:
+        return "POST", "", event_body(appointment)
+    return "PATCH", f"/{appointment_event_id(appointment)}", {
+        "start": {"dateTime": appointment.start.isoformat()},
+        "end": {"dateTime": appointment.end.isoformat()},
+    }
+
+
+def _outcome(method, status_code, reason):
+    """ "done", "retry" or "failed" for one call's answer inside the batch."""
+    if 200 <= status_code < 300:
+        return "done"
+    if method == "DELETE" and status_code in (404, 410):
+        return "done"  # already gone (or it was cancelled before it was ever created)
+    if method == "POST" and status_code == 409:
+        return "done"  # an earlier attempt created it and we never saw the answer
+    if status_code == 401 or reason is not None or is_upstream_failure(status_code):
+        return "retry"
+    return "failed"
+
+
+def _batch_body(calls, calendar_path, boundary):
+    """ multipart/mixed body of a google batch request. calls are (content id, method, path, body)."""
+    parts = []
+    for content_id, method, path, body in calls:
+        request = f"{method} {calendar_path}{path} HTTP/1.1\r\n"
+        if body is not None:
+            request += f"Content-Type: application/json\r\n\r\n{json.dumps(body)}"
+        else:
+            request += "\r\n"
+        parts.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <{content_id}>\r\n\r\n{request}\r\n")
+    return "".join(parts) + f"--{boundary}--\r\n"
+
+
+def _parse_batch(response):
+    """ {content id: (status code, quota reason or None)} of the answers in a google batch response."""
+    message = BytesParser().parsebytes(
+        f"Content-Type: {response.headers.get('Content-Type', '')}\r\n\r\n".encode() + response.content)
+    results = {}
+    for part in message.get_payload() if message.is_multipart() else ():
+        # google answers item "x" as "response-x"
+        content_id = part.get("Content-ID", "").strip("<>").removeprefix("response-")
+        http = part.get_payload(decode=False)
+        status_line, _, rest = http.lstrip().partition("\n")
+        body = rest.replace("\r\n", "\n").partition("\n\n")[2]
+        status_code = int(status_line.split()[1])
+        results[content_id] = (status_code, rate_limit_reason(_PartResponse(status_code, body)))
+    return results
+
+
+class _PartResponse:
+    """ Enough of a requests.Response for rate_limit_reason()."""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return json.loads(self._body)
+
+
+def _send(stylist, credential, groups):
+    """ Send one stylist's calls (groups: [(appointment, rows)]) as batch requests.
+    Returns {appointment id: (outcome, error)} with outcome "done", "failed", "skipped", "retry" (counts as an attempt)
+    or "wait" (we held back because of our rate limit or an open circuit, doesn't count). Runs on a worker thread."""
+    try:
+        if credential is None:
+            return {appointment.pk: ("skipped", "stylist hasn't connected google") for appointment, _ in groups}
+        access_token = get_valid_access_token(stylist, prefetched={stylist.id: credential})
+        if not access_token:
+            return {appointment.pk: ("retry", "no google access token") for appointment, _ in groups}
+        calendar_path = f"{urlsplit(settings.GOOGLE_API_BASE_URL).path}/calendars/{quote(credential.calendar_id, safe='')}/events"
+        outcomes = {}
+        size = settings.GOOGLE_OUTBOX_BATCH_SIZE
+        for i in range(0, len(groups), size):
+            outcomes.update(_send_batch(stylist, access_token, calendar_path, groups[i:i + size]))
+        return outcomes
+    finally:
+        connection.close()  # each worker thread has its own db connection
+
+
+def _send_or_retry(stylist, credential, groups):
+    """ _send(), except that an unexpected error only puts this stylist's rows back for a retry (with backoff), the other stylists are still sent."""
+    try:
+        return _send(stylist, credential, groups)
+    except Exception as ex:
+        logger.exception("Sending the calendar writes of stylist %s failed", stylist.id)
+        return {appointment.pk: ("retry", f"{type(ex).__name__}: {ex}") for appointment, _ in groups}
+
+
+def _send_batch(stylist, access_token, calendar_path, groups):
+    breaker = get_breaker("google:events")
+    if not breaker.allow():
+        return {appointment.pk: ("wait", "google calendar writes keep failing (circuit open)") for appointment, _ in groups}
+    calls = {str(appointment.pk): (appointment, *_plan(appointment, [row.operation for row in rows]))
+             for appointment, rows in groups}
+    boundary = f"batch_{uuid.uuid4().hex}"
+    try:
+        # google counts every call in a batch against the quotas, the batch request itself takes the last token
+        for _ in range(len(calls) - 1):
+            get_rate_limiter().acquire(access_token)
+        response = google_post(
+            settings.GOOGLE_BATCH_URL, rate_key=access_token,
+            headers={"Authorization": f"Bearer {access_token}",
+                     "Content-Type": f"multipart/mixed; boundary={boundary}"},
+            data=_batch_body([(content_id, method, path, body) for content_id, (_, method, path, body) in calls.items()],
+                             calendar_path, boundary).encode())
+    except GoogleRateLimited as ex:
+        breaker.release()
+        return {appointment.pk: ("wait", str(ex)) for appointment, _, _, _ in calls.values()}
+    except requests.RequestException as ex:
+        breaker.record_failure()
+        return {appointment.pk: ("retry", str(ex)) for appointment, _, _, _ in calls.values()}
+    if response.status_code != 200:
+        if is_upstream_failure(response.status_code):
+            breaker.record_failure()
+        else:
+            breaker.release()
+        if response.status_code == 401:
+            forget_access_token(stylist.id)
+        return {appointment.pk: ("retry", f"batch request: HTTP {response.status_code}")
+                for appointment, _, _, _ in calls.values()}
+    breaker.record_success()
+
+    results = _parse_batch(response)
+    outcomes = {}
+    for content_id, (appointment, method, _, _) in calls.items():
+        if content_id not in results:
+            outcomes[appointment.pk] = ("retry", "missing from the batch response")
+            continue
+        status_code, reason = results[content_id]
+        outcomes[appointment.pk] = (_outcome(method, status_code, reason), f"{method}: HTTP {status_code}")
+    return outcomes
+
+
+def _retry_later(row, error, now, outcome):
+    row.last_error = error
+    if outcome == "wait":
+        row.next_attempt_at = now + timedelta(seconds=settings.GOOGLE_BREAKER_RESET_SEC)
+        return
+    row.attempts += 1
+    if row.attempts >= settings.GOOGLE_OUTBOX_MAX_ATTEMPTS:
+        row.status = "failed"
+        return
+    backoff = settings.GOOGLE_OUTBOX_BACKOFF_SEC * (2 ** (row.attempts - 1))
+    row.next_attempt_at = now + timedelta(seconds=min(backoff, settings.GOOGLE_OUTBOX_MAX_BACKOFF_SEC))
+
+
+def drain_outbox(limit, workers=1):
+    """ Send up to limit due outbox rows to google (each stylist's calls on a worker thread, up to workers at once).
+    Returns {"done", "retry", "failed", "skipped"} counts of rows."""
+    rows = _claim(limit)
+    by_appointment = {}
+    for row in rows:
+        by_appointment.setdefault(row.appointment_id, []).append(row)
+    by_stylist = {}
+    for appointment_rows in by_appointment.values():
+        appointment = appointment_rows[0].appointment
+        by_stylist.setdefault(appointment.stylist_id, (appointment.stylist, []))[1].append((appointment, appointment_rows))
+    credentials = {credential.user_id: credential for credential in
+                   OAuthCredential.objects.filter(user_id__in=by_stylist, provider="google")}
+
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for stylist_outcomes in executor.map(
+                lambda item: _send_or_retry(item[0], credentials.get(item[0].id), item[1]), by_stylist.values()):
+            outcomes.update(stylist_outcomes)
+
+    counts = dict.fromkeys(("done", "retry", "failed", "skipped"), 0)
+    now = timezone.now()
+    written = {}
+    for appointment_id, appointment_rows in by_appointment.items():
+        outcome, error = outcomes[appointment_id]
+        if outcome == "done":
+            appointment = appointment_rows[0].appointment
+            written.setdefault(appointment.stylist_id, set()).add(appointment.start.astimezone(SALON_TZ).date())
+        for row in appointment_rows:
+            if outcome in ("retry", "wait"):
+                _retry_later(row, error, now, outcome)
+            else:
+                row.status = outcome
+                row.last_error = "" if outcome == "done" else error
+            counts["retry" if row.status == "pending" else row.status] += 1
+        if outcome == "failed":
+            logger.warning("Google refused the calendar write of appointment %s: %s", appointment_id, error)
+    CalendarOutbox.objects.bulk_update(rows, ["status", "attempts", "next_attempt_at", "last_error"])
+    # the stylists' calendars changed on those days, cached FreeBusy answers for them are out of date
+    for stylist_id, dates in written.items():
+        invalidate_busy(stylist_id, sorted(dates))
+    return counts
@@ -0,0 +1,258 @@
+# Keep a local copy of each connected stylist's busy events (BusyEvent) in step with their google calendar, so availability
+# can read busy times from the db instead of calling FreeBusy (see mirror_busy_by_day() and utils/stylist_busy.py).
+#
+# 1.) watch_calendar() opens a push channel: google POSTs to GOOGLE_WEBHOOK_URL (views/calendar_webhook.py) whenever the calendar changes
+# 2.) each notification runs sync_calendar(), which lists only the events that changed since the last sync token and applies them
+# 3.) channels expire (GOOGLE_CHANNEL_TTL_SEC at most), `python manage.py renew_calendar_channels` opens new ones before that
+# The mirror is only trusted while its channel is alive. Without one (webhooks off, channel expired) availability asks FreeBusy like before.
+# Only calendar_id is mirrored, so credentials that have other calendars to check (busy_calendar_ids) always use FreeBusy and get no channel.
+#
+# DOCS: https://developers.google.com/workspace/calendar/api/guides/push
+# https://developers.google.com/workspace/calendar/api/guides/sync
+# https://developers.google.com/workspace/calendar/api/v3/reference/events/list
+
+import datetime
+import hmac
+import logging
+import secrets
+import uuid
+from urllib.parse import quote
+import requests
+from dateutil.parser import isoparse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from tressreliefapi.models import BusyEvent, CalendarSync, OAuthCredential
+from tressreliefapi.utils.availability import SALON_TZ, local_day_bounds, split_busy_by_day
+from tressreliefapi.utils.busy_cache import invalidate_busy
+from tressreliefapi.utils.google_transport import google_get, google_post
+from tressreliefapi.utils.google_utils import get_valid_access_token
+
+logger = logging.getLogger(__name__)
+
+# how far back the first full sync lists events. only today and later matter for availability
+FULL_SYNC_LOOKBACK = datetime.timedelta(days=1)
+# don't invalidate more than this many cached days for one (e.g. years-long) event
+MAX_INVALIDATE_DAYS = 366
+
+
+class SyncTokenExpired(Exception):
+    """ Google answered 410 Gone: the sync token is too old and we have to start over with a full sync."""
+
+
+def _events_url(credential):
+    return f"{settings.GOOGLE_API_BASE_URL}/calendars/{quote(credential.calendar_id, safe='')}/events"
+
+
+def _event_time(when):
+    """ An event's start/end as a UTC datetime. All-day events ({"date": ...}) run from salon-local midnight to midnight
+    (their end date is exclusive, so the end is the start of that day too)."""
+    if "dateTime" in when:
+        return isoparse(when["dateTime"]).astimezone(datetime.timezone.utc)
+    return local_day_bounds(datetime.date.fromisoformat(when["date"]))[0]
+
+
+def event_interval(event):
+    """ (start, end) of an event that makes the stylist busy, or None if it doesn't (cancelled, "show as available", declined)."""
+    if event.get("status") == "cancelled" or event.get("transparency") == "transparent":
+        return None
+    if any(attendee.get("self") and attendee.get("responseStatus") == "declined"
+           for attendee in event.get("attendees", ())):
+        return None
+    if "start" not in event or "end" not in event:
+        return None
+    return _event_time(event["start"]), _event_time(event["end"])
+
+
+def _salon_dates(start, end):
+    """ The salon-local days an interval touches (for busy cache invalidation)."""
+    first = start.astimezone(SALON_TZ).date()
+    last = (end - datetime.timedelta(microseconds=1)).astimezone(SALON_TZ).date()
+    count = min((last - first).days + 1, MAX_INVALIDATE_DAYS)
+    return {first + datetime.timedelta(days=i) for i in range(max(count, 1))}
+
+
+def _list_changes(credential, access_token, sync_token):
+    """ Every event that changed since sync_token (every event from yesterday on, for a full sync when sync_token is None),
+    following the pages. Returns (events, next sync token)."""
+    params = {"singleEvents": "true", "maxResults": 250}
+    if sync_token:
+        params["syncToken"] = sync_token
+    else:
+        params["timeMin"] = (timezone.now() - FULL_SYNC_LOOKBACK).strftime("%Y-%m-%dT%H:%M:%SZ")
+    events = []
+    while True:
+        response = google_get(_events_url(credential), rate_key=access_token, params=params,
+                              headers={"Authorization": f"Bearer {access_token}"})
+        if response.status_code == 410:
+            raise SyncTokenExpired()
+        response.raise_for_status()
+        page = response.json()
+        events.extend(page.get("items", []))
+        if "nextPageToken" not in page:
+            return events, page.get("nextSyncToken")
+        params["pageToken"] = page["nextPageToken"]
+
+
+def sync_calendar(credential):
+    """ Bring the credential's BusyEvent mirror up to date with the calendar. Only changed events are listed once there's a sync token.
+    Returns the number of events that changed, or None if we couldn't get a token or reach google."""
+    sync, _ = CalendarSync.objects.get_or_create(credential=credential)
+    access_token = get_valid_access_token(credential.user)
+    if not access_token:
+        return None
+    full = not sync.sync_token
+    try:
+        try:
+            events, next_sync_token = _list_changes(credential, access_token, sync.sync_token)
+        except SyncTokenExpired:
+            full = True
+            events, next_sync_token = _list_changes(credential, access_token, None)
+    except requests.RequestException:
+        logger.warning("Calendar sync failed for credential %s", credential.pk, exc_info=True)
+        return None
+
+    touched = set()
+    with transaction.atomic():
+        existing = BusyEvent.objects.filter(credential=credential)
+        if full:
+            # a full listing replaces the whole mirror
+            touched.update(existing.values_list("start", "end"))
+            existing.delete()
+        else:
+            changed_ids = [event["id"] for event in events]
+            touched.update(existing.filter(event_id__in=changed_ids).values_list("start", "end"))
+            existing.filter(event_id__in=changed_ids).delete()
+        rows = {}
+        for event in events:
+            interval = event_interval(event)
+            if interval is not None and interval[0] < interval[1]:
+                # keyed by id: an event changed twice while we paged shows up twice, the later one wins
+                rows[event["id"]] = BusyEvent(credential=credential, event_id=event["id"],
+                                              start=interval[0], end=interval[1])
+                touched.add(interval)
+        # an upsert, so two notifications syncing at the same time don't trip over each other's rows
+        BusyEvent.objects.bulk_create(
+            rows.values(), batch_size=500, update_conflicts=True,
+            unique_fields=["credential", "event_id"], update_fields=["start", "end"])
+        sync.sync_token = next_sync_token
+        sync.synced_at = timezone.now()
+        sync.save(update_fields=["sync_token", "synced_at"])
+
+    # busy times cached before this sync are out of date on the days the changed events touch
+    dates = set()
+    for start, end in touched:
+        dates |= _salon_dates(start, end)
+    invalidate_busy(credential.user_id, sorted(dates))
+    return len(events)
+
+
+def watch_calendar(credential):
+    """ Open a push channel on the credential's calendar pointing at GOOGLE_WEBHOOK_URL (stopping the old one) and make sure the mirror is synced.
+    Returns the CalendarSync, or None if google said no."""
+    sync, _ = CalendarSync.objects.get_or_create(credential=credential)
+    access_token = get_valid_access_token(credential.user)
+    if not access_token:
+        return None
+    channel_id, channel_token = str(uuid.uuid4()), secrets.token_urlsafe(32)
+    try:
+        response = google_post(
+            f"{_events_url(credential)}/watch", rate_key=access_token,
+            headers={"Authorization": f"Bearer {access_token}"},
+            json={
+                "id": channel_id,
+                "type": "web_hook",
+                "address": settings.GOOGLE_WEBHOOK_URL,
+                # google sends this back in X-Goog-Channel-Token, so we know a notification is really for our channel
+                "token": channel_token,
+                "params": {"ttl": str(settings.GOOGLE_CHANNEL_TTL_SEC)},
+            })
+    except requests.RequestException:
+        logger.warning("Opening a calendar channel failed for credential %s", credential.pk, exc_info=True)
+        return None
+    if response.status_code != 200:
+        logger.warning("Google refused a calendar channel for credential %s: %s", credential.pk, response.status_code)
+        return None
+    channel = response.json()
+
+    if sync.channel_id:
+        stop_channel(sync, access_token)
+    sync.channel_id = channel_id
+    sync.channel_token = channel_token
+    sync.resource_id = channel["resourceId"]
+    # expiration is milliseconds since the epoch
+    sync.channel_expiration = datetime.datetime.fromtimestamp(
+        int(channel["expiration"]) / 1000, tz=datetime.timezone.utc)
+    sync.save(update_fields=["channel_id", "channel_token", "resource_id", "channel_expiration"])
+    if not sync.sync_token:
+        sync_calendar(credential)
+    return sync
+
+
+def stop_channel(sync, access_token):
+    """ Tell google to stop sending notifications for the sync's current channel. Best effort: it expires on its own anyway."""
+    try:
+        google_post(f"{settings.GOOGLE_API_BASE_URL}/channels/stop", rate_key=access_token,
+                    headers={"Authorization": f"Bearer {access_token}"},
+                    json={"id": sync.channel_id, "resourceId": sync.resource_id})
+    except requests.RequestException:
+        pass
+
+
+def handle_notification(headers):
+    """ Act on one push notification (the X-Goog-* request headers). Returns False if it isn't for a channel of ours."""
+    channel_id = headers.get("X-Goog-Channel-ID")
+    if not channel_id:
+        return False
+    sync = CalendarSync.objects.select_related("credential__user").filter(channel_id=channel_id).first()
+    if sync is None or not hmac.compare_digest(sync.channel_token, headers.get("X-Goog-Channel-Token", "")) \
+            or sync.resource_id != headers.get("X-Goog-Resource-ID"):
+        return False
+    # "sync" is google saying hello when the channel opens, everything else means something on the calendar changed
+    if headers.get("X-Goog-Resource-State") != "sync":
+        sync_calendar(sync.credential)
+    return True
+
+
+def _live_mirror_filter():
+    return {"sync_token__isnull": False, "channel_expiration__gt": timezone.now(), "credential__busy_calendar_ids": []}
+
+
+def mirror_busy_by_day(stylist_id, dates):
+    """ {date: busy intervals} for the stylist from the local mirror, or None if their calendar isn't mirrored
+    (no channel, or it expired so we might have missed changes)."""
+    if not settings.GOOGLE_WEBHOOK_URL:
+        return None  # no push channels without a webhook, don't query for a mirror that can't exist
+    credential_id = (CalendarSync.objects.filter(credential__user_id=stylist_id, **_live_mirror_filter())
+                     .values_list("credential_id", flat=True).first())
+    if credential_id is None:
+        return None
+    range_start, range_end = local_day_bounds(min(dates))[0], local_day_bounds(max(dates))[1]
+    intervals = list(BusyEvent.objects.filter(credential_id=credential_id, start__lt=range_end, end__gt=range_start)
+                     .values_list("start", "end"))
+    return split_busy_by_day(intervals, dates)
+
+
+async def amirror_busy_by_day(stylist_id, dates):
+    """ Async version of mirror_busy_by_day()."""
+    if not settings.GOOGLE_WEBHOOK_URL:
+        return None
+    credential_id = await (CalendarSync.objects.filter(credential__user_id=stylist_id, **_live_mirror_filter())
+                           .values_list("credential_id", flat=True).afirst())
+    if credential_id is None:
+        return None
+    range_start, range_end = local_day_bounds(min(dates))[0], local_day_bounds(max(dates))[1]
+    intervals = [interval async for interval in BusyEvent.objects.filter(
+        credential_id=credential_id, start__lt=range_end, end__gt=range_start).values_list("start", "end")]
+    return split_busy_by_day(intervals, dates)
+
+
+def credentials_to_watch(window):
+    """ Google credentials with no push channel, or one that expires within window (timedelta): the ones renew_calendar_channels opens a channel for.
+    Credentials with other calendars to check (busy_calendar_ids) are left out, their busy times come from FreeBusy."""
+    renew_before = timezone.now() + window
+    return (OAuthCredential.objects.filter(provider="google", busy_calendar_ids=[]).select_related("user")
+            .filter(Q(calendar_sync__isnull=True) | Q(calendar_sync__channel_expiration__isnull=True)
+                    | Q(calendar_sync__channel_expiration__lte=renew_before))
+            .order_by("calendar_sync__channel_expiration"))
@@ -0,0 +1,105 @@
+# Circuit breakers for the google calls, so a google outage doesn't make every availability request wait on (and keep hammering) a failing upstream.
+# Each breaker counts consecutive failures of one thing: a google endpoint ("google:freebusy", "google:token") or one stylist's calendar ("google:freebusy:stylist:12").
+#   closed: calls go through. after `failure_threshold` failures in a row it opens
+#   open: calls are skipped right away (callers fall back to stale busy times) until `reset_timeout` seconds have passed
+#   half_open: one trial call goes through. success closes the breaker, failure opens it for another reset_timeout
+#
+# Breakers are per process (like the token cache), which is fine: each worker finds out about an outage after a few failures on its own.
+
+import threading
+import time
+import requests
+from django.conf import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(requests.RequestException):
+    """ The endpoint's breaker didn't let the call through, so it wasn't sent (says nothing about the stylist's own calendar)."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """ True if a call should go through now. In half_open only one caller gets True, until it reports back."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_running = False
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def release(self):
+        """ The call allow() let through ended without a result (e.g. it was cancelled). Lets another trial call through."""
+        with self._lock:
+            self._trial_running = False
+
+    def is_open(self):
+        """ True while calls are being skipped (open, or half_open with the trial call still out)."""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at < self.reset_timeout
+            return self.state == HALF_OPEN and self._trial_running
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, failure_threshold=None):
+    """ The breaker called name (created the first time), e.g. get_breaker("google:freebusy").
+    failure_threshold defaults to GOOGLE_BREAKER_FAILURES."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(failure_threshold or settings.GOOGLE_BREAKER_FAILURES,
+                                         settings.GOOGLE_BREAKER_RESET_SEC)
+                _breakers[name] = breaker
+    return breaker
+
+
+def stylist_breaker(stylist_id):
+    """ Breaker for one stylist's FreeBusy calls (a calendar that keeps failing shouldn't cost a google call on every request)."""
+    return get_breaker(f"google:freebusy:stylist:{stylist_id}", settings.GOOGLE_BREAKER_STYLIST_FAILURES)
+
+
+def breaker_states():
+    """ {name: state} of every breaker so far, for GET /metrics/google."""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.state for name, breaker in sorted(breakers.items())}
+
+
+def is_upstream_failure(status_code):
+    """ Responses that mean google itself is in trouble (vs. e.g. a 401 for one stylist's revoked token)."""
+    return status_code == 429 or status_code >= 500
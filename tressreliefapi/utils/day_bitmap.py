@@ -0,0 +1,152 @@
+# A stylist's working day as a bitmap of slot-granularity cells instead of a list of (start, end) busy tuples.
+# Cell i covers [opening + i * granularity, opening + (i + 1) * granularity) and its bit is 1 when the stylist is free for that whole cell.
+# The bits live in one python int (a 9-5 day at 15 minutes is 32 cells, so a few dozen bytes instead of a list of datetime tuples),
+# which gives cheap checks like "is 2pm-4pm free" and lets us AND/OR whole days across stylists in one operation:
+#   a & b -> free for both stylists, a | b -> free for at least one of them
+#
+# A cell that's only partly busy counts as busy, so slots always start on the granularity grid from opening.
+# That's the same as generate_available_slots() whenever busy times start and end on the grid (google events almost always do),
+# while for off-grid busy times (e.g. ending at 10:20) the python engine restarts its grid at 10:20 and the bitmap waits for 10:30.
+
+from datetime import timedelta
+from functools import reduce
+import operator
+from tressreliefapi.utils.availability import SLOT_GRANULARITY_MIN, working_hours
+
+
+class DayBitmap:
+    """ Free cells of one salon-local working day. Build one with from_busy() or free_day()."""
+    __slots__ = ("date", "granularity", "day_start", "cell_count", "bits")
+
+    def __init__(self, date, bits, granularity=SLOT_GRANULARITY_MIN):
+        self.date = date
+        self.granularity = granularity
+        day_start, day_end = working_hours(date)
+        self.day_start = day_start
+        self.cell_count = (day_end - day_start) // self.step
+        # cells past closing never count as free
+        self.bits = bits & self.full_mask
+
+    @property
+    def step(self):
+        return timedelta(minutes=self.granularity)
+
+    @property
+    def full_mask(self):
+        return (1 << self.cell_count) - 1
+
+    @classmethod
+    def free_day(cls, date, granularity=SLOT_GRANULARITY_MIN):
+        """ A day with every cell free."""
+        return cls(date, -1, granularity)
+
+    @classmethod
+    def from_busy(cls, date, busy_intervals, granularity=SLOT_GRANULARITY_MIN):
+        """ Bitmap of the date's working hours with every cell a busy interval touches cleared."""
+        bitmap = cls.free_day(date, granularity)
+        bits = bitmap.bits
+        for start, end in busy_intervals:
+            first, last = bitmap._cell_span(start, end)
+            first, last = max(first, 0), min(last, bitmap.cell_count)
+            if first < last:
+                bits &= ~(((1 << (last - first)) - 1) << first)
+        bitmap.bits = bits
+        return bitmap
+
+    def _cell_span(self, start, end):
+        """ (first, last) cell indexes (last exclusive) that [start, end) overlaps. Can be outside 0 .. cell_count."""
+        first = (start - self.day_start) // self.step
+        # ceiling division, so a time that ends mid-cell takes the whole cell
+        last = -((self.day_start - end) // self.step)
+        return first, last
+
+    def cells_for(self, duration):
+        """ How many cells a service of duration minutes needs."""
+        return -(-duration // self.granularity)
+
+    def is_free_cells(self, first, count):
+        """ True if cells first .. first + count - 1 are all free."""
+        if first < 0 or count <= 0 or first + count > self.cell_count:
+            return False
+        mask = ((1 << count) - 1) << first
+        return self.bits & mask == mask
+
+    def is_free(self, start, end):
+        """ True if [start, end) is inside working hours and every cell it touches is free."""
+        first, last = self._cell_span(start, end)
+        return self.is_free_cells(first, last - first)
+
+    def starts(self, duration):
+        """ Bitmap of the cells a service of duration minutes can start at. OR them across stylists (any_free()) for the times
+        at least one stylist can start, e.g. the month summary's open_times."""
+        needed = self.cells_for(duration)
+        if needed > self.cell_count:
+            return DayBitmap(self.date, 0, self.granularity)
+        # bit i of runs stays set only if cells i .. i + needed - 1 are all free
+        runs = self.bits
+        for shift in range(1, needed):
+            runs &= self.bits >> shift
+        return DayBitmap(self.date, runs, self.granularity)
+
+    def slot_cells(self, duration):
+        """ Index of every cell a service of duration minutes can start at, in order."""
+        runs = self.starts(duration).bits
+        cells = []
+        while runs:
+            lowest = runs & -runs
+            cells.append(lowest.bit_length() - 1)
+            runs ^= lowest
+        return cells
+
+    def slots(self, duration):
+        """ Bookable (start, end) UTC datetimes for a service of duration minutes, like generate_available_slots()."""
+        length = timedelta(minutes=duration)
+        return [(start, start + length) for start in
+                (self.day_start + cell * self.step for cell in self.slot_cells(duration))]
+
+    def free_cell_count(self):
+        return bin(self.bits).count("1")
+
+    def _check_compatible(self, other):
+        if (self.date, self.granularity) != (other.date, other.granularity):
+            raise ValueError(
+                "Can only combine bitmaps of the same date and granularity.")
+
+    def __and__(self, other):
+        self._check_compatible(other)
+        return DayBitmap(self.date, self.bits & other.bits, self.granularity)
+
+    def __or__(self, other):
+        self._check_compatible(other)
+        return DayBitmap(self.date, self.bits | other.bits, self.granularity)
+
+    def __eq__(self, other):
+        if not isinstance(other, DayBitmap):
+            return NotImplemented
+        return (self.date, self.granularity, self.bits) == (other.date, other.granularity, other.bits)
+
+    def __hash__(self):
+        return hash((self.date, self.granularity, self.bits))
+
+    def __repr__(self):
+        # cell 0 (opening) first, 1 = free
+        cells = format(self.bits, f"0{self.cell_count}b")[::-1]
+        return f"DayBitmap({self.date}, {cells})"
+
+    def to_bytes(self):
+        """ The bits as bytes (little-endian), e.g. for a cache. Rebuild with DayBitmap.from_bytes()."""
+        return self.bits.to_bytes((self.cell_count + 7) // 8, "little")
+
+    @classmethod
+    def from_bytes(cls, date, data, granularity=SLOT_GRANULARITY_MIN):
+        return cls(date, int.from_bytes(data, "little"), granularity)
+
+
+def any_free(bitmaps):
+    """ Cells where at least one of the bitmaps is free (e.g. "any stylist")."""
+    return reduce(operator.or_, bitmaps)
+
+
+def all_free(bitmaps):
+    """ Cells where every one of the bitmaps is free."""
+    return reduce(operator.and_, bitmaps)
@@ -0,0 +1,108 @@
+# Async google client for the ASGI views. Instead of opening a new connection for every call (what requests.post/get does), every coroutine shares one httpx.AsyncClient, which keeps a pool of open keep-alive connections to google.
+# While a call is waiting on google the event loop is free to work on other requests, so one ASGI worker can have many slow google calls in flight at once.
+# Same timeouts, retry policy and rate limiter (utils/rate_limit.py) as the sync transport in google_transport.py.
+
+# DOCS: https://www.python-httpx.org/async/
+
+import asyncio
+import weakref
+import httpx
+from django.conf import settings
+from tressreliefapi.utils.circuit_breaker import CircuitOpen, get_breaker, is_upstream_failure
+from tressreliefapi.utils.google_transport import BACKOFF_MAX, RETRY_STATUSES, google_timeout
+from tressreliefapi.utils.google_utils import parse_freebusy
+from tressreliefapi.utils.rate_limit import GoogleRateLimited, get_rate_limiter, rate_limit_reason, throttle_delay
+
+# one client per event loop. an httpx.AsyncClient can only be used on the loop it was created on.
+# under uvicorn/daphne there is one loop per worker so this ends up being one client per process. weak keys so clients for loops that are gone (e.g. async_to_sync under WSGI) get cleaned up
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """ Return the shared AsyncClient for the running event loop, creating it the first time."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        connect_timeout, read_timeout = google_timeout()
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.GOOGLE_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GOOGLE_HTTP_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            # retries here only cover failing to connect, status retries are handled in agoogle_request()
+            transport=httpx.AsyncHTTPTransport(
+                retries=settings.GOOGLE_HTTP_RETRIES),
+        )
+        _clients[loop] = client
+    return client
+
+
+def _retry_delay(response, attempt):
+    """ Seconds to wait before retrying: google's Retry-After if it sent one, otherwise exponential backoff."""
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(int(retry_after), BACKOFF_MAX)
+    return min(settings.GOOGLE_HTTP_BACKOFF_SEC * (2 ** attempt), BACKOFF_MAX)
+
+
+async def agoogle_request(method, url, rate_key=None, **kwargs):
+    """ Async version of google_transport.google_request(). Waits its turn in the rate limiter, retries 429/5xx answers with backoff and
+    returns the last response once it runs out of retries. Raises httpx.HTTPError if google can't be reached,
+    GoogleRateLimited if the call would have had to wait too long for its turn."""
+    client = get_async_client()
+    limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        await limiter.aacquire(rate_key)
+        response = await client.request(method, url, **kwargs)
+        reason = rate_limit_reason(response)
+        if (reason is None and response.status_code not in RETRY_STATUSES) or attempt >= settings.GOOGLE_HTTP_RETRIES:
+            return response
+        if reason is not None:
+            # over quota: pause the limiter so every queued call waits it out, the retry waits in line like the rest
+            limiter.pause(throttle_delay(response, attempt),
+                          rate_key if reason == "userRateLimitExceeded" else None)
+        else:
+            await asyncio.sleep(_retry_delay(response, attempt))
+        attempt += 1
+
+
+async def afetch_busy_intervals(access_token, time_min, time_max, calendar_ids=("primary",)):
+    """ Async FreeBusy query for the stylist's calendars (merged, like fetch_busy_intervals()).
+    Returns a list of (start, end) datetimes, or None if the call failed. Raises GoogleRateLimited / CircuitOpen if it wasn't sent."""
+    # same body as the sync view sends: between time_min and time_max, give me the busy chunks for each calendar
+    body = {
+        "timeMin": time_min,
+        "timeMax": time_max,
+        "items": [{"id": calendar_id} for calendar_id in calendar_ids]
+    }
+    # same breaker as the sync fetch_busy_intervals()
+    breaker = get_breaker("google:freebusy")
+    if not breaker.allow():
+        raise CircuitOpen("google:freebusy is open")
+    try:
+        response = await agoogle_request(
+            "POST",
+            f"{settings.GOOGLE_API_BASE_URL}/freeBusy",
+            rate_key=access_token,
+            headers={"Authorization": f"Bearer {access_token}"},
+            json=body,
+        )
+    except GoogleRateLimited:
+        breaker.release()  # we didn't send it, says nothing about google. the caller falls back to stale busy times
+        raise
+    except httpx.HTTPError:
+        breaker.record_failure()
+        return None  # couldn't reach google (timed out, connection refused, ...)
+    except asyncio.CancelledError:
+        breaker.release()  # e.g. the request deadline passed. says nothing about google
+        raise
+    if is_upstream_failure(response.status_code):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    if response.status_code != 200:
+        return None
+
+    return parse_freebusy(response.json(), calendar_ids)
@@ -0,0 +1,104 @@
+# Every call the server makes to google goes through here.
+# requests.get()/requests.post() open a brand new TCP + TLS connection every time and then throw it away, and they wait forever if google never answers.
+# Instead we keep one requests.Session per process. Its connection pool keeps connections to google open (HTTP keep-alive), so after the first call we skip the handshake.
+# Every call also gets connect/read timeouts, and 5xx answers are retried with exponential backoff.
+# Calls that mustn't be sent twice (the one-time authorization code exchange, google_post(..., retry=False)) go on a second session that never retries:
+# a code that google already used comes back invalid_grant the second time, hiding the real error.
+# Calls wait their turn in the rate limiter (utils/rate_limit.py) first. 429s (and 403 quota errors) pause the limiter for google's Retry-After and are retried through it.
+
+# DOCS: https://requests.readthedocs.io/en/latest/user/advanced/#session-objects
+# https://urllib3.readthedocs.io/en/stable/reference/urllib3.util.html#urllib3.util.Retry
+
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from tressreliefapi.utils.rate_limit import get_rate_limiter, rate_limit_reason, throttle_delay
+
+# google answers these when it's having a bad time, worth trying again. (429 "slow down" goes through the rate limiter instead, see google_request())
+RETRY_STATUSES = (500, 502, 503, 504)
+# never sleep longer than this between 5xx retries, however far the backoff has doubled
+BACKOFF_MAX = 30
+
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+def google_timeout(deadline=None):
+    """ (connect, read) timeout in seconds used for every google call.
+    With a deadline (a time.monotonic() value) both are capped at the time left before it, and None means there's no time left."""
+    timeout = (settings.GOOGLE_HTTP_CONNECT_TIMEOUT, settings.GOOGLE_HTTP_READ_TIMEOUT)
+    if deadline is None:
+        return timeout
+    left = deadline - time.monotonic()
+    if left <= 0:
+        return None
+    return tuple(min(seconds, left) for seconds in timeout)
+
+
+def _build_session(retry_calls):
+    retry = Retry(
+        total=settings.GOOGLE_HTTP_RETRIES if retry_calls else 0,
+        backoff_factor=settings.GOOGLE_HTTP_BACKOFF_SEC,
+        backoff_max=BACKOFF_MAX,
+        status_forcelist=RETRY_STATUSES,
+        # urllib3 doesn't retry POSTs by default. the POSTs we send (freeBusy queries, token refreshes) are safe to send again
+        allowed_methods=frozenset({"GET", "POST"}),
+        # urllib3 would otherwise retry any 429/413/503 carrying a Retry-After and sleep for all of it (uncapped) inside the call.
+        # Retry-After is the rate limiter's job (google_request()), where the wait is bounded by GOOGLE_RATE_MAX_WAIT_SEC
+        respect_retry_after_header=False,
+        # once we run out of retries hand back the last response instead of raising, callers already check status_code
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,  # number of hosts to keep a pool for (googleapis, oauth2.googleapis, ...)
+        pool_maxsize=settings.GOOGLE_HTTP_MAX_CONNECTIONS,  # open connections kept per host
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(retry_calls=True):
+    """ Return the process-wide google session, creating it the first time. retry_calls=False: the session that never retries.
+    requests.Session is fine to share between the availability view's worker threads."""
+    session = _sessions.get(retry_calls)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(retry_calls)
+            if session is None:
+                session = _sessions[retry_calls] = _build_session(retry_calls)
+    return session
+
+
+def google_request(method, url, rate_key=None, retry=True, **kwargs):
+    """ Send a request to google through the shared session. Same arguments as requests.request().
+    rate_key (the access token the call is made with) puts the call in that user's rate limit bucket too.
+    retry=False sends it exactly once (no 5xx or quota retries), for calls that mustn't be repeated.
+    Raises requests.RequestException if google can't be reached even after retrying,
+    GoogleRateLimited (a RequestException) if the call would have had to wait too long for its turn."""
+    kwargs.setdefault("timeout", google_timeout())
+    limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        limiter.acquire(rate_key)
+        response = get_session(retry).request(method, url, **kwargs)
+        reason = rate_limit_reason(response)
+        if reason is None or not retry or attempt >= settings.GOOGLE_HTTP_RETRIES:
+            return response
+        # over quota: hold back every call for that quota (not just this one) for as long as google asked, then try again in line
+        limiter.pause(throttle_delay(response, attempt),
+                      rate_key if reason == "userRateLimitExceeded" else None)
+        attempt += 1
+
+
+def google_get(url, **kwargs):
+    return google_request("GET", url, **kwargs)
+
+
+def google_post(url, **kwargs):
+    return google_request("POST", url, **kwargs)
@@ -3,48 +3,351 @@
 # DOCS: Refrshing an access token (offline access): https://developers.google.com/identity/protocols/oauth2/web-server#offline
 
 import datetime
+import logging
+import threading
+import time
 import requests
+from asgiref.sync import sync_to_async
+from dateutil.parser import isoparse
 from tressreliefapi.models.oauth_credential import OAuthCredential
+from tressreliefapi.utils.availability import normalize_intervals
+from tressreliefapi.utils.circuit_breaker import CircuitOpen, get_breaker, is_upstream_failure
+from tressreliefapi.utils.google_transport import google_post, google_timeout
+from tressreliefapi.utils.rate_limit import GoogleRateLimited
 from django.conf import settings
+from django.db import connection
+from django.db.models import Q
 from django.utils import timezone
 
+logger = logging.getLogger(__name__)
 
-def get_valid_access_token(user):
+
+# in-process cache of access tokens we know are still valid: user_id -> (access_token, token_expiry)
+# a cache hit means no OAuthCredential query for the token. entries stop counting as valid TOKEN_EXPIRY_MARGIN before google's expiry, which is also when the next lookup will refresh the token.
+# only the token is kept: the calendar list can be edited through the api in any worker, and forget_access_token() only reaches this process, so it's always read from the row.
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+
+
+# one lock per credential so only one thread in this process refreshes a given token at a time (see refresh_access_token())
+_refresh_locks = {}
+_refresh_locks_guard = threading.Lock()
+# how often a worker waiting on another process's refresh checks the credential for the new token
+REFRESH_POLL_SEC = 0.05
+
+
+def _token_expiry_margin(min_valid=None):
+    margin = datetime.timedelta(
+        seconds=settings.GOOGLE_TOKEN_EXPIRY_MARGIN_SEC)
+    return max(margin, min_valid) if min_valid else margin
+
+
+def _is_token_valid(credential, min_valid=None):
+    """ True if the credential's access token is good for at least the expiry margin (or min_valid if that's longer)."""
+    return bool(credential.access_token and credential.token_expiry
+                and credential.token_expiry - _token_expiry_margin(min_valid) > timezone.now())
+
+
+def get_cached_access_token(user_id, min_valid=None):
+    """ Return the cached access token for the user if it's still valid, otherwise None."""
+    with _token_cache_lock:
+        entry = _token_cache.get(user_id)
+        if entry is None:
+            return None
+        access_token, token_expiry = entry
+        if token_expiry - _token_expiry_margin(min_valid) > timezone.now():
+            return access_token
+        if token_expiry - _token_expiry_margin() <= timezone.now():
+            del _token_cache[user_id]  # expired, next lookup goes to the db (and refreshes)
+        return None
+
+
+def cache_access_token(credential):
+    """ Remember the credential's access token until it expires."""
+    with _token_cache_lock:
+        _token_cache[credential.user_id] = (credential.access_token, credential.token_expiry)
+
+
+def forget_access_token(user_id):
+    """ Drop the user's cached token, e.g. when their credential is changed or deleted."""
+    with _token_cache_lock:
+        _token_cache.pop(user_id, None)
+
+
+def busy_calendars(credential):
+    """ Ids of the credential's calendars whose busy times count: calendar_id (where appointments go) and its busy_calendar_ids, without duplicates."""
+    return tuple(dict.fromkeys([credential.calendar_id, *credential.busy_calendar_ids]))
+
+
+def _known_busy_calendars(user, prefetched):
+    if prefetched is not None and prefetched.get(user.id) is not None:
+        return busy_calendars(prefetched[user.id])
+    return None
+
+
+def get_busy_calendars(user, prefetched=None):
+    """ The ids of the calendars to check for the user's busy times (see busy_calendars()).
+    From the prefetched credential if there is one (see prefetch_credentials()), otherwise from the db."""
+    calendar_ids = _known_busy_calendars(user, prefetched)
+    if calendar_ids is not None:
+        return calendar_ids
+    credential = OAuthCredential.objects.filter(user=user, provider='google').first()
+    return busy_calendars(credential) if credential else ('primary',)
+
+
+async def aget_busy_calendars(user, prefetched=None):
+    """ Async version of get_busy_calendars()."""
+    calendar_ids = _known_busy_calendars(user, prefetched)
+    if calendar_ids is not None:
+        return calendar_ids
+    credential = await OAuthCredential.objects.filter(user=user, provider='google').afirst()
+    return busy_calendars(credential) if credential else ('primary',)
+
+
+def prefetch_credentials(user_ids):
+    """ Load the google credentials for every user, in one query (the calendar lists are needed even when the token is cached).
+    Returns {user_id: OAuthCredential or None}, None meaning the user hasn't connected google.
+    Pass the result to get_valid_access_token(prefetched=...) and get_busy_calendars(prefetched=...) so they don't query per stylist."""
+    if not user_ids:
+        return {}
+    prefetched = dict.fromkeys(user_ids)
+    for credential in OAuthCredential.objects.filter(user_id__in=user_ids, provider='google'):
+        prefetched[credential.user_id] = credential
+    return prefetched
+
+
+def get_valid_access_token(user, prefetched=None):
     """ Ensure the stylist has a valid Google access token. 
-    Refresh if expired, then return the token."""
+    Refresh if expired, then return the token.
+    prefetched is the optional result of prefetch_credentials() for a batch of stylists."""
 
-    # 1.) Look up the stylit's OAuthCredential
-    try:
-        credential = OAuthCredential.objects.get(user=user, provider='google')
-    except OAuthCredential.DoesNotExist:
-        return None  # stylist hasn't connected their google account yet
+    # 0.) if we already know a valid token for this stylist, use it without touching the db
+    access_token = get_cached_access_token(user.id)
+    if access_token:
+        return access_token
+
+    # 1.) Look up the stylit's OAuthCredential (from the prefetched batch if we have one)
+    if prefetched is not None and user.id in prefetched:
+        credential = prefetched[user.id]
+        if credential is None:
+            return None  # stylist hasn't connected their google account yet
+    else:
+        try:
+            credential = OAuthCredential.objects.get(
+                user=user, provider='google')
+        except OAuthCredential.DoesNotExist:
+            return None  # stylist hasn't connected their google account yet
 
     # 2.) Check if token_expiry is in the valid still (if it is greater than 'now'), if so return the access token
-    if credential.token_expiry and credential.token_expiry > timezone.now():
+    if _is_token_valid(credential):
+        cache_access_token(credential)
         return credential.access_token
 
-    # 3.) othwerwise (if token_expiry is in the past (invalid)), call google's token refresh endpoint with the stored refresh_token (docs linked above).
-    else:
-        data = {
-            "client_id": settings.GOOGLE_CLIENT_ID,  # from google cloud
-            "client_secret": settings.GOOGLE_CLIENT_SECRET,  # from google cloud
-            # tells google what kind of exchange this is, docs say it must be this value
-            "grant_type": 'refresh_token',
-            "refresh_token": credential.refresh_token,
-        }
-        response = requests.post(
+    # 3.) othwerwise (if token_expiry is in the past (invalid)), refresh it. refresh_access_token() makes sure only one refresh per credential runs at a time.
+    return refresh_access_token(credential)
+
+
+def _refresh_lock(credential_id):
+    with _refresh_locks_guard:
+        return _refresh_locks.setdefault(credential_id, threading.Lock())
+
+
+def refresh_access_token(credential, min_valid=None):
+    """ Refresh the credential's access token with its refresh token and return the new token (None if google said no).
+
+    Refreshes are single-flight: when a token expires, every request that includes that stylist notices at the same time.
+    Only the first one actually POSTs to google, the rest wait and reuse its token.
+    - threads in this process wait on a per-credential lock
+    - worker processes take turns through the credential's refresh_lock_until: a conditional UPDATE that only one of them wins (_claim_refresh()).
+      the losers poll the row until the winner's token shows up, or take over if its lock runs out (GOOGLE_TOKEN_REFRESH_LOCK_SEC).
+      plain UPDATEs work on every database, including sqlite, and no transaction stays open during the google call.
+    After getting each lock we check again whether someone else already refreshed the token.
+    min_valid (timedelta) refreshes tokens that are still valid but expire within that window (used by the background refresher)."""
+    with _refresh_lock(credential.pk):
+        # another thread may have refreshed it while we waited for the lock
+        access_token = get_cached_access_token(credential.user_id, min_valid)
+        if access_token:
+            return access_token
+
+        while True:
+            credential = OAuthCredential.objects.filter(pk=credential.pk).first()
+            if credential is None:
+                return None  # credential was deleted (stylist disconnected google)
+            # another process may have refreshed it while we waited for its refresh lock
+            if _is_token_valid(credential, min_valid):
+                cache_access_token(credential)
+                return credential.access_token
+            if _claim_refresh(credential.pk):
+                break
+            time.sleep(REFRESH_POLL_SEC)
+
+        refreshed = False
+        try:
+            refreshed = _refresh_from_google(credential)
+        finally:
+            if not refreshed:
+                # let the next caller try (after success the save below already cleared it)
+                OAuthCredential.objects.filter(pk=credential.pk).update(refresh_lock_until=None)
+        if not refreshed:
+            return None
+        cache_access_token(credential)
+        # return valid access token for use in future api calls
+        return credential.access_token
+
+
+def _claim_refresh(credential_id):
+    """ Take the credential's refresh lock unless another worker holds it. True if we got it."""
+    now = timezone.now()
+    return OAuthCredential.objects.filter(
+        Q(refresh_lock_until__isnull=True) | Q(refresh_lock_until__lt=now), pk=credential_id,
+    ).update(refresh_lock_until=now + datetime.timedelta(seconds=settings.GOOGLE_TOKEN_REFRESH_LOCK_SEC)) == 1
+
+
+def _refresh_from_google(credential):
+    """ POST the refresh token to google and save the new access token on the credential (releasing its refresh lock). True if it worked."""
+    # call google's token refresh endpoint with the stored refresh_token (docs linked above).
+    data = {
+        "client_id": settings.GOOGLE_CLIENT_ID,  # from google cloud
+        "client_secret": settings.GOOGLE_CLIENT_SECRET,  # from google cloud
+        # tells google what kind of exchange this is, docs say it must be this value
+        "grant_type": 'refresh_token',
+        "refresh_token": credential.refresh_token,
+    }
+    # while google's token endpoint is failing, don't add to the pile (the breaker lets a trial call through now and then)
+    breaker = get_breaker("google:token")
+    if not breaker.allow():
+        return False
+    try:
+        response = google_post(
             # the following returns json with new access token and expiry time if successful
-            'https://oauth2.googleapis.com/token', data=data)
-        if response.status_code != 200:  # if refresh failed
+            settings.GOOGLE_TOKEN_URL, data=data)
+    except GoogleRateLimited:
+        breaker.release()  # throttled on our side, google's fine. try again next time
+        return False
+    except requests.RequestException:
+        breaker.record_failure()
+        return False  # couldn't reach google, treat it like a failed refresh
+    if response.status_code != 200:  # if refresh failed
+        _record_response(breaker, response)
+        return False
+    breaker.record_success()
+
+    tokens = response.json()
+    credential.access_token = tokens["access_token"]
+    # default to 1 hour if missing
+    expires_in = tokens.get("expires_in", 3600)
+    credential.token_expiry = timezone.now() + datetime.timedelta(seconds=expires_in)
+    credential.refresh_lock_until = None
+    # save the new access token and expiry time back to the DB, where the workers waiting on the refresh lock pick it up
+    credential.save(update_fields=["access_token", "token_expiry", "refresh_lock_until"])
+    return True
+
+
+def _refresh_access_token_in_thread(credential):
+    """ refresh_access_token() for sync_to_async: closes the worker thread's db connection when done."""
+    try:
+        return refresh_access_token(credential)
+    finally:
+        connection.close()
+
+
+async def aprefetch_credentials(user_ids):
+    """ Async version of prefetch_credentials()."""
+    if not user_ids:
+        return {}
+    prefetched = dict.fromkeys(user_ids)
+    async for credential in OAuthCredential.objects.filter(user_id__in=user_ids, provider='google'):
+        prefetched[credential.user_id] = credential
+    return prefetched
+
+
+async def aget_valid_access_token(user, prefetched=None):
+    """ Async version of get_valid_access_token() for the ASGI views.
+    The cache check and db lookup don't block the event loop. The (rare) refresh runs the single-flight refresh_access_token() in a thread."""
+
+    access_token = get_cached_access_token(user.id)
+    if access_token:
+        return access_token
+
+    if prefetched is not None and user.id in prefetched:
+        credential = prefetched[user.id]
+        if credential is None:
+            return None  # stylist hasn't connected their google account yet
+    else:
+        try:
+            credential = await OAuthCredential.objects.aget(user=user, provider='google')
+        except OAuthCredential.DoesNotExist:
+            return None  # stylist hasn't connected their google account yet
+
+    if _is_token_valid(credential):
+        cache_access_token(credential)
+        return credential.access_token
+
+    # refreshing is rare (about once an hour per stylist) and has to hold the single-flight locks, so it runs in a thread instead of on the event loop
+    return await sync_to_async(_refresh_access_token_in_thread, thread_sensitive=False)(credential)
+
+
+def _record_response(breaker, response):
+    """ Tell an endpoint's breaker how a call went. Only 429/5xx count as google failing, a 401 for one stylist's token doesn't."""
+    if is_upstream_failure(response.status_code):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def fetch_busy_intervals(access_token, time_min, time_max, calendar_ids=('primary',), timeout=None):
+    """ Ask google FreeBusy for the busy chunks on the stylist's calendars (calendar_ids, see get_busy_calendars()) between time_min and time_max.
+    All the calendars are asked in one call and their busy times merged. timeout overrides the (connect, read) timeout, see google_timeout().
+    Returns a list of (start, end) datetimes, or None if the call failed.
+    Raises GoogleRateLimited if the call didn't get its turn in the rate limiter in time, CircuitOpen if FreeBusy's breaker is open (either way it wasn't sent)."""
+    # DOCS: https://developers.google.com/workspace/calendar/api/v3/reference/freebusy/query
+    # what the freebusy api expects in the body of the post request
+    body = {
+        "timeMin": time_min,
+        "timeMax": time_max,
+        # every calendar to check, in the one call ("primary" is the authenticated user's main calendar)
+        "items": [{"id": calendar_id} for calendar_id in calendar_ids]
+    }
+    # while FreeBusy is failing for everyone, fail fast instead of waiting on it (callers fall back to stale busy times)
+    breaker = get_breaker("google:freebusy")
+    if not breaker.allow():
+        raise CircuitOpen("google:freebusy is open")
+    try:
+        response = google_post(
+            f"{settings.GOOGLE_API_BASE_URL}/freeBusy",
+            # the stylist's token also gets its own rate limit bucket (google's per-user quota)
+            rate_key=access_token,
+            # bearer means whoever presents this is the "bearer" and is granted access. no other auth needed.
+            headers={"Authorization": f"Bearer {access_token}"},
+            # this runs json.dumps() for us and sets content-type to application/json
+            json=body,
+            timeout=timeout or google_timeout(),
+        )
+    except GoogleRateLimited:
+        breaker.release()  # we didn't send it, says nothing about google. the caller falls back to stale busy times
+        raise
+    except requests.RequestException:
+        breaker.record_failure()
+        return None  # couldn't reach google (timed out, connection refused, ...)
+    _record_response(breaker, response)
+    if response.status_code != 200:
+        return None
+
+    # parse the response to get busy intervals. .json() parses json string into a python dict
+    return parse_freebusy(response.json(), calendar_ids)
+
+
+def parse_freebusy(payload, calendar_ids):
+    """ The merged busy intervals of the calendars in a FreeBusy response, or None if google couldn't tell us about one of them.
+    Calendars google can't find (deleted, or no longer shared with the stylist) are skipped, so they can't hide the stylist for good."""
+    busy = []
+    for calendar_id in calendar_ids:
+        calendar = payload["calendars"].get(calendar_id, {"errors": [{"reason": "notFound"}]})
+        reasons = {error.get("reason") for error in calendar.get("errors", ())}
+        if reasons == {"notFound"}:
+            logger.warning("FreeBusy couldn't find calendar %s, skipping it", calendar_id)
+            continue
+        if reasons:
             return None
-        else:  # refresh successful
-            tokens = response.json()
-
-            credential.access_token = tokens["access_token"]
-            # default to 1 hour if missing
-            expires_in = tokens.get("expires_in", 3600)
-            credential.token_expiry = timezone.now() + datetime.timedelta(seconds=expires_in)
-    # 4.) (cont on step 3) save the new access token and expiry time back to the DB
-            credential.save()
-    # 5.) return valid access token for use in future api calls
-            return credential.access_token
+        busy.extend((isoparse(b["start"]), isoparse(b["end"])) for b in calendar["busy"])
+    return normalize_intervals(busy)
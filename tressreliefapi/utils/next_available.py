@@ -0,0 +1,76 @@
+# "Book me the soonest appointment": walk forward from a start date and yield open slots in time order, across all of the service's stylists.
+# It's a lazy generator, so the caller takes as many slots as it wants (itertools.islice) and nothing after that is fetched or computed.
+# Busy times are fetched in growing windows (1 day, then 2, 4, 8, ... up to MAX_WINDOW_DAYS): the soonest slot is usually today or tomorrow,
+# so the first window is small, but a fully booked stretch doesn't cost one round of google calls per day.
+# The whole search shares the request's deadline (request_deadline()): stylists whose calls miss it are reported as timed out,
+# and once it has passed no more windows are fetched.
+
+import heapq
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from tressreliefapi.utils.availability import SALON_TZ, generate_available_slots
+from tressreliefapi.utils.stylist_busy import gather_stylists_busy
+
+FIRST_WINDOW_DAYS = 1
+MAX_WINDOW_DAYS = 16
+
+
+def salon_today():
+    """ Today's date in the salon's time zone."""
+    return timezone.now().astimezone(SALON_TZ).date()
+
+
+def _add_timed_out(timed_out, stylists):
+    if timed_out is not None:
+        timed_out.extend(stylist for stylist in stylists if stylist not in timed_out)
+
+
+def busy_windows(stylists, start_date, max_days, deadline=None, timed_out=None):
+    """ Yield (date, [busy intervals or None per stylist]) for each day from start_date on, at most max_days of them.
+    Busy times are fetched one growing window at a time, and only when the caller asks for a day that isn't fetched yet.
+    Stylists whose calls miss the deadline (a time.monotonic() value) are added to timed_out (a list) and count as None.
+    If the deadline has passed before the next window, the search stops there and every stylist is added to timed_out."""
+    window = FIRST_WINDOW_DAYS
+    offset = 0
+    while offset < max_days:
+        if deadline is not None and time.monotonic() >= deadline:
+            _add_timed_out(timed_out, stylists)
+            return
+        dates = [start_date + timedelta(days=offset + i)
+                 for i in range(min(window, max_days - offset))]
+        # one FreeBusy call per stylist for the whole window (or none, if the busy cache has it), all stylists at the same time
+        busy_by_days, late = gather_stylists_busy(
+            stylists, dates, lambda stylist, busy_by_day: busy_by_day, deadline)
+        _add_timed_out(timed_out, late)
+        for date in dates:
+            yield date, [None if busy_by_day is None else busy_by_day[date]
+                         for busy_by_day in busy_by_days]
+        offset += len(dates)
+        window = min(window * 2, MAX_WINDOW_DAYS)
+
+
+def _stylist_day_slots(position, stylist, slots):
+    # the stylist's position breaks ties between equal start times, so stylists are never compared
+    for start, end in slots:
+        yield start, position, end, stylist
+
+
+def iter_next_available(service, stylists, start_date, max_days=None, now=None, deadline=None, timed_out=None):
+    """ Lazily yield (start, end, stylist) for every open slot from start_date on, soonest first (ties in stylist order).
+    Slots that already started (before now) are skipped. Stops after max_days days (NEXT_AVAILABLE_MAX_DAYS).
+    deadline and timed_out: see busy_windows()."""
+    if not stylists:
+        return
+    max_days = max_days or settings.NEXT_AVAILABLE_MAX_DAYS
+    now = now or timezone.now()
+    for date, busy_per_stylist in busy_windows(stylists, start_date, max_days, deadline, timed_out):
+        # slots for one day at a time, only once the caller gets this far
+        day_slots = [_stylist_day_slots(position, stylist, generate_available_slots(service.duration, busy, date))
+                     for position, (stylist, busy) in enumerate(zip(stylists, busy_per_stylist))
+                     if busy is not None]
+        # merge the stylists' sorted lists by start time
+        for start, _, end, stylist in heapq.merge(*day_slots):
+            if start >= now:
+                yield start, end, stylist
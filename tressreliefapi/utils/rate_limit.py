@@ -0,0 +1,180 @@
+# Token buckets in front of every google call, so a burst of availability requests queues up a little instead of
+# blowing through google's quotas (which then answers 429 and the stylists go missing).
+# Two kinds of bucket, and a call has to get a token from each that applies:
+#   global: the whole process (google's per-project quota), GOOGLE_RATE_PER_SEC with bursts up to GOOGLE_RATE_BURST
+#   per user: one per access token (google's per-user quota), GOOGLE_RATE_USER_PER_SEC / GOOGLE_RATE_USER_BURST
+# A call that would have to wait longer than GOOGLE_RATE_MAX_WAIT_SEC for its tokens isn't queued at all: it raises GoogleRateLimited
+# (callers fall back to stale busy times, see utils/stylist_busy.py). When google answers 429 anyway, its Retry-After pauses the bucket
+# so every queued call waits it out, instead of each of them hitting google and getting its own 429.
+#
+# Buckets are per process, like the circuit breakers. metrics() is what GET /metrics/google shows.
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+import requests
+from django.conf import settings
+
+# per-user buckets we keep around. access tokens change every hour so old ones fall off the end
+MAX_USER_BUCKETS = 10000
+
+
+class GoogleRateLimited(requests.RequestException):
+    """ The call would have had to wait longer than GOOGLE_RATE_MAX_WAIT_SEC for its turn, so it wasn't sent."""
+
+
+class TokenBucket:
+    """ Holds up to capacity tokens and gets rate more every second. Tokens can go negative: each reservation queues behind the ones before it."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        # refill clock. it's in the future while the bucket is paused for a Retry-After
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """ Seconds until the next token is ours."""
+        self._refill(now)
+        return max(0, self.updated - now) + max(0, 1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause_until(self, until):
+        """ Hand out nothing before until (google's Retry-After), then refill from empty so the queue drains at rate instead of in one burst."""
+        self._refill(time.monotonic())
+        if until > self.updated:
+            self.tokens = min(self.tokens, 0)
+            self.updated = until
+
+
+class RateLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._global = None
+        self._users = OrderedDict()
+        self._metrics = {
+            "calls": 0,  # calls that got their tokens
+            "throttled": 0,  # ...of which had to wait for them
+            "rejected": 0,  # calls not sent because the wait was over GOOGLE_RATE_MAX_WAIT_SEC
+            "wait_sec_total": 0.0,
+            "queue_depth": 0,  # calls waiting for their tokens right now
+            "max_queue_depth": 0,
+            "retry_after_pauses": 0,  # quota answers (429, 403 rateLimitExceeded) from google that paused a bucket
+        }
+
+    def _buckets(self, user_key):
+        buckets = []
+        if settings.GOOGLE_RATE_PER_SEC > 0:
+            if self._global is None:
+                self._global = TokenBucket(settings.GOOGLE_RATE_PER_SEC, settings.GOOGLE_RATE_BURST)
+            buckets.append(self._global)
+        if user_key is not None and settings.GOOGLE_RATE_USER_PER_SEC > 0:
+            bucket = self._users.get(user_key)
+            if bucket is None:
+                bucket = self._users[user_key] = TokenBucket(
+                    settings.GOOGLE_RATE_USER_PER_SEC, settings.GOOGLE_RATE_USER_BURST)
+                if len(self._users) > MAX_USER_BUCKETS:
+                    self._users.popitem(last=False)
+            self._users.move_to_end(user_key)
+            buckets.append(bucket)
+        return buckets
+
+    def _reserve(self, user_key):
+        """ Take a token from every bucket the call needs and return how long to wait before sending it.
+        Raises GoogleRateLimited (taking nothing) if that's longer than GOOGLE_RATE_MAX_WAIT_SEC."""
+        with self._lock:
+            buckets = self._buckets(user_key)
+            now = time.monotonic()  # after _buckets(), a bucket it just made mustn't look like it's refilling in the future
+            wait = max((bucket.wait_time(now) for bucket in buckets), default=0)
+            if wait > settings.GOOGLE_RATE_MAX_WAIT_SEC:
+                self._metrics["rejected"] += 1
+                raise GoogleRateLimited(f"google rate limit: would wait {wait:.2f}s")
+            for bucket in buckets:
+                bucket.take()
+            self._metrics["calls"] += 1
+            if wait > 0:
+                self._metrics["throttled"] += 1
+                self._metrics["wait_sec_total"] += wait
+                self._metrics["queue_depth"] += 1
+                self._metrics["max_queue_depth"] = max(
+                    self._metrics["max_queue_depth"], self._metrics["queue_depth"])
+            return wait
+
+    def _dequeue(self):
+        with self._lock:
+            self._metrics["queue_depth"] -= 1
+
+    def acquire(self, user_key=None):
+        """ Block until the call may be sent (user_key is the access token, for its per-user bucket)."""
+        wait = self._reserve(user_key)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._dequeue()
+
+    async def aacquire(self, user_key=None):
+        """ acquire() for the async transport: waits without blocking the event loop."""
+        wait = self._reserve(user_key)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._dequeue()
+
+    def pause(self, seconds, user_key=None):
+        """ Google said to back off for seconds: the user's bucket if it was that user's quota, otherwise the global one."""
+        with self._lock:
+            buckets = self._buckets(user_key)
+            if user_key is not None and len(buckets) > 1:
+                buckets = buckets[1:]
+            for bucket in buckets:
+                bucket.pause_until(time.monotonic() + seconds)
+            self._metrics["retry_after_pauses"] += 1
+
+    def metrics(self):
+        with self._lock:
+            return {**self._metrics, "wait_sec_total": round(self._metrics["wait_sec_total"], 3),
+                    "user_buckets": len(self._users)}
+
+
+_limiter = RateLimiter()
+
+
+def get_rate_limiter():
+    return _limiter
+
+
+# reasons google gives (403/429) when a quota is used up. userRateLimitExceeded is the per-user quota, the rest are project-wide
+# DOCS: https://developers.google.com/workspace/calendar/api/guides/errors#403_usage_limits_exceeded
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded")
+
+
+def rate_limit_reason(response):
+    """ The quota reason of a 403/429 from google ("" for a 429 without one), or None if the response isn't about quota."""
+    if response.status_code not in (403, 429):
+        return None
+    try:
+        errors = response.json()["error"]["errors"]
+        reason = errors[0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        reason = ""
+    if reason in RATE_LIMIT_REASONS or response.status_code == 429:
+        return reason
+    return None
+
+
+def throttle_delay(response, attempt):
+    """ Seconds google wants us to back off: its Retry-After if it sent one (in seconds), otherwise exponential backoff."""
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return int(retry_after)
+    return settings.GOOGLE_HTTP_BACKOFF_SEC * (2 ** attempt)
@@ -0,0 +1,28 @@
+# The slot engine the availability endpoints use, picked with AVAILABILITY_SLOT_ENGINE:
+#   numpy (default): every stylist and day in one vectorized pass (utils/availability_np.py)
+#   python: the plain loop in utils/availability.py, one stylist-day at a time
+# Both give the same slots. They come back the way the API sends them (and the snapshot rows store them): [start, end] pairs of
+# UTC ISO strings, formatted like DRF formats a datetime, so the engine never changes a response or a snapshot.
+
+from django.conf import settings
+from tressreliefapi.utils.availability import SLOT_GRANULARITY_MIN, generate_available_slots
+from tressreliefapi.utils.availability_np import slots_by_day_np
+
+
+def iso_datetime(dt):
+    """ UTC datetime -> the ISO string DRF's JSONEncoder makes of it (e.g. 2025-10-01T14:00:00Z)."""
+    representation = dt.isoformat()
+    if representation.endswith("+00:00"):
+        representation = representation[:-6] + "Z"
+    return representation
+
+
+def slots_by_day(service_duration, dates, busy_by_days, slot_granularity=SLOT_GRANULARITY_MIN):
+    """ Slots on every date for many stylists. busy_by_days has one {date: busy_intervals} dict per stylist (None for stylists to skip).
+    Returns one {date: [[start, end], ...]} dict per stylist (None stays None), with the times as ISO strings."""
+    if settings.AVAILABILITY_SLOT_ENGINE == "numpy":
+        return slots_by_day_np(service_duration, dates, busy_by_days, slot_granularity)
+    return [None if busy_by_day is None else {
+        date: [[iso_datetime(start), iso_datetime(end)]
+               for start, end in generate_available_slots(service_duration, busy_by_day[date], date, slot_granularity)]
+        for date in dates} for busy_by_day in busy_by_days]
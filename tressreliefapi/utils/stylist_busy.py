@@ -0,0 +1,322 @@
+# Get a stylist's busy intervals for one or more salon-local days, from the busy cache when we can and from google FreeBusy when we can't.
+# All the days that aren't cached are fetched with ONE FreeBusy call covering the whole range, then split by day (and cached per day).
+# So a week view costs one google call per stylist instead of seven.
+# When google is failing, the circuit breakers (utils/circuit_breaker.py) skip the call and the last fetched busy times are used instead, marked stale.
+# Same when the rate limiter (utils/rate_limit.py) can't fit the call in within its wait budget.
+# Calendars mirrored through push notifications (utils/calendar_sync.py) are read from the db instead, no google call at all.
+# The availability helpers below (gather/map/iter_stylists_busy) also add the stylists' booked appointments (utils/appointments.py) to their busy times.
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from django.conf import settings
+from django.db import connection
+from tressreliefapi.utils.appointments import add_appointments, appointments_by_day
+from tressreliefapi.utils.availability import local_day_bounds, split_busy_by_day
+from tressreliefapi.utils.busy_cache import acache_busy, aget_cached_busy, aget_stale_busy, cache_busy, get_cached_busy, get_stale_busy
+from tressreliefapi.utils.calendar_sync import amirror_busy_by_day, mirror_busy_by_day
+from tressreliefapi.utils.circuit_breaker import CircuitOpen, get_breaker, stylist_breaker
+from tressreliefapi.utils.google_async import afetch_busy_intervals
+from tressreliefapi.utils.google_utils import (aget_busy_calendars, aget_valid_access_token, fetch_busy_intervals, get_busy_calendars,
+                                               get_valid_access_token, prefetch_credentials)
+from tressreliefapi.utils.google_transport import google_timeout
+from tressreliefapi.utils.rate_limit import GoogleRateLimited
+
+logger = logging.getLogger(__name__)
+
+# one pool for every availability request in the process, so a slow google can't make the thread count grow with the traffic:
+# calls that missed their request's deadline keep a thread until their http timeout, but never more than AVAILABILITY_MAX_WORKERS threads in total
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """ The process-wide thread pool the stylists' google calls run on, created the first time."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.AVAILABILITY_MAX_WORKERS,
+                                               thread_name_prefix="stylist-busy")
+    return _executor
+
+
+def _rfc3339(dt):
+    """ UTC datetime -> the timestamp format google expects, e.g. 2025-10-01T05:00:00Z"""
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def freebusy_window(dates):
+    """ (timeMin, timeMax) strings covering every salon-local day from the first to the last date."""
+    return _rfc3339(local_day_bounds(min(dates))[0]), _rfc3339(local_day_bounds(max(dates))[1])
+
+
+class BusyDays(dict):
+    """ {date: busy intervals}, plus .stale = {date: age in seconds} for the days served from the stale copy because google was failing."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stale = {}
+
+
+def _use_stale(busy_by_day, dates, stale_entries):
+    """ Fill in the dates from their stale busy entries. None if any day has no stale entry (then we have nothing to show for the stylist)."""
+    for date, entry in zip(dates, stale_entries):
+        if entry is None:
+            return None
+        busy_by_day[date], busy_by_day.stale[date] = entry
+    return busy_by_day
+
+
+def _google_failing(stylist):
+    """ True if we shouldn't ask google for the stylist right now: FreeBusy as a whole or this stylist's calendar keeps failing."""
+    return get_breaker("google:freebusy").is_open() or stylist_breaker(stylist.id).is_open()
+
+
+def get_busy_by_day(stylist, dates, credentials=None, deadline=None):
+    """ Return {date: busy intervals} (a BusyDays) for the stylist on each of the dates,
+    or None if the stylist has no usable google calendar (not connected, or the google call failed and there's no stale copy to fall back on).
+    credentials is the optional prefetch_credentials() result for the request's stylists.
+    deadline (a time.monotonic() value, see request_deadline()) caps the FreeBusy call's http timeouts at the time the request has left.
+
+    While google is failing (the circuit breakers are open) or when the call fails, we serve the last busy times we fetched,
+    with their age in busy_by_day.stale, instead of waiting on google or dropping the stylist."""
+    busy_by_day = BusyDays()
+    missing = []
+    for date in dates:
+        busy = get_cached_busy(stylist.id, date)
+        if busy is None:
+            missing.append(date)
+        else:
+            busy_by_day[date] = busy
+    if not missing:
+        return busy_by_day  # everything was cached, no token or google call needed
+
+    # calendars kept in step by push notifications come from the local mirror (a sync invalidates the cached days it changes)
+    mirrored = mirror_busy_by_day(stylist.id, missing)
+    if mirrored is not None:
+        for date, busy in mirrored.items():
+            cache_busy(stylist.id, date, busy)
+            busy_by_day[date] = busy
+        return busy_by_day
+
+    def stale():
+        return _use_stale(busy_by_day, missing, [get_stale_busy(stylist.id, date) for date in missing])
+
+    if _google_failing(stylist):
+        return stale()
+
+    access_token = get_valid_access_token(stylist, prefetched=credentials)
+    if not access_token:
+        # the token endpoint is down (vs. the stylist just hasn't connected their google calendar yet)
+        return stale() if get_breaker("google:token").is_open() else None
+
+    timeout = google_timeout(deadline)
+    if timeout is None:
+        return stale()  # the request is out of time, the answer couldn't be used anyway
+    breaker = stylist_breaker(stylist.id)
+    if not breaker.allow():
+        return stale()
+    # one call from the first missing day to the last one (days in between that were cached just get refreshed), for all of the stylist's calendars
+    time_min, time_max = freebusy_window(missing)
+    calendar_ids = get_busy_calendars(stylist, prefetched=credentials)
+    try:
+        busy_intervals = fetch_busy_intervals(access_token, time_min, time_max, calendar_ids, timeout=timeout)
+    except (GoogleRateLimited, CircuitOpen):
+        # not sent: over our own quota budget, or FreeBusy is failing for everyone. either way not the stylist's calendar failing
+        breaker.release()
+        return stale()
+    if busy_intervals is None:
+        breaker.record_failure()
+        return stale()
+    breaker.record_success()
+
+    for date, busy in split_busy_by_day(busy_intervals, missing).items():
+        cache_busy(stylist.id, date, busy)
+        busy_by_day[date] = busy
+    return busy_by_day
+
+
+def needs_fetch(stylist, dates):
+    """ True if any of the stylist's days aren't in the busy cache (so we'll need their google credential)."""
+    return any(get_cached_busy(stylist.id, date) is None for date in dates)
+
+
+def _stylist_runner(stylists, dates, compute, deadline=None):
+    """ Returns (credentials, run): the prefetched credentials and the function each worker thread runs for one stylist."""
+    # load every stylist's google credential in one query (skips stylists whose busy times are already cached)
+    credentials = prefetch_credentials(
+        [stylist.id for stylist in stylists if needs_fetch(stylist, dates)])
+    # and every stylist's booked appointments in one query too
+    appointments = appointments_by_day([stylist.id for stylist in stylists], dates)
+
+    def run(stylist):
+        try:
+            busy_by_day = get_busy_by_day(stylist, dates, credentials, deadline=deadline)
+            if busy_by_day is None:
+                return None
+            return compute(stylist, add_appointments(busy_by_day, appointments.get(stylist.id, {})))
+        finally:
+            # each worker thread gets its own db connection, close it so they don't pile up
+            connection.close()
+    return credentials, run
+
+
+def request_deadline():
+    """ time.monotonic() value by which an availability request has to be done (AVAILABILITY_DEADLINE_SEC from now), or None for no deadline."""
+    if settings.AVAILABILITY_DEADLINE_SEC <= 0:
+        return None
+    return time.monotonic() + settings.AVAILABILITY_DEADLINE_SEC
+
+
+def _time_left(deadline):
+    return None if deadline is None else max(0, deadline - time.monotonic())
+
+
+def gather_stylists_busy(stylists, dates, compute, deadline=None):
+    """ For every stylist, get their busy intervals on the dates and run compute(stylist, busy_by_day) with them.
+    Returns (results, timed_out): one result per stylist in the same order as stylists (None for stylists we couldn't get busy times for),
+    and the stylists that weren't done by the deadline (a time.monotonic() value, see request_deadline()). Their result is None too.
+
+    The google calls for each stylist run at the same time on the process-wide thread pool (get_executor()),
+    so the whole thing takes about as long as the slowest stylist instead of the sum of all of them.
+    compute runs on the worker thread too, so per-stylist slot generation is spread out the same way.
+    At the deadline we stop waiting and return: a hanging google call can't hold the request any longer than that."""
+    if not stylists:
+        return [], []
+    _, run = _stylist_runner(stylists, dates, compute, deadline)
+
+    futures = [get_executor().submit(run, stylist) for stylist in stylists]
+    try:
+        done, _ = wait(futures, timeout=_time_left(deadline))
+        # results in the same order as the stylists we passed in, so the output order doesn't depend on which call finishes first
+        results, timed_out = [], []
+        for stylist, future in zip(stylists, futures):
+            if future in done:
+                results.append(_result(stylist, future))
+            else:
+                results.append(None)
+                timed_out.append(stylist)
+        return results, timed_out
+    finally:
+        # don't start the stylists that haven't started yet. the calls already running end on their own by the deadline (their http timeout)
+        for future in futures:
+            future.cancel()
+
+
+def map_stylists_busy(stylists, dates, compute, deadline=None):
+    """ gather_stylists_busy() without the list of stylists that timed out."""
+    return gather_stylists_busy(stylists, dates, compute, deadline)[0]
+
+
+def iter_stylists_busy(stylists, dates, compute, deadline=None):
+    """ Like gather_stylists_busy(), but yields (stylist, result, status) as soon as each stylist is done, fastest first, instead of waiting for all of them.
+    status is "ok", "not_connected" (no google calendar), "failed" (the google call or compute failed) or "timed_out" (not done by the deadline).
+    result is None unless status is "ok"."""
+    if not stylists:
+        return
+    credentials, run = _stylist_runner(stylists, dates, compute, deadline)
+
+    futures = {get_executor().submit(run, stylist): stylist for stylist in stylists}
+    try:
+        finished = set()
+        try:
+            for future in as_completed(futures, timeout=_time_left(deadline)):
+                finished.add(future)
+                yield _completed(futures[future], future, credentials)
+        except FuturesTimeoutError:
+            for future, stylist in futures.items():
+                if future not in finished:
+                    yield stylist, None, "timed_out"
+    finally:
+        # if the caller stops early (e.g. the client went away), don't start the stylists that haven't started yet
+        for future in futures:
+            future.cancel()
+
+
+def _result(stylist, future):
+    """ The finished future's result, or None if it raised."""
+    try:
+        return future.result()
+    except Exception:  # pylint: disable=broad-except
+        # one stylist blowing up shouldn't cut off everyone else's results
+        logger.exception("Availability failed for stylist %s", stylist.id)
+        return None
+
+
+def _completed(stylist, future, credentials):
+    """ (stylist, result, status) for a finished iter_stylists_busy() future."""
+    try:
+        result = future.result()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Availability failed for stylist %s", stylist.id)
+        return stylist, None, "failed"
+    if result is not None:
+        return stylist, result, "ok"
+    if stylist.id in credentials and credentials[stylist.id] is None:
+        return stylist, None, "not_connected"
+    return stylist, None, "failed"
+
+
+async def aget_busy_by_day(stylist, dates, credentials=None):
+    """ Async version of get_busy_by_day() for the ASGI views."""
+    busy_by_day = BusyDays()
+    missing = []
+    for date in dates:
+        busy = await aget_cached_busy(stylist.id, date)
+        if busy is None:
+            missing.append(date)
+        else:
+            busy_by_day[date] = busy
+    if not missing:
+        return busy_by_day
+
+    mirrored = await amirror_busy_by_day(stylist.id, missing)
+    if mirrored is not None:
+        for date, busy in mirrored.items():
+            await acache_busy(stylist.id, date, busy)
+            busy_by_day[date] = busy
+        return busy_by_day
+
+    async def stale():
+        return _use_stale(busy_by_day, missing, [await aget_stale_busy(stylist.id, date) for date in missing])
+
+    if _google_failing(stylist):
+        return await stale()
+
+    access_token = await aget_valid_access_token(stylist, prefetched=credentials)
+    if not access_token:
+        return await stale() if get_breaker("google:token").is_open() else None
+
+    breaker = stylist_breaker(stylist.id)
+    if not breaker.allow():
+        return await stale()
+    time_min, time_max = freebusy_window(missing)
+    calendar_ids = await aget_busy_calendars(stylist, prefetched=credentials)
+    try:
+        busy_intervals = await afetch_busy_intervals(access_token, time_min, time_max, calendar_ids)
+    except (GoogleRateLimited, CircuitOpen):
+        breaker.release()
+        return await stale()
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    if busy_intervals is None:
+        breaker.record_failure()
+        return await stale()
+    breaker.record_success()
+
+    for date, busy in split_busy_by_day(busy_intervals, missing).items():
+        await acache_busy(stylist.id, date, busy)
+        busy_by_day[date] = busy
+    return busy_by_day
+
+
+async def aneeds_fetch(stylist, dates):
+    for date in dates:
+        if await aget_cached_busy(stylist.id, date) is None:
+            return True
+    return False
@@ -6,3 +6,10 @@ from .oauth import oauth_google_initiate
 from .oauth_callback import oauth_google_callback
 from .oauth_credential import OAuthCredentialViewSet
 from .availability import service_availability
+from .availability_async import service_availability_async
+from .next_available import service_next_available
+from .availability_summary import service_availability_summary
+from .google_metrics import google_metrics
+from .calendar_webhook import google_calendar_webhook
+from .appointment import AppointmentView
+from .combined_availability import combined_availability
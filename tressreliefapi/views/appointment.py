@@ -0,0 +1,88 @@
+"""View module for handling requests about appointments"""
+from dateutil.parser import isoparse
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.viewsets import ViewSet
+from tressreliefapi.models import Appointment, StylistService, UserInfo
+from tressreliefapi.serializers import AppointmentSerializer
+from tressreliefapi.utils.availability import local_day_bounds
+from tressreliefapi.utils.booking import BookingError, CalendarUnavailable, SlotTaken, book_appointment, cancel_appointment
+
+
+class AppointmentView(ViewSet):
+
+    # GET /appointments, /appointments?stylistId=:id&date=YYYY-MM-DD
+    def list(self, request):
+        """Handle GET requests for appointments (booked ones, soonest first)"""
+        appointments = Appointment.objects.filter(status="booked").order_by("start")
+
+        stylist_id = request.query_params.get('stylistId')
+        if stylist_id:
+            appointments = appointments.filter(stylist_id=stylist_id)
+        client_id = request.query_params.get('clientId')
+        if client_id:
+            appointments = appointments.filter(client_id=client_id)
+        date = request.query_params.get('date')
+        if date:
+            date = parse_date(date)
+            if not date:
+                return Response({'message': "date has to be YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
+            day_start, day_end = local_day_bounds(date)
+            appointments = appointments.filter(start__lt=day_end, end__gt=day_start)
+
+        serializer = AppointmentSerializer(appointments, many=True)
+        return Response(serializer.data)
+
+    # GET /appointments/:id
+    def retrieve(self, request, pk):
+        """Handle GET requests for single appointment"""
+        try:
+            appointment = Appointment.objects.get(pk=pk)
+            serializer = AppointmentSerializer(appointment)
+            return Response(serializer.data)
+        except Appointment.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
+
+    # POST /appointments  {"service": id, "stylist": id, "start": "2025-10-01T15:00:00Z", "client": id (optional)}
+    def create(self, request):
+        """Handle POST operations. Books the slot if it's still free (409 if someone got it first)"""
+        try:
+            start = isoparse(str(request.data["start"]))
+            service_id, stylist_id = int(request.data["service"]), int(request.data["stylist"])
+            client_id = int(request.data["client"]) if request.data.get("client") else None
+        except (KeyError, TypeError, ValueError):
+            return Response({'message': "service, stylist (and client) ids and start (ISO datetime) are required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if start.tzinfo is None:
+            return Response({'message': "start needs a time zone (e.g. 2025-10-01T15:00:00Z)."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            stylist_service = StylistService.objects.select_related("service", "stylist").get(
+                service_id=service_id, stylist_id=stylist_id)
+            client = UserInfo.objects.get(pk=client_id) if client_id else None
+        except (StylistService.DoesNotExist, UserInfo.DoesNotExist) as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            appointment = book_appointment(stylist_service, start, client)
+        except SlotTaken as ex:
+            return Response({'message': str(ex)}, status=status.HTTP_409_CONFLICT)
+        except CalendarUnavailable as ex:
+            return Response({'message': str(ex)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except BookingError as ex:
+            return Response({'message': str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = AppointmentSerializer(appointment)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    # DELETE /appointments/:id
+    def destroy(self, request, pk):
+        """Handle DELETE requests: cancels the appointment (it's kept, but its time is free again)"""
+        try:
+            appointment = Appointment.objects.get(pk=pk)
+        except Appointment.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
+        if appointment.status != "cancelled":
+            cancel_appointment(appointment)
+        return Response(None, status=status.HTTP_204_NO_CONTENT)
@@ -2,121 +2,334 @@
 # aka... For Service X on Date Y, what slots are open across the stylists who offer that service?
 # DOCS: https://developers.google.com/workspace/calendar/api/v3/reference/freebusy/query
 
-import requests
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from django.utils.dateparse import parse_date  # to parse date from query param
-from tressreliefapi.models import Service, StylistService, UserInfo
-from tressreliefapi.models.oauth_credential import OAuthCredential
-from tressreliefapi.utils.availability import generate_available_slots
-from tressreliefapi.utils.google_utils import get_valid_access_token
-from dateutil.parser import isoparse
+from tressreliefapi.models import Service, StylistService
+from tressreliefapi.negotiation import RESPONSE_SHAPE_FORMATS
+from tressreliefapi.utils.any_stylist import ASSIGNMENT_POLICIES, merge_stylist_slots
+from tressreliefapi.utils.availability import SLOT_GRANULARITY_MIN, bookable_intervals
+from tressreliefapi.utils.availability_snapshot import fresh_snapshots
+from tressreliefapi.utils.slot_engine import slots_by_day
+from tressreliefapi.utils.stylist_busy import gather_stylists_busy, iter_stylists_busy, request_deadline
+
+
+def is_range_query(query_params):
+    return bool(query_params.get('start') or query_params.get('end'))
+
+
+def parse_dates(query_params):
+    """ Read either ?date=YYYY-MM-DD or ?start=YYYY-MM-DD&end=YYYY-MM-DD (inclusive) from the query params.
+    Returns (dates, error). error is a message for a 400 response, or None if the dates are fine."""
+    if is_range_query(query_params):
+        start = parse_date(query_params.get('start') or "")
+        end = parse_date(query_params.get('end') or "")
+        if not start or not end or end < start:
+            return None, "Valid start and end query params are required (YYYY-MM-DD, end on or after start)."
+        day_count = (end - start).days + 1
+        if day_count > settings.AVAILABILITY_MAX_RANGE_DAYS:
+            return None, f"Date range can be at most {settings.AVAILABILITY_MAX_RANGE_DAYS} days."
+        return [start + timedelta(days=i) for i in range(day_count)], None
+
+    # parse and validate date
+    date = parse_date(query_params.get('date') or "")
+    if not date:
+        return None, "Valid date query param is required (YYYY-MM-DD)."
+    return [date], None
+
+
+def parse_any_stylist(query_params):
+    """ Read ?any=true and the optional ?policy= for the "any stylist" mode.
+    Returns (any_stylist, policy, error). error is a message for a 400 response, or None."""
+    any_stylist = (query_params.get('any') or "").lower() in ("true", "1")
+    policy = query_params.get(
+        'policy') or settings.AVAILABILITY_ANY_STYLIST_POLICY
+    if policy not in ASSIGNMENT_POLICIES:
+        return any_stylist, None, f"policy must be one of: {', '.join(ASSIGNMENT_POLICIES)}."
+    return any_stylist, policy, None
+
+
+def parse_format(query_params, any_stylist):
+    """ Read ?format=slots (default) or ?format=intervals. Returns (format, error)."""
+    response_format = query_params.get('format') or "slots"
+    if response_format not in RESPONSE_SHAPE_FORMATS:
+        return None, "format must be slots or intervals."
+    if response_format == "intervals" and any_stylist:
+        return None, "format=intervals can't be combined with any=true."
+    return response_format, None
+
+
+def stylist_info(stylist):
+    return {"stylist_id": stylist.id, "stylist_name": stylist.display_name}
+
+
+def with_stale(compute):
+    """ Wrap a compute(stylist, busy_by_day) so it also returns the days whose busy times came from the stale cache
+    (google failing, see utils/circuit_breaker.py): (result, {date: age in seconds})."""
+    def compute_with_stale(stylist, busy_by_day):
+        return compute(stylist, busy_by_day), busy_by_day.stale
+    return compute_with_stale
+
+
+def stale_fields(stale, date):
+    """ Marks a stylist's entry for date as built from stale busy times, and how old they are. Nothing if they're fresh."""
+    if date not in stale:
+        return {}
+    return {"stale": True, "stale_age_sec": stale[date]}
+
+
+def intervals_response(available, dates, duration, range_query):
+    """ Response body for ?format=intervals: each stylist's free windows (long enough for duration minutes) instead of every slot in them.
+    The client expands a window into slots itself: one every granularity minutes from its start, while start + duration fits."""
+    def stylist_intervals(stylist, intervals, stale, date):
+        return {**stylist_info(stylist), "intervals": intervals[date], **stale_fields(stale, date)}
+
+    body = {"duration": duration, "granularity": SLOT_GRANULARITY_MIN}
+    if not range_query:
+        date = dates[0]
+        return {"date": date, **body,
+                "stylists": [stylist_intervals(stylist, intervals, stale, date) for stylist, intervals, stale in available]}
+    return {
+        "start": dates[0],
+        "end": dates[-1],
+        **body,
+        "days": [{
+            "date": date,
+            "stylists": [stylist_intervals(stylist, intervals, stale, date) for stylist, intervals, stale in available]
+        } for date in dates]
+    }
+
+
+def parse_stream(query_params, any_stylist):
+    """ Read ?stream=true. Returns (stream, error)."""
+    stream = (query_params.get('stream') or "").lower() in ("true", "1")
+    if stream and any_stylist:
+        return None, "stream=true can't be combined with any=true (merging needs every stylist first)."
+    return stream, None
+
+
+def parse_source(query_params, stream):
+    """ Read ?source=live|snapshot (default live). Returns (source, error)."""
+    source = (query_params.get('source') or "live").lower()
+    if source not in ("live", "snapshot"):
+        return None, "source must be live or snapshot."
+    if source == "snapshot" and stream:
+        return None, "source=snapshot can't be combined with stream=true (it answers all at once)."
+    return source, None
+
+
+def partial_fields(timed_out):
+    """ Fields saying which stylists missed the request deadline (AVAILABILITY_DEADLINE_SEC) and were left out."""
+    return {"partial": bool(timed_out), "timed_out_stylists": [stylist_info(stylist) for stylist in timed_out]}
+
+
+def partial_headers(timed_out):
+    """ partial_fields() as headers, for the single-date response which is a plain list."""
+    return {
+        "X-Availability-Partial": "true" if timed_out else "false",
+        "X-Availability-Timed-Out-Stylists": ",".join(str(stylist.id) for stylist in timed_out),
+    }
+
+
+def ndjson_records(stylists, dates, compute, key, range_query, deadline=None):
+    """ Yield one NDJSON line per stylist as soon as that stylist's results are ready (fastest stylist first),
+    then a trailer line listing the stylists that were left out and why."""
+    left_out = {"not_connected": [], "failed": [], "timed_out": []}
+    for stylist, result, status in iter_stylists_busy(stylists, dates, with_stale(compute), deadline):
+        if status != "ok":
+            left_out[status].append(stylist)
+            continue
+        by_day, stale = result
+        if range_query:
+            record = {**stylist_info(stylist),
+                      "days": [{"date": date, key: by_day[date], **stale_fields(stale, date)} for date in dates]}
+        else:
+            record = {**stylist_info(stylist), key: by_day[dates[0]], **stale_fields(stale, dates[0])}
+        yield json.dumps(record, cls=JSONEncoder) + "\n"
+    yield json.dumps({
+        "done": True,
+        "stylist_count": len(stylists),
+        "skipped": [stylist_info(stylist) for stylist in left_out["not_connected"]],
+        "failed": [stylist_info(stylist) for stylist in left_out["failed"]],
+        **partial_fields(left_out["timed_out"]),
+    }) + "\n"
+
+
+def any_stylist_response(available, dates, policy, range_query):
+    """ Response body for ?any=true: every stylist's slots merged into one list per day, each start time once with the ids of the stylists free then."""
+    def merged_slots(date):
+        return merge_stylist_slots([(stylist.id, slots[date]) for stylist, slots, _ in available], policy)
+
+    def merged_stylist_info(stylist, stale):
+        # the days (of the ones asked for) this stylist's slots came from stale busy times
+        stale_days = [{"date": date, "stale_age_sec": stale[date]} for date in dates if date in stale]
+        return {**stylist_info(stylist), **({"stale_days": stale_days} if stale_days else {})}
+
+    body = {
+        "policy": policy,
+        # names once here instead of in every slot
+        "stylists": [merged_stylist_info(stylist, stale) for stylist, _, stale in available],
+    }
+    if not range_query:
+        return {"date": dates[0], **body, "slots": merged_slots(dates[0])}
+    return {
+        "start": dates[0],
+        "end": dates[-1],
+        **body,
+        "days": [{"date": date, "slots": merged_slots(date)} for date in dates],
+    }
+
+
+def service_stylists(service, stylist_id=None):
+    """ The stylists linked to the service via Stylist_Service (only stylist_id if given), in link order."""
+    # select_related pulls the stylist in the same query so the worker threads don't each need to fetch it
+    service_stylist_links = StylistService.objects.filter(
+        service=service).select_related("stylist").order_by("id")
+    # if stylist_id provided, filter to links of that stylist only
+    if stylist_id:
+        service_stylist_links = service_stylist_links.filter(
+            stylist__id=stylist_id)
+    return [link.stylist for link in service_stylist_links]
 
 # GET /services/:<service_id>/availability/?date=YYYY-MM-DD&stylist_id=:<stylist_id> (stylist_id is optional)
+# GET /services/:<service_id>/availability/?start=YYYY-MM-DD&end=YYYY-MM-DD&stylist_id=:<stylist_id>
+# GET /services/:<service_id>/availability/?date=YYYY-MM-DD&any=true&policy=round_robin (works with start/end too)
+# GET /services/:<service_id>/availability/?date=YYYY-MM-DD&format=intervals (works with start/end too)
+# GET /services/:<service_id>/availability/?date=YYYY-MM-DD&stream=true (works with start/end and format=intervals too)
+# GET /services/:<service_id>/availability/?date=YYYY-MM-DD&source=snapshot (works with every other param but stream)
 
 
 @api_view(['GET'])
 def service_availability(request, id):
     """
-    Get available appointment slots for a given service on a given date.
+    Get available appointment slots for a given service on a given date (or range of dates).
     Query params:
-    - date (required): date in YYYY-MM-DD format
+    - date: date in YYYY-MM-DD format
+    - start, end (instead of date): inclusive range of dates in YYYY-MM-DD format, e.g. a week.
+      each stylist's google calendar is asked once for the whole range.
     - stylist_id (optional): filter slots to a specific stylist
+    - any (optional): "true" merges all stylists into one slot list, each start time once with the ids of the stylists free then
+    - policy (optional, with any): order of those stylist ids. one of order, round_robin, most_free, least_free
+    - format (optional): "intervals" returns each stylist's free windows plus the service duration and slot granularity
+      instead of every (overlapping) slot in them. a lot smaller for long services
+    - stream (optional): "true" streams NDJSON, one line per stylist as soon as they're ready, then a {"done": true, ...} line
+      with the stylists that were skipped (no google calendar) or failed
+    Stylists whose google calls aren't done within AVAILABILITY_DEADLINE_SEC are left out and listed in
+    partial / timed_out_stylists (X-Availability-Partial / X-Availability-Timed-Out-Stylists headers for the single-date list).
+    While google is failing, stylists get slots from their last known busy times instead, marked "stale": true with "stale_age_sec".
+    - source (optional): "snapshot" answers from the precomputed AvailabilitySnapshot rows (build_availability_snapshots) with one query,
+      computing live only the stylists without a row for every day (or with rows older than AVAILABILITY_SNAPSHOT_MAX_AGE_SEC)
     """
-    # 1.) get data and stylist_id (if provided) from query params
-    date_str = request.query_params.get('date')
+    # the clock for AVAILABILITY_DEADLINE_SEC starts now
+    deadline = request_deadline()
+    # 1.) get the date(s) and stylist_id (if provided) from query params
+    dates, error = parse_dates(request.query_params)
+    if not error:
+        any_stylist, policy, error = parse_any_stylist(request.query_params)
+    if not error:
+        response_format, error = parse_format(
+            request.query_params, any_stylist)
+    if not error:
+        stream, error = parse_stream(request.query_params, any_stylist)
+    if not error:
+        source, error = parse_source(request.query_params, stream)
+    if error:
+        return Response({"error": error}, status=400)
     stylist_id = request.query_params.get('stylist_id')
 
-    # parse and validate date
-    date = parse_date(date_str)
+    # 2.) look up the service by id
+    try:
+        service = Service.objects.get(pk=id)
+    except Service.DoesNotExist as ex:
+        return Response({'message': ex.args[0]}, status=404)
 
-    if not date:
-        return Response({"error": "Valid date query param is required (YYYY-MM-DD)."}, status=400)
+    # 3.) Lookup stylists linked to the service via Stylist_Service (4.) filtered to stylist_id if provided)
+    stylists = service_stylists(service, stylist_id)
 
-    # 2.) look up the service by id
-    service = Service.objects.get(pk=id)
+    # 5.) for each stylist, get their busy times for the date(s) (one google call per stylist, all stylists at the same time) and turn them into slots for each day
+    def stylist_slots_by_day(stylist, busy_by_day):
+        # Generate available slots (apply salon hours + slice into bookable chunks) with the configured engine (utils/slot_engine.py)
+        return slots_by_day(service.duration, dates, [busy_by_day])[0]
 
-    # 3.) Lookup stylists linked to the service via Stylist_Service
-    service_stylist_links = StylistService.objects.filter(service=service)
-    # 4.) if stylist_id provided, filter to links of that stylist only
-    if stylist_id:
-        service_stylist_links = service_stylist_links.filter(
-            stylist__id=stylist_id)
+    def intervals_by_day(stylist, busy_by_day):
+        return {date: bookable_intervals(service.duration, busy_by_day[date], date)
+                for date in dates}
 
-    # 5.) for each stylist, get their availability for that date (using helper function that calls google calendar api)
-    availability = []
-    for link in service_stylist_links:
-        stylist = link.stylist
-        # Get access token for the stylist
-        access_token = get_valid_access_token(stylist)
-        if not access_token:
-            continue  # stylist hasn't connected their google calendar yet, skip them
-
-        # DEBUG: list all events for this stylist on that date
-        response = requests.get(
-            "https://www.googleapis.com/calendar/v3/calendars/primary/events",
-            headers={"Authorization": f"Bearer {access_token}"},
-            params={
-                "timeMin": f"{date.isoformat()}T00:00:00Z",
-                "timeMax": f"{date.isoformat()}T23:59:59Z",
-                "singleEvents": True,
-                "orderBy": "startTime"
-            }
-        )
-        print("Events raw:", response.json())
-
-        credential = OAuthCredential.objects.filter(
-            user=stylist, provider="google").first()
-        print("DEBUG stylist_id:", stylist.id, "google_email:", stylist.google_email,
-              "oauth_user_id:", credential.user_id if credential else None)
-
-        # call freebusy api
-        # DOCS: https://developers.google.com/workspace/calendar/api/v3/reference/freebusy/query
-        # we basically tell freebusy: Between X and Y, tell me the busy chunks for calendar Z. and it returns an array of busy chunks (start and end times).
-
-        # want the whole day in UTC to make sure we get all busy times that day. generate_available_slots() will handle converting to CST and enforcing working hours.
-        # start of day (midnight) in UTC
-        start_of_day = f"{date.isoformat()}T00:00:00Z"
-        # end of day (11:59:59pm) in UTC
-        end_of_day = f"{date.isoformat()}T23:59:59Z"
-
-        # what the freebusy api expects in the body of the post request
-        body = {
-            "timeMin": start_of_day,
-            "timeMax": end_of_day,
-            # primary calendar of the authenticated user
-            "items": [{"id": "primary"}]
-        }
+    if stream:
+        if response_format == "intervals":
+            compute, key = intervals_by_day, "intervals"
+        else:
+            compute, key = stylist_slots_by_day, "slots"
+        response = StreamingHttpResponse(
+            ndjson_records(stylists, dates, compute, key,
+                           is_range_query(request.query_params), deadline),
+            content_type="application/x-ndjson")
+        # ask proxies (nginx) not to buffer the stream, or the client gets it all at the end anyway
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    # stylists still waiting on google at the deadline come back in timed_out (and with a None result)
+    if source == "snapshot":
+        # one indexed query for every stylist-day precomputed recently enough...
+        snapshots = fresh_snapshots(service, stylists, dates,
+                                    "intervals" if response_format == "intervals" else "slots")
+        # ...and the usual live computation only for stylists missing some of the days
+        live = [stylist for stylist in stylists
+                if len(snapshots.get(stylist.id, {})) < len(dates)]
+        # ISO strings from either engine, like the snapshot rows (any=true compares start times across stylists)
+        compute = intervals_by_day if response_format == "intervals" else stylist_slots_by_day
+        live_results, timed_out = gather_stylists_busy(
+            live, dates, with_stale(compute), deadline)
+        live_results = dict(zip((stylist.id for stylist in live), live_results))
+        results = [live_results[stylist.id] if stylist.id in live_results else (snapshots[stylist.id], {})
+                   for stylist in stylists]
+    elif response_format == "intervals":
+        # no slots at all, just the free windows
+        results, timed_out = gather_stylists_busy(
+            stylists, dates, with_stale(intervals_by_day), deadline)
+    else:
+        # collect everyone's busy times first, then slice every stylist-day into slots in one pass (one vectorized pass with the numpy engine)
+        busy_by_days, timed_out = gather_stylists_busy(
+            stylists, dates, lambda stylist, busy_by_day: busy_by_day, deadline)
+        results = [None if busy_by_day is None else (slots, busy_by_day.stale)
+                   for slots, busy_by_day in zip(slots_by_day(service.duration, dates, busy_by_days), busy_by_days)]
+    # stylists we couldn't get busy times for (no google calendar connected, the google call failed or missed the deadline) are left out
+    available = [(stylist, *result) for stylist, result in zip(stylists, results)
+                 if result is not None]
 
-        response = requests.post(
-            # freebusy endpoint
-            "https://www.googleapis.com/calendar/v3/freeBusy",
-            # bearer means whoever presents this is the "bearer" and is granted access. no other auth needed.
-            # send the access token we got for the stylist in the auth header so we can see their calendar
-            headers={"Authorization": f"Bearer {access_token}"},
-            # this runs json.dumps() for us and sets content-type to application/json
-            json=body,
-        )
-        if response.status_code != 200:
-            continue  # skip this stylist if api call failed
-
-        print("FreeBusy raw:", response.json())
-
-        # parse the response to get busy intervals. .json() parses json string into a python dict
-        busy_raw = response.json()["calendars"]["primary"]["busy"]
-        busy_intervals = [(isoparse(b["start"]), isoparse(b["end"]))
-                          for b in busy_raw]
-
-        # Generate available slots (apply salon hours + slice into bookable chunks)
-        slots = generate_available_slots(
-            service.duration, busy_intervals, date)
-
-        # Add this stylist’s availability to results
-        availability.append({
+    if response_format == "intervals":
+        return Response({**intervals_response(available, dates, service.duration, is_range_query(request.query_params)),
+                         **partial_fields(timed_out)})
+    if any_stylist:
+        return Response({**any_stylist_response(available, dates, policy, is_range_query(request.query_params)),
+                         **partial_fields(timed_out)})
+
+    def stylist_slots(stylist, slots, stale, date):
+        return {
             "stylist_id": stylist.id,
             "stylist_name": stylist.display_name,
-            "slots": slots  # these are still in UTC, FE can convert back to CT when displaying
-        })
+            "slots": slots[date],  # these are still in UTC, FE can convert back to CT when displaying
+            **stale_fields(stale, date),
+        }
+
+    # 6. Return JSON array of stylists + their slots for a single date (a list can't hold the partial fields, so they go in headers)
+    if not is_range_query(request.query_params):
+        date = dates[0]
+        return Response([stylist_slots(stylist, slots, stale, date) for stylist, slots, stale in available],
+                        headers=partial_headers(timed_out))
 
-    # 5. Return JSON array of stylists + their slots
-    return Response(availability)
+    # ...or the same thing for every day in the range
+    return Response({
+        "start": dates[0],
+        "end": dates[-1],
+        "days": [{
+            "date": date,
+            "stylists": [stylist_slots(stylist, slots, stale, date) for stylist, slots, stale in available]
+        } for date in dates],
+        **partial_fields(timed_out),
+    })
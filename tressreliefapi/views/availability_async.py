@@ -0,0 +1,106 @@
+# async version of the service availability endpoint (views/availability.py), for running under ASGI (tressreliefproject/asgi.py).
+# the sync view ties up a worker thread for as long as google takes to answer. here the token refresh and FreeBusy calls are awaited, so while one request waits on google the same worker can keep serving other requests.
+# DRF's @api_view doesn't support async views, so this is a plain django async view that returns a JsonResponse.
+
+import asyncio
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.dateparse import parse_date
+from rest_framework.utils.encoders import JSONEncoder
+from tressreliefapi.models import Service, StylistService
+from tressreliefapi.utils.appointments import aappointments_by_day, add_appointments
+from tressreliefapi.utils.availability import bookable_intervals, generate_available_slots
+from tressreliefapi.utils.google_utils import aprefetch_credentials
+from tressreliefapi.utils.stylist_busy import aget_busy_by_day, aneeds_fetch
+from tressreliefapi.views.availability import any_stylist_response, intervals_response, parse_any_stylist, parse_format, partial_fields, partial_headers, stale_fields
+
+
+async def _astylist_slots(stylist, service, date, credentials, appointments, response_format):
+    """ Get one stylist's available slots (or free windows, for format=intervals) for the service on the date, or None to leave them out.
+    Returns (slots, stale) with stale the {date: age} of busy times that came from the stale cache."""
+    # same busy cache and FreeBusy window as the sync view (utils/stylist_busy.py), so both share fetches
+    busy_by_day = await aget_busy_by_day(stylist, [date], credentials)
+    if busy_by_day is None:
+        return None  # not connected to google, or the google call failed. skip this stylist
+    add_appointments(busy_by_day, appointments.get(stylist.id, {}))
+    if response_format == "intervals":
+        return bookable_intervals(service.duration, busy_by_day[date], date), busy_by_day.stale
+    return generate_available_slots(service.duration, busy_by_day[date], date), busy_by_day.stale
+
+# GET /services/:<service_id>/availability/async/?date=YYYY-MM-DD&stylist_id=:<stylist_id> (stylist_id is optional)
+# GET /services/:<service_id>/availability/async/?date=YYYY-MM-DD&any=true&policy=round_robin
+
+
+async def service_availability_async(request, id):
+    """
+    Async version of service_availability. Same query params and same response.
+    Query params:
+    - date (required): date in YYYY-MM-DD format
+    - stylist_id (optional): filter slots to a specific stylist
+    - any, policy, format (optional): "any stylist" mode and free-window format, see service_availability
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed."}, status=405)
+    # the clock for AVAILABILITY_DEADLINE_SEC starts now
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.AVAILABILITY_DEADLINE_SEC
+
+    date = parse_date(request.GET.get('date') or "")
+    stylist_id = request.GET.get('stylist_id')
+    if not date:
+        return JsonResponse({"error": "Valid date query param is required (YYYY-MM-DD)."}, status=400)
+    any_stylist, policy, error = parse_any_stylist(request.GET)
+    if not error:
+        response_format, error = parse_format(request.GET, any_stylist)
+    if error:
+        return JsonResponse({"error": error}, status=400)
+
+    try:
+        service = await Service.objects.aget(pk=id)
+    except Service.DoesNotExist:
+        return JsonResponse({"error": "Service not found."}, status=404)
+
+    service_stylist_links = StylistService.objects.filter(
+        service=service).select_related("stylist").order_by("id")
+    if stylist_id:
+        service_stylist_links = service_stylist_links.filter(
+            stylist__id=stylist_id)
+    stylists = [link.stylist async for link in service_stylist_links]
+
+    # one query for every stylist's credential (skipped entirely when all their busy times are cached)
+    uncached = [stylist.id for stylist in stylists
+                if await aneeds_fetch(stylist, [date])]
+    credentials = await aprefetch_credentials(uncached)
+    # and one for their booked appointments
+    appointments = await aappointments_by_day([stylist.id for stylist in stylists], [date])
+    # every stylist's google calls run at the same time. at the deadline we stop waiting: the ones not done yet are cancelled and reported as timed out
+    tasks = [asyncio.ensure_future(_astylist_slots(stylist, service, date, credentials, appointments, response_format))
+             for stylist in stylists]
+    timeout = None
+    if settings.AVAILABILITY_DEADLINE_SEC > 0:
+        timeout = max(0, deadline - loop.time())
+    timed_out = []
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        timed_out = [stylist for stylist, task in zip(stylists, tasks)
+                     if task in pending]
+    # results in the order the stylists were passed in
+    available = [(stylist, {date: task.result()[0]}, task.result()[1]) for stylist, task in zip(stylists, tasks)
+                 if stylist not in timed_out and task.result() is not None]
+
+    # DRF's encoder so datetimes come out exactly like they do from the sync view
+    if response_format == "intervals":
+        return JsonResponse({**intervals_response(available, [date], service.duration, range_query=False), **partial_fields(timed_out)},
+                            encoder=JSONEncoder)
+    if any_stylist:
+        return JsonResponse({**any_stylist_response(available, [date], policy, range_query=False), **partial_fields(timed_out)},
+                            encoder=JSONEncoder)
+    availability = [{
+        "stylist_id": stylist.id,
+        "stylist_name": stylist.display_name,
+        "slots": slots[date],
+        **stale_fields(stale, date),
+    } for stylist, slots, stale in available]
+    return JsonResponse(availability, safe=False, encoder=JSONEncoder, headers=partial_headers(timed_out))
@@ -0,0 +1,75 @@
+# month overview of a service's availability for the calendar picker: for each day, how many open slots there are and how many stylists have any.
+# every stylist's busy times for the whole month come from one ranged fetch (utils/stylist_busy.py), and slots are counted
+# from the free windows with arithmetic (count_slots()) instead of being built, so the response is tiny and cheap to compute.
+# open_times (distinct start times any stylist can take) comes from each stylist-day's DayBitmap of start cells (utils/day_bitmap.py):
+# OR-ing them is one int operation per stylist-day, where merging the slot lists would build every slot first.
+
+import calendar
+from datetime import date as date_cls, timedelta
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from tressreliefapi.models import Service
+from tressreliefapi.utils.availability import count_slots, free_intervals
+from tressreliefapi.utils.day_bitmap import DayBitmap, any_free
+from tressreliefapi.utils.stylist_busy import gather_stylists_busy, request_deadline
+from tressreliefapi.views.availability import partial_fields, service_stylists, with_stale
+
+
+def parse_month(query_params):
+    """ Read ?month=YYYY-MM. Returns (every date of the month, error)."""
+    try:
+        year, month = (int(part) for part in (query_params.get('month') or "").split("-"))
+        first = date_cls(year, month, 1)
+    except ValueError:
+        return None, "Valid month query param is required (YYYY-MM)."
+    day_count = calendar.monthrange(year, month)[1]
+    return [first + timedelta(days=i) for i in range(day_count)], None
+
+# GET /services/:<service_id>/availability/summary/?month=YYYY-MM&stylist_id=:<stylist_id> (stylist_id is optional)
+
+
+@api_view(['GET'])
+def service_availability_summary(request, id):
+    """
+    Per-day counts for a month: open_slots (bookable slots, counted per stylist), stylists_available (stylists with at least one)
+    and open_times (start times on the granularity grid from opening at which at least one stylist is free for the whole service).
+    Query params:
+    - month (required): YYYY-MM
+    - stylist_id (optional): only count that stylist
+    Days whose busy times came from the stale copy (google failing) for any stylist are marked "stale": true.
+    Stylists that missed the deadline are left out and listed in partial / timed_out_stylists, like service_availability.
+    """
+    deadline = request_deadline()
+    dates, error = parse_month(request.query_params)
+    if error:
+        return Response({"error": error}, status=400)
+    try:
+        service = Service.objects.get(pk=id)
+    except Service.DoesNotExist as ex:
+        return Response({'message': ex.args[0]}, status=404)
+    stylists = service_stylists(service, request.query_params.get('stylist_id'))
+
+    def counts_by_day(stylist, busy_by_day):
+        return {date: (count_slots(service.duration, free_intervals(busy_by_day[date], date)),
+                       DayBitmap.from_busy(date, busy_by_day[date]).starts(service.duration))
+                for date in dates}
+
+    results, timed_out = gather_stylists_busy(stylists, dates, with_stale(counts_by_day), deadline)
+    results = [result for result in results if result is not None]
+
+    def day_summary(date):
+        counts = [by_day[date][0] for by_day, _ in results]
+        starts = [by_day[date][1] for by_day, _ in results]
+        summary = {"date": date, "open_slots": sum(counts), "stylists_available": sum(count > 0 for count in counts),
+                   "open_times": any_free(starts).free_cell_count() if starts else 0}
+        if any(date in stale for _, stale in results):
+            summary["stale"] = True
+        return summary
+
+    return Response({
+        "month": request.query_params["month"],
+        "service_id": service.id,
+        "duration": service.duration,
+        "days": [day_summary(date) for date in dates],
+        **partial_fields(timed_out),
+    })
@@ -0,0 +1,17 @@
+# google calendar push notifications land here (the address we gave google when opening each channel, GOOGLE_WEBHOOK_URL)
+# everything is in the X-Goog-* headers, the body is empty. we pull the changed events into the local mirror (utils/calendar_sync.py)
+# DOCS: https://developers.google.com/workspace/calendar/api/guides/push#receiving-notifications
+
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from tressreliefapi.utils.calendar_sync import handle_notification
+
+# POST /webhooks/google/calendar (from google, not the frontend)
+
+
+@api_view(['POST'])
+def google_calendar_webhook(request):
+    """ One push notification. 200 tells google we got it, 404 if it's not for one of our channels (wrong id or token)."""
+    if not handle_notification(request.headers):
+        return Response(status=404)
+    return Response(status=200)
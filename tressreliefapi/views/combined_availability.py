@@ -0,0 +1,119 @@
+# availability for several services booked together ("cut + color") and done back to back by one stylist.
+# the stylists who offer every one of the services are found in one query, each of them has their busy times fetched once
+# (one set of google calls for the whole combination) and the slots are for the services' summed duration.
+
+from django.db.models import Count
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from tressreliefapi.models import Service, UserInfo
+from tressreliefapi.utils.availability import bookable_intervals
+from tressreliefapi.utils.slot_engine import slots_by_day
+from tressreliefapi.utils.stylist_busy import gather_stylists_busy, request_deadline
+from tressreliefapi.views.availability import (any_stylist_response, intervals_response, is_range_query, parse_any_stylist, parse_dates,
+                                               parse_format, partial_fields, stale_fields, stylist_info, with_stale)
+
+# most services one combined booking can hold
+MAX_COMBINED_SERVICES = 5
+
+
+def parse_service_ids(query_params):
+    """ Read ?services=1,2 (in the order they're done). Returns (service ids, error)."""
+    try:
+        service_ids = [int(service_id) for service_id in (query_params.get('services') or "").split(",") if service_id.strip()]
+    except ValueError:
+        return None, "services must be a comma separated list of service ids."
+    # the same service twice is still just that service
+    service_ids = list(dict.fromkeys(service_ids))
+    if not service_ids:
+        return None, "services query param is required (e.g. services=1,2)."
+    if len(service_ids) > MAX_COMBINED_SERVICES:
+        return None, f"At most {MAX_COMBINED_SERVICES} services can be booked together."
+    return service_ids, None
+
+
+def stylists_offering_all(service_ids, stylist_id=None):
+    """ The stylists linked to every one of the services (only stylist_id if given), in one query."""
+    stylists = (UserInfo.objects.filter(stylist_services__service__in=service_ids)
+                .annotate(offered=Count("stylist_services__service", distinct=True))
+                .filter(offered=len(service_ids)).order_by("id"))
+    if stylist_id:
+        stylists = stylists.filter(pk=stylist_id)
+    return list(stylists)
+
+
+def service_segments(services):
+    """ Where each service falls inside a combined slot: minutes from the slot's start, and its duration."""
+    segments, offset = [], 0
+    for service in services:
+        segments.append({"service_id": service.id, "name": service.name, "offset_min": offset, "duration": service.duration})
+        offset += service.duration
+    return segments
+
+# GET /availability/combined/?services=1,2&date=YYYY-MM-DD&stylist_id=:<stylist_id> (stylist_id is optional)
+# GET /availability/combined/?services=1,2&start=YYYY-MM-DD&end=YYYY-MM-DD
+# GET /availability/combined/?services=1,2&date=YYYY-MM-DD&any=true&policy=round_robin (works with start/end too)
+# GET /availability/combined/?services=1,2&date=YYYY-MM-DD&format=intervals (works with start/end too)
+
+
+@api_view(['GET'])
+def combined_availability(request):
+    """
+    Get available slots for several services done back to back by the same stylist, e.g. a cut and then color.
+    Query params:
+    - services (required): service ids in the order they're done, e.g. 3,7
+    - date, or start and end, stylist_id, any, policy, format: same as service_availability
+    Only stylists who offer every one of the services are included. Each slot is as long as the services' durations added up,
+    and "services" says where each service falls inside it.
+    """
+    deadline = request_deadline()
+    service_ids, error = parse_service_ids(request.query_params)
+    if not error:
+        dates, error = parse_dates(request.query_params)
+    if not error:
+        any_stylist, policy, error = parse_any_stylist(request.query_params)
+    if not error:
+        response_format, error = parse_format(request.query_params, any_stylist)
+    if error:
+        return Response({"error": error}, status=400)
+    range_query = is_range_query(request.query_params)
+
+    services = Service.objects.in_bulk(service_ids)
+    missing = [service_id for service_id in service_ids if service_id not in services]
+    if missing:
+        return Response({'message': f"Service matching query does not exist: {', '.join(map(str, missing))}"}, status=404)
+    services = [services[service_id] for service_id in service_ids]
+    duration = sum(service.duration for service in services)
+
+    stylists = stylists_offering_all(service_ids, request.query_params.get('stylist_id'))
+
+    # one set of google calls for the whole combination: each stylist's busy times once, slots for the total duration
+    if response_format == "intervals":
+        results, timed_out = gather_stylists_busy(stylists, dates, with_stale(
+            lambda stylist, busy_by_day: {date: bookable_intervals(duration, busy_by_day[date], date) for date in dates}), deadline)
+    else:
+        busy_by_days, timed_out = gather_stylists_busy(
+            stylists, dates, lambda stylist, busy_by_day: busy_by_day, deadline)
+        results = [None if busy_by_day is None else (slots, busy_by_day.stale)
+                   for slots, busy_by_day in zip(slots_by_day(duration, dates, busy_by_days), busy_by_days)]
+    available = [(stylist, *result) for stylist, result in zip(stylists, results)
+                 if result is not None]
+
+    combination = {"services": service_segments(services), "duration": duration}
+    if response_format == "intervals":
+        return Response({**intervals_response(available, dates, duration, range_query), **combination, **partial_fields(timed_out)})
+    if any_stylist:
+        return Response({**any_stylist_response(available, dates, policy, range_query), **combination, **partial_fields(timed_out)})
+
+    def stylists_on(date):
+        return [{**stylist_info(stylist), "slots": slots[date], **stale_fields(stale, date)}
+                for stylist, slots, stale in available]
+
+    if not range_query:
+        return Response({"date": dates[0], **combination, "stylists": stylists_on(dates[0]), **partial_fields(timed_out)})
+    return Response({
+        "start": dates[0],
+        "end": dates[-1],
+        **combination,
+        "days": [{"date": date, "stylists": stylists_on(date)} for date in dates],
+        **partial_fields(timed_out),
+    })
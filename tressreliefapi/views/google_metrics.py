@@ -0,0 +1,33 @@
+# what this process's google rate limiter and circuit breakers are doing, for dashboards and for checking on a quota problem
+# (queue depth, how often calls had to wait or weren't sent, 429 pauses, which breakers are open)
+# these are internals, so the endpoint wants the GOOGLE_METRICS_TOKEN shared secret (or DEBUG on, if no token is set)
+
+import hmac
+from django.conf import settings
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import BasePermission
+from rest_framework.response import Response
+from tressreliefapi.utils.circuit_breaker import breaker_states
+from tressreliefapi.utils.rate_limit import get_rate_limiter
+
+
+class HasMetricsToken(BasePermission):
+    """ The request sends "Authorization: Bearer <GOOGLE_METRICS_TOKEN>". Without a token configured, only allowed while DEBUG is on."""
+
+    def has_permission(self, request, view):
+        if not settings.GOOGLE_METRICS_TOKEN:
+            return settings.DEBUG
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        return scheme == "Bearer" and hmac.compare_digest(token.encode(), settings.GOOGLE_METRICS_TOKEN.encode())
+
+# GET /metrics/google (Authorization: Bearer <GOOGLE_METRICS_TOKEN>)
+
+
+@api_view(['GET'])
+@permission_classes([HasMetricsToken])
+def google_metrics(request):
+    """ Rate limiter counters (utils/rate_limit.py) and circuit breaker states (utils/circuit_breaker.py). Per process, counted since it started."""
+    return Response({
+        "rate_limit": get_rate_limiter().metrics(),
+        "breakers": breaker_states(),
+    })
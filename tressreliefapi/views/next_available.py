@@ -0,0 +1,66 @@
+# endpoint for "book me the soonest appointment": the first K open slots for a service from a date on, across its stylists (or one stylist)
+# instead of the frontend asking /availability/ date by date until it finds something.
+
+from itertools import islice
+from django.conf import settings
+from django.utils.dateparse import parse_date
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from tressreliefapi.models import Service
+from tressreliefapi.utils.next_available import iter_next_available, salon_today
+from tressreliefapi.utils.stylist_busy import request_deadline
+from tressreliefapi.views.availability import partial_fields, service_stylists
+
+# GET /services/:<service_id>/next-available/?from=YYYY-MM-DD&count=5&stylist_id=:<stylist_id> (all optional)
+
+
+@api_view(['GET'])
+def service_next_available(request, id):
+    """
+    Get the soonest open appointment slots for a service.
+    Query params:
+    - from (optional): first date to search, YYYY-MM-DD. defaults to (and can't be before) today (salon time)
+    - count (optional): how many slots to return, default 1, at most NEXT_AVAILABLE_MAX_COUNT
+    - stylist_id (optional): only this stylist
+    Searches up to NEXT_AVAILABLE_MAX_DAYS days ahead and stops calling google as soon as it has count slots.
+    The search stops at the request deadline (AVAILABILITY_DEADLINE_SEC). Stylists whose calls missed it, or whose search was cut short,
+    are listed in partial / timed_out_stylists like service_availability, and the slots may then not be the soonest ones.
+    """
+    # the clock for AVAILABILITY_DEADLINE_SEC starts now
+    deadline = request_deadline()
+    start_date = salon_today()
+    if request.query_params.get('from'):
+        from_date = parse_date(request.query_params['from'])
+        if not from_date:
+            return Response({"error": "from must be a date (YYYY-MM-DD)."}, status=400)
+        # days before today can't have open slots, don't spend google calls on them
+        start_date = max(from_date, start_date)
+    try:
+        count = int(request.query_params.get('count') or 1)
+    except ValueError:
+        count = 0
+    if not 1 <= count <= settings.NEXT_AVAILABLE_MAX_COUNT:
+        return Response({"error": f"count must be a number from 1 to {settings.NEXT_AVAILABLE_MAX_COUNT}."}, status=400)
+
+    try:
+        service = Service.objects.get(pk=id)
+    except Service.DoesNotExist as ex:
+        return Response({'message': ex.args[0]}, status=404)
+
+    stylists = service_stylists(
+        service, request.query_params.get('stylist_id'))
+    # islice stops pulling from the generator after count slots, so no more days get fetched
+    timed_out = []
+    slots = list(islice(iter_next_available(
+        service, stylists, start_date, deadline=deadline, timed_out=timed_out), count))
+
+    return Response({
+        "from": start_date,
+        "slots": [{
+            "start": start,
+            "end": end,
+            "stylist_id": stylist.id,
+            "stylist_name": stylist.display_name,
+        } for start, end, stylist in slots],
+        **partial_fields(timed_out),
+    })
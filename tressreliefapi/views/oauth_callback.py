@@ -14,6 +14,8 @@ from django.utils import timezone
 from datetime import timedelta
 from tressreliefapi.models.user_info import UserInfo
 from tressreliefapi.models.oauth_credential import OAuthCredential
+from tressreliefapi.utils.google_transport import google_post
+from tressreliefapi.utils.google_utils import cache_access_token
 from rest_framework.decorators import api_view
 from django.shortcuts import redirect
 
@@ -41,7 +43,7 @@ def oauth_google_callback(request):
     # DOCS: https://developers.google.com/identity/protocols/oauth2/web-server#httprest_3
     # https://datatracker.ietf.org/doc/html/rfc6749#section-4.1.3
 
-    token_url = "https://oauth2.googleapis.com/token"
+    token_url = settings.GOOGLE_TOKEN_URL
 
     data = {
         "code": code,  # short-lived authorization code from query param, proves user consented
@@ -53,7 +55,11 @@ def oauth_google_callback(request):
         "grant_type": "authorization_code",  # standard for web apps
     }
 
-    response = requests.post(token_url, data=data)
+    try:
+        # the code only works once, so this call is never retried (a retry would come back invalid_grant and hide the real error)
+        response = google_post(token_url, data=data, retry=False)
+    except requests.RequestException:
+        return Response({"error": "Could not reach Google to exchange code for tokens"}, status=status.HTTP_502_BAD_GATEWAY)
     if response.status_code != 200:
         return Response({"error": "Failed to exchange code for tokens"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -90,6 +96,9 @@ def oauth_google_callback(request):
         }
     )
 
+    # the new token replaces whatever was cached for the stylist (e.g. from a previous connection)
+    cache_access_token(credentials)
+
     # 5. Redirect back to FE
     return redirect("http://localhost:3000/stylists")
 
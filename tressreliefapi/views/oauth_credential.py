@@ -2,6 +2,8 @@ from rest_framework import viewsets
 from rest_framework.permissions import IsAdminUser
 from tressreliefapi.models import OAuthCredential
 from tressreliefapi.serializers.oauth_credential import OAuthCredentialSerializer
+from tressreliefapi.utils.busy_cache import invalidate_upcoming_busy
+from tressreliefapi.utils.google_utils import forget_access_token
 
 
 class OAuthCredentialViewSet(viewsets.ModelViewSet):
@@ -11,3 +13,15 @@ class OAuthCredentialViewSet(viewsets.ModelViewSet):
     queryset = OAuthCredential.objects.all()
     serializer_class = OAuthCredentialSerializer
     permission_classes = []
+
+    # tokens are cached in memory by user (utils/google_utils.py), and busy times per stylist-day (utils/busy_cache.py).
+    # drop both when a credential is edited or removed here: which calendars count may have changed
+    def perform_update(self, serializer):
+        forget_access_token(serializer.instance.user_id)
+        serializer.save()
+        invalidate_upcoming_busy(serializer.instance.user_id)
+
+    def perform_destroy(self, instance):
+        forget_access_token(instance.user_id)
+        instance.delete()
+        invalidate_upcoming_busy(instance.user_id)
@@ -32,6 +32,7 @@ def oauth_google_status(request):
         return Response({
             "connected": True,
             "calendar_id": cred.calendar_id,
+            "busy_calendar_ids": cred.busy_calendar_ids,
             "updated_at": cred.token_expiry
         })
     except OAuthCredential.DoesNotExist:
@@ -3,8 +3,12 @@ from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
-from tressreliefapi.models import UserInfo
+from rest_framework.decorators import action
+from tressreliefapi.models import StylistService, UserInfo
 from tressreliefapi.serializers import UserInfoSerializer
+from tressreliefapi.utils.availability import free_intervals, long_enough_intervals, slice_free_intervals
+from tressreliefapi.utils.stylist_busy import gather_stylists_busy, request_deadline
+from tressreliefapi.views.availability import is_range_query, parse_dates, parse_format, partial_fields, stale_fields, stylist_info
 
 
 class UserInfoView(ViewSet):
@@ -36,3 +40,57 @@ class UserInfoView(ViewSet):
             return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
         serializer = UserInfoSerializer(userinfo)
         return Response(serializer.data)
+
+    # GET /userinfo/:id/availability?date=YYYY-MM-DD (or ?start=YYYY-MM-DD&end=YYYY-MM-DD, &format=intervals)
+    @action(methods=['get'], detail=True)
+    def availability(self, request, pk):
+        """Availability for every service the stylist offers (their profile page), keyed by service.
+        Their busy times are fetched once and turned into free windows once, then sliced for each distinct service duration,
+        instead of one service_availability call (and FreeBusy call) per service.
+        A stylist without a google calendar gets "services": [] (like service_availability leaving them out)."""
+        dates, error = parse_dates(request.query_params)
+        if not error:
+            response_format, error = parse_format(request.query_params, any_stylist=False)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            stylist = UserInfo.objects.get(pk=pk)
+        except UserInfo.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
+        services = [link.service for link in
+                    StylistService.objects.filter(stylist=stylist).select_related("service").order_by("id")]
+        durations = {service.duration for service in services}
+
+        def by_duration(stylist, busy_by_day):
+            # {date: {duration: slots or windows}}. the free windows are worked out once per day, whatever the number of services
+            result = {}
+            for date in dates:
+                free = free_intervals(busy_by_day[date], date)
+                if response_format == "intervals":
+                    result[date] = {duration: long_enough_intervals(duration, free) for duration in durations}
+                else:
+                    result[date] = {duration: slice_free_intervals(duration, free) for duration in durations}
+            return result, busy_by_day.stale
+
+        (result,), timed_out = gather_stylists_busy([stylist], dates, by_duration, request_deadline())
+
+        def services_on(date):
+            if result is None:
+                return []
+            by_day = result[0]
+            return [{"service_id": service.id, "name": service.name, "duration": service.duration,
+                     response_format: by_day[date][service.duration]} for service in services]
+
+        def stale_on(date):
+            return stale_fields(result[1], date) if result is not None else {}
+
+        if not is_range_query(request.query_params):
+            return Response({**stylist_info(stylist), "date": dates[0], "services": services_on(dates[0]),
+                             **stale_on(dates[0]), **partial_fields(timed_out)})
+        return Response({
+            **stylist_info(stylist),
+            "start": dates[0],
+            "end": dates[-1],
+            "days": [{"date": date, "services": services_on(date), **stale_on(date)} for date in dates],
+            **partial_fields(timed_out),
+        })
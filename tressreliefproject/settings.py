@@ -9,7 +9,98 @@ load_dotenv(BASE_DIR / ".env")  # this is the one line that loads my .env
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI")
+# google endpoints, overridable so we can point the server at a local fake google (see benchmarks/fake_google.py)
+GOOGLE_API_BASE_URL = os.getenv(
+    "GOOGLE_API_BASE_URL", "https://www.googleapis.com/calendar/v3")
+GOOGLE_TOKEN_URL = os.getenv(
+    "GOOGLE_TOKEN_URL", "https://oauth2.googleapis.com/token")
+# size of the shared connection pools the google clients keep open (see utils/google_transport.py)
+GOOGLE_HTTP_MAX_CONNECTIONS = int(
+    os.getenv("GOOGLE_HTTP_MAX_CONNECTIONS", "100"))
+# seconds to wait for a connection to google / for google to answer
+GOOGLE_HTTP_CONNECT_TIMEOUT = float(
+    os.getenv("GOOGLE_HTTP_CONNECT_TIMEOUT", "3.05"))
+GOOGLE_HTTP_READ_TIMEOUT = float(os.getenv("GOOGLE_HTTP_READ_TIMEOUT", "10"))
+# how many times to retry a google call that failed with 429/5xx, and the base of the exponential backoff between tries
+GOOGLE_HTTP_RETRIES = int(os.getenv("GOOGLE_HTTP_RETRIES", "3"))
+GOOGLE_HTTP_BACKOFF_SEC = float(os.getenv("GOOGLE_HTTP_BACKOFF_SEC", "0.5"))
+# token buckets every google call waits in (see utils/rate_limit.py): calls per second and burst size for the whole process (google's per-project quota)
+# and per access token (google's per-user quota). 0 turns a bucket off.
+# a call that would wait longer than GOOGLE_RATE_MAX_WAIT_SEC for its turn isn't sent (stale busy times are used instead)
+GOOGLE_RATE_PER_SEC = float(os.getenv("GOOGLE_RATE_PER_SEC", "50"))
+GOOGLE_RATE_BURST = float(os.getenv("GOOGLE_RATE_BURST", "100"))
+GOOGLE_RATE_USER_PER_SEC = float(os.getenv("GOOGLE_RATE_USER_PER_SEC", "5"))
+GOOGLE_RATE_USER_BURST = float(os.getenv("GOOGLE_RATE_USER_BURST", "10"))
+GOOGLE_RATE_MAX_WAIT_SEC = float(os.getenv("GOOGLE_RATE_MAX_WAIT_SEC", "2"))
+# shared secret for GET /metrics/google (rate limiter and breaker internals), sent as "Authorization: Bearer <token>".
+# unset = the endpoint only answers while DEBUG is on
+GOOGLE_METRICS_TOKEN = os.getenv("GOOGLE_METRICS_TOKEN", "")
+# public https url of the calendar webhook (e.g. https://api.example.com/webhooks/google/calendar). google sends push notifications there
+# and availability reads mirrored calendars from the db (see utils/calendar_sync.py). unset = no push channels, FreeBusy on every request
+GOOGLE_WEBHOOK_URL = os.getenv("GOOGLE_WEBHOOK_URL", "")
+# how long a push channel lives before renew_calendar_channels has to open a new one (google caps it, about a week for events)
+GOOGLE_CHANNEL_TTL_SEC = int(os.getenv("GOOGLE_CHANNEL_TTL_SEC", str(7 * 24 * 3600)))
+# appointments are written to the stylists' calendars by the drain_calendar_outbox worker (see utils/calendar_outbox.py), as google batch requests
+# of up to GOOGLE_OUTBOX_BATCH_SIZE calls. a failed write is retried after GOOGLE_OUTBOX_BACKOFF_SEC, doubling each time up to GOOGLE_OUTBOX_MAX_BACKOFF_SEC,
+# and given up on (status failed) after GOOGLE_OUTBOX_MAX_ATTEMPTS tries. a worker has GOOGLE_OUTBOX_LEASE_SEC to send the rows it claimed before another worker may
+GOOGLE_BATCH_URL = os.getenv(
+    "GOOGLE_BATCH_URL", "https://www.googleapis.com/batch/calendar/v3")
+GOOGLE_OUTBOX_BATCH_SIZE = int(os.getenv("GOOGLE_OUTBOX_BATCH_SIZE", "50"))
+GOOGLE_OUTBOX_BACKOFF_SEC = float(os.getenv("GOOGLE_OUTBOX_BACKOFF_SEC", "30"))
+GOOGLE_OUTBOX_MAX_BACKOFF_SEC = float(
+    os.getenv("GOOGLE_OUTBOX_MAX_BACKOFF_SEC", "3600"))
+GOOGLE_OUTBOX_MAX_ATTEMPTS = int(os.getenv("GOOGLE_OUTBOX_MAX_ATTEMPTS", "10"))
+GOOGLE_OUTBOX_LEASE_SEC = int(os.getenv("GOOGLE_OUTBOX_LEASE_SEC", "120"))
+# treat access tokens as expired this many seconds early, so we never start a google call with a token that's about to die
+GOOGLE_TOKEN_EXPIRY_MARGIN_SEC = int(
+    os.getenv("GOOGLE_TOKEN_EXPIRY_MARGIN_SEC", "60"))
+# the refresh_google_tokens command refreshes tokens that expire within this many minutes
+GOOGLE_TOKEN_REFRESH_WINDOW_MIN = int(
+    os.getenv("GOOGLE_TOKEN_REFRESH_WINDOW_MIN", "10"))
+# a worker refreshing a token holds the credential's refresh lock this long at most (other workers, in any process, wait for its token meanwhile).
+# if it dies mid-refresh the next worker takes over once the lock runs out
+GOOGLE_TOKEN_REFRESH_LOCK_SEC = float(
+    os.getenv("GOOGLE_TOKEN_REFRESH_LOCK_SEC", "15"))
+# minutes between the possible start times of a slot, used by every slot engine (SLOT_GRANULARITY_MIN in tressreliefapi/utils/availability.py)
 APPT_SLOT_GRANULARITY_MIN = int(os.getenv("APPT_SLOT_GRANULARITY_MIN", "15"))
+# max number of stylists whose google calls run at the same time, across all availability requests of the process (one shared thread pool,
+# so calls abandoned at a request's deadline can't pile up threads while google is slow)
+AVAILABILITY_MAX_WORKERS = int(os.getenv("AVAILABILITY_MAX_WORKERS", "16"))
+# overall time budget (seconds) of one availability request. stylists whose google calls aren't done by then are left out and reported
+# (partial: true / timed_out_stylists), so the endpoint answers within this no matter how slow google is. 0 = no deadline
+AVAILABILITY_DEADLINE_SEC = float(os.getenv("AVAILABILITY_DEADLINE_SEC", "8"))
+# longest ?start=&end= range the availability endpoint accepts
+AVAILABILITY_MAX_RANGE_DAYS = int(
+    os.getenv("AVAILABILITY_MAX_RANGE_DAYS", "31"))
+# how the availability views and the snapshot builder turn busy times into slots (utils/slot_engine.py): "numpy" (vectorized, utils/availability_np.py)
+# or "python" (utils/availability.py). same slots either way, numpy is >10x faster (benchmarks/bench_slot_engine.py)
+AVAILABILITY_SLOT_ENGINE = os.getenv("AVAILABILITY_SLOT_ENGINE", "numpy")
+# how far ahead (in days) the next-available search looks, and the most slots it returns
+NEXT_AVAILABLE_MAX_DAYS = int(os.getenv("NEXT_AVAILABLE_MAX_DAYS", "60"))
+NEXT_AVAILABLE_MAX_COUNT = int(os.getenv("NEXT_AVAILABLE_MAX_COUNT", "20"))
+# precomputed availability (?source=snapshot, see tressreliefapi/utils/availability_snapshot.py): how many days ahead
+# build_availability_snapshots fills, and how old a row can be before the endpoint computes that stylist live instead
+AVAILABILITY_SNAPSHOT_DAYS = int(os.getenv("AVAILABILITY_SNAPSHOT_DAYS", "14"))
+AVAILABILITY_SNAPSHOT_MAX_AGE_SEC = int(
+    os.getenv("AVAILABILITY_SNAPSHOT_MAX_AGE_SEC", "900"))
+# default order of the stylist ids in ?any=true availability (see tressreliefapi/utils/any_stylist.py)
+AVAILABILITY_ANY_STYLIST_POLICY = os.getenv(
+    "AVAILABILITY_ANY_STYLIST_POLICY", "order")
+# cache of each stylist's google busy times per day (see tressreliefapi/utils/busy_cache.py)
+# backend is "lru" (in-process) or "django" (the CACHES alias below)
+BUSY_CACHE_BACKEND = os.getenv("BUSY_CACHE_BACKEND", "lru")
+BUSY_CACHE_DJANGO_ALIAS = os.getenv("BUSY_CACHE_DJANGO_ALIAS", "default")
+BUSY_CACHE_TTL_SEC = int(os.getenv("BUSY_CACHE_TTL_SEC", "120"))
+BUSY_CACHE_MAX_ENTRIES = int(os.getenv("BUSY_CACHE_MAX_ENTRIES", "5000"))
+# how long the last fetched busy times are kept to fall back on (marked stale) while google is failing
+BUSY_STALE_TTL_SEC = int(os.getenv("BUSY_STALE_TTL_SEC", str(7 * 24 * 3600)))
+# circuit breakers around the google calls (see tressreliefapi/utils/circuit_breaker.py):
+# an endpoint opens after GOOGLE_BREAKER_FAILURES failures in a row, one stylist's calendar after GOOGLE_BREAKER_STYLIST_FAILURES,
+# and an open breaker lets a trial call through after GOOGLE_BREAKER_RESET_SEC seconds
+GOOGLE_BREAKER_FAILURES = int(os.getenv("GOOGLE_BREAKER_FAILURES", "5"))
+GOOGLE_BREAKER_STYLIST_FAILURES = int(
+    os.getenv("GOOGLE_BREAKER_STYLIST_FAILURES", "3"))
+GOOGLE_BREAKER_RESET_SEC = float(os.getenv("GOOGLE_BREAKER_RESET_SEC", "30"))
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 # BASE_DIR = Path(__file__).resolve().parent.parent
@@ -56,6 +147,8 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
     ),
+    # lets ?format=intervals through to the availability views (see tressreliefapi/negotiation.py)
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS': 'tressreliefapi.negotiation.ContentNegotiation',
 }
 
 
@@ -65,6 +158,11 @@ CORS_ORIGIN_WHITELIST = (
     'http://localhost:5173',
     'http://127.0.0.1:5173',
 )
+# let the frontend read the partial-result headers of the single-date availability response (views/availability.py)
+CORS_EXPOSE_HEADERS = (
+    'X-Availability-Partial',
+    'X-Availability-Timed-Out-Stylists',
+)
 
 
 MIDDLEWARE = [
@@ -106,6 +204,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # tests that write from several threads (token refresh locks, the refresh command) need a real file:
+        # sqlite's in-memory test database fails concurrent writers with "database table is locked" instead of making them wait
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -8,6 +8,13 @@ from tressreliefapi.views.stylist_service import StylistServiceLinks
 from tressreliefapi.views.oauth import oauth_google_initiate
 from tressreliefapi.views.oauth_callback import oauth_google_callback
 from tressreliefapi.views.availability import service_availability
+from tressreliefapi.views.availability_async import service_availability_async
+from tressreliefapi.views.next_available import service_next_available
+from tressreliefapi.views.availability_summary import service_availability_summary
+from tressreliefapi.views.google_metrics import google_metrics
+from tressreliefapi.views.calendar_webhook import google_calendar_webhook
+from tressreliefapi.views.appointment import AppointmentView
+from tressreliefapi.views.combined_availability import combined_availability
 
 # The first parameter, r'userinfo, is setting up the url.
 # The second UserInfoView is telling the server which view to use when it sees that url.
@@ -19,6 +26,7 @@ router.register(r'categories', CategoryView, 'category')
 router.register(r'services', ServiceView, 'service')
 router.register(r'oauth-credentials',
                 OAuthCredentialViewSet, 'oauthcredential')
+router.register(r'appointments', AppointmentView, 'appointment')
 
 
 # Each path() in urlpatterns is mapping a URL pattern to a view — which is just the code that runs when someone visits that URL.
@@ -34,4 +42,16 @@ urlpatterns = [
     path("oauth/google/status", oauth_google_status),
     # <int:id> is django syntax for defining an dynamic URL segment that is an integer and will be passed to the view as the parameter 'id'
     path("services/<int:id>/availability/", service_availability),
+    # per-day open slot / stylist counts for a month (calendar picker)
+    path("services/<int:id>/availability/summary/", service_availability_summary),
+    # same endpoint as an async view, for running under ASGI
+    path("services/<int:id>/availability/async/", service_availability_async),
+    # slots for several services done back to back by one stylist (?services=1,2)
+    path("availability/combined/", combined_availability),
+    # soonest open slots from a date on (stops calling google once it has enough)
+    path("services/<int:id>/next-available/", service_next_available),
+    # google rate limiter / circuit breaker metrics of this process
+    path("metrics/google", google_metrics),
+    # google calendar push notifications (keeps the local busy-time mirror up to date)
+    path("webhooks/google/calendar", google_calendar_webhook),
 ]